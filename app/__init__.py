@@ -6,6 +6,10 @@ from flask import Flask
 
 from app.auth.blacklist import blacklist
 from app.auth.jwt import jwt
+from app.auth.keys import key_ring
+from app.auth.middleware import TokenValidationMiddleware
+from app.auth.password import password_hasher
+from app.auth.token_cache import verified_tokens
 from app.models import db, migrate
 from config import config, get_mode_from_env, load_dotenv
 
@@ -25,6 +29,12 @@ def register_blueprints(app):
   app.register_blueprint(api_blueprint, url_prefix='/api/')
 
 
+def init_middlewares(app):
+  if app.config.get('TOKEN_VALIDATION_FAST_PATH', False):
+    app.wsgi_app = TokenValidationMiddleware(app, app.wsgi_app)
+    app.extensions['token_validation'] = app.wsgi_app
+
+
 def create_app():
   mode = get_mode_from_env(logger)
   load_dotenv(mode, logger)
@@ -36,7 +46,11 @@ def create_app():
   app.config.update(config['app'][mode])
   blacklist.init_app(app)
   jwt.init_app(app)
+  key_ring.init_app(app)
+  password_hasher.init_app(app)
+  verified_tokens.init_app(app)
   init_db(app)
   register_blueprints(app)
+  init_middlewares(app)
 
   return app
@@ -5,6 +5,11 @@ Note: Unlike app.views, there's no need to avoid circular import.
 from flask import Blueprint
 from flask_restful import Api
 
+from .v1_0.introspection import TokenIntrospectionApi
+from .v1_0.jwks import JwksApi
+from .v1_0.revocations import RevocationListApi
+from .v1_0.sessions import SessionListApi
+from .v1_0.stats import StatsApi
 from .v1_0.token import TokenApi
 from .v1_0.users import UserApi, UserListApi
 
@@ -13,5 +18,11 @@ api_blueprint = Blueprint('api', __name__)
 api = Api(api_blueprint)
 
 api.add_resource(TokenApi, '/v1_0/token/', endpoint='token')
+api.add_resource(
+    TokenIntrospectionApi, '/v1_0/token/introspect/', endpoint='token_introspection')
 api.add_resource(UserApi, '/v1_0/users/<int:id>/', endpoint='user')
 api.add_resource(UserListApi, '/v1_0/users/', endpoint='users')
+api.add_resource(StatsApi, '/v1_0/stats/', endpoint='stats')
+api.add_resource(SessionListApi, '/v1_0/sessions/', endpoint='sessions')
+api.add_resource(RevocationListApi, '/v1_0/revocations/', endpoint='revocations')
+api.add_resource(JwksApi, '/v1_0/jwks/', endpoint='jwks')
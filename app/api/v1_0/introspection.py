@@ -0,0 +1,74 @@
+import logging
+
+from flask import current_app, jsonify, make_response, request
+from flask_jwt_extended import decode_token, jwt_required
+from flask_restful import Resource
+from http import HTTPStatus
+
+from app.auth.jwt import check_if_tokens_in_blacklist
+from app.utils.exceptions import ApiException
+
+
+logger = logging.getLogger(__name__)
+
+
+def try_decode_token(token):
+  """Return None if token is not valid, whatever the reason is."""
+  try:
+    return decode_token(token)
+  except Exception as e:
+    logger.debug(f'{str(type(e))}: {str(e)}')
+    return None
+
+
+class TokenIntrospectionApi(Resource):
+  """
+  GET: N/A
+  POST: Introspect tokens in body {"tokens": [...]}, in the spirit of RFC 7662.
+        Signature and expiry of each token are verified, and the blacklist is
+        looked up once for all of them. Results are in the order of tokens,
+        {"active": true, <claims>} or {"active": false}.
+  PUT: N/A
+  DELETE: N/A
+  """
+  @jwt_required
+  def post(self):
+    status = HTTPStatus.OK
+    ret = {}
+    error_msg = ''
+
+    try:
+      data = request.get_json()
+      tokens = data.get('tokens') if isinstance(data, dict) else None
+      if not isinstance(tokens, list) or \
+          not all(isinstance(token, str) for token in tokens):
+        msg = 'Tokens must be a list of strings in body.'
+        raise ApiException(msg, status=HTTPStatus.BAD_REQUEST)
+      max_tokens = int(current_app.config.get('INTROSPECTION_MAX_TOKENS', 1000))
+      if len(tokens) > max_tokens:
+        msg = f'Too many tokens. Max is {max_tokens}.'
+        raise ApiException(msg, status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+      claims = [try_decode_token(token) for token in tokens]
+      decoded = [c for c in claims if c is not None]
+      revoked = iter(check_if_tokens_in_blacklist(decoded))
+
+      results = []
+      for c in claims:
+        if c is None or next(revoked):
+          results.append({'active': False})
+        else:
+          results.append({'active': True, **c})
+      ret = {'results': results}
+    except ApiException as e:
+      status = e.status
+      error_msg = str(e)
+    except Exception as e:
+      status = HTTPStatus.INTERNAL_SERVER_ERROR
+      error_msg = f'{str(type(e))}: {str(e)}'
+    finally:
+      if error_msg != '':
+        ret = { 'error': { 'message': error_msg } }
+        logger.error(ret)
+
+    return make_response(jsonify(ret), status)
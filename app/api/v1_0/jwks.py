@@ -0,0 +1,27 @@
+import logging
+
+from flask import jsonify, make_response, request
+from flask_restful import Resource
+from http import HTTPStatus
+
+from app.auth.keys import key_ring
+
+
+logger = logging.getLogger(__name__)
+
+
+class JwksApi(Resource):
+  """
+  GET: Return public keys to verify tokens as JWK Set (RFC 7517).
+       It's cacheable for JWT_JWKS_MAX_AGE seconds, and revalidated by ETag.
+       Keys are empty with a symmetric JWT_ALGORITHM.
+  POST: N/A
+  PUT: N/A
+  DELETE: N/A
+  """
+  def get(self):
+    response = make_response(jsonify(key_ring.jwks()), HTTPStatus.OK)
+    response.cache_control.public = True
+    response.cache_control.max_age = key_ring.max_age
+    response.add_etag()
+    return response.make_conditional(request)
@@ -0,0 +1,80 @@
+import logging
+import struct
+
+from flask import jsonify, make_response, request
+from flask_jwt_extended import jwt_required
+from flask_restful import Resource
+from http import HTTPStatus
+
+from app.auth.blacklist import blacklist
+from app.utils.exceptions import ApiException
+
+
+logger = logging.getLogger(__name__)
+
+# Binary snapshot is MAGIC + sequence(uint64) + count(uint64), followed by
+# count sorted keys of 16 bytes, so that readers can binary search it.
+MAGIC = b'BLKREV01'
+HEADER = struct.Struct('<8sQQ')
+MAX_LIMIT = 10000
+
+
+class RevocationListApi(Resource):
+  """
+  GET: Return snapshot of revoked jtis, or revocations since ?since=sequence.
+       jtis are 16 bytes in hex, see app.auth.feed.
+       Snapshot is returned in binary with ?format=binary.
+  POST: N/A
+  PUT: N/A
+  DELETE: N/A
+  """
+  @jwt_required
+  def get(self):
+    status = HTTPStatus.OK
+    ret = {}
+    error_msg = ''
+
+    try:
+      if blacklist.feed is None:
+        msg = 'Revocation feed is not enabled.'
+        raise ApiException(msg, status=HTTPStatus.NOT_IMPLEMENTED)
+
+      since = request.args.get('since', type=int)
+      if since is not None:
+        limit = request.args.get('limit', MAX_LIMIT, type=int)
+        if since < 0 or not 0 < limit <= MAX_LIMIT:
+          msg = f'since must be >= 0, and limit must be in 1..{MAX_LIMIT}.'
+          raise ApiException(msg, status=HTTPStatus.BAD_REQUEST)
+        sequence, keys, reset = blacklist.feed.since(since, limit)
+        ret = {
+          'sequence': sequence,
+          'jtis': [key.hex() for key in keys],
+          'reset': reset,
+        }
+      else:
+        format = request.args.get('format', 'json')
+        if format not in ['json', 'binary']:
+          msg = f'Not supported format: {format}.'
+          raise ApiException(msg, status=HTTPStatus.BAD_REQUEST)
+        sequence, keys = blacklist.feed_snapshot()
+        if format == 'binary':
+          body = HEADER.pack(MAGIC, sequence, len(keys)) + b''.join(keys)
+          response = make_response(body, status)
+          response.headers['Content-Type'] = 'application/octet-stream'
+          return response
+        ret = {
+          'sequence': sequence,
+          'jtis': [key.hex() for key in keys],
+        }
+    except ApiException as e:
+      status = e.status
+      error_msg = str(e)
+    except Exception as e:
+      status = HTTPStatus.INTERNAL_SERVER_ERROR
+      error_msg = f'{str(type(e))}: {str(e)}'
+    finally:
+      if error_msg != '':
+        ret = { 'error': { 'message': error_msg } }
+        logger.error(ret)
+
+    return make_response(jsonify(ret), status)
@@ -0,0 +1,44 @@
+import logging
+
+from flask import jsonify, make_response
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from flask_restful import Resource
+from http import HTTPStatus
+
+from app.auth.blacklist import blacklist
+from app.utils.exceptions import ApiException
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionListApi(Resource):
+  """
+  GET: N/A
+  POST: N/A
+  PUT: N/A
+  DELETE: Revoke all tokens of the user, including the one in the request.
+  """
+  @jwt_required
+  def delete(self):
+    status = HTTPStatus.OK
+    ret = {}
+    error_msg = ''
+
+    try:
+      if not blacklist.generation_enabled:
+        msg = 'Revoking all sessions is not enabled.'
+        raise ApiException(msg, status=HTTPStatus.NOT_IMPLEMENTED)
+      blacklist.bump_generation(get_jwt_identity())
+    except ApiException as e:
+      status = e.status
+      error_msg = str(e)
+    except Exception as e:
+      status = HTTPStatus.INTERNAL_SERVER_ERROR
+      error_msg = f'{str(type(e))}: {str(e)}'
+    finally:
+      if error_msg != '':
+        ret = { 'error': { 'message': error_msg } }
+        logger.error(ret)
+
+    return make_response(jsonify(ret), status)
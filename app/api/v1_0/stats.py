@@ -0,0 +1,37 @@
+import logging
+
+from flask import current_app, jsonify, make_response
+from flask_jwt_extended import jwt_required
+from flask_restful import Resource
+from http import HTTPStatus
+
+from app.auth.blacklist import blacklist
+from app.auth.password import password_hasher
+from app.auth.token_cache import verified_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+class StatsApi(Resource):
+  """
+  GET: Return runtime stats of the worker which handles the request, if
+       STATS_ENABLED, since they tell hosts of redis nodes and errors.
+  POST: N/A
+  PUT: N/A
+  DELETE: N/A
+  """
+  @jwt_required
+  def get(self):
+    if not current_app.config.get('STATS_ENABLED', False):
+      ret = { 'error': { 'message': 'Stats are not enabled.' } }
+      return make_response(jsonify(ret), HTTPStatus.NOT_FOUND)
+
+    token_validation = current_app.extensions.get('token_validation')
+    ret = {
+      'blacklist': blacklist.stats(),
+      'token_cache': verified_tokens.stats(),
+      'password': password_hasher.stats(),
+      'token_validation': None if token_validation is None else token_validation.stats(),
+    }
+    return make_response(jsonify(ret), HTTPStatus.OK)
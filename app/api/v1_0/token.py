@@ -1,39 +1,41 @@
 import logging
 import os
 
+from concurrent.futures.process import BrokenProcessPool
 from flask import jsonify, make_response, request
 from flask_jwt_extended import create_access_token, create_refresh_token
-from flask_jwt_extended import get_jti, get_jwt_identity, get_raw_jwt
+from flask_jwt_extended import decode_token, get_jwt_identity, get_raw_jwt
 from flask_jwt_extended import jwt_refresh_token_required, jwt_required
 from flask_jwt_extended.config import config
 from flask_restful import Resource
 from http import HTTPStatus
 from jwt.exceptions import ExpiredSignatureError
 from marshmallow import ValidationError, Schema
-from werkzeug.security import check_password_hash
 
 from app.auth.blacklist import blacklist
+from app.auth.password import password_hasher
+from app.models import db
+from app.models.queries import find_user_by_email
 from app.models.user import User, user_schema
-from app.utils.exceptions import ApiException
+from app.utils.exceptions import ApiException, HashingBusy, StorageUnavailable
 
 
 logger = logging.getLogger(__name__)
 
 
-def try_revoke_access_token(token):
+def try_decode_token(token):
+  """Return None if token has expired, since it needs no revocation."""
   try:
-    jti = get_jti(encoded_token=token)
-    blacklist.revoke_access_token(jti)
+    return decode_token(token)
   except ExpiredSignatureError as e:
     logger.warning(f'{str(type(e))}: {str(e)}')
+    return None
 
 
-def try_revoke_refresh_token(token):
-  try:
-    jti = get_jti(encoded_token=token)
-    blacklist.revoke_refresh_token(jti)
-  except ExpiredSignatureError as e:
-    logger.warning(f'{str(type(e))}: {str(e)}')
+def try_revoke_access_token(token):
+  claims = try_decode_token(token)
+  if claims is not None:
+    blacklist.revoke_access_token(claims['jti'], exp=claims['exp'])
 
 
 class RequestSchema:
@@ -65,15 +67,17 @@ class TokenApi(Resource):
         raise ValidationError(errors)
       data = RequestSchema.PostToken().dump(data)
 
-      query = User.query.filter_by(email=data['email'])
-      user = query.first()
+      user = find_user_by_email(data['email'])
 
       if user is None:
         raise ApiException(
             f"User:({data['email']}) not found.",
             status=HTTPStatus.NOT_FOUND)
-      elif not check_password_hash(user.password, data['password']):
+      elif not password_hasher.verify(user.password, data['password']):
         raise ApiException('Wrong password.', status=HTTPStatus.UNAUTHORIZED)
+      password_hasher.rehash(
+          user.password, data['password'],
+          lambda pwhash: self.update_password(user, pwhash))
 
       access_token = create_access_token(identity=user.email)
       refresh_token = create_refresh_token(identity=user.email)
@@ -87,14 +91,23 @@ class TokenApi(Resource):
         'refresh_expires_in': refresh_expires_in,
       }
 
-      self.probate_access_token(token=access_token)
-      self.probate_refresh_token(token=refresh_token)
+      if blacklist.probation_enabled:
+        self.probate_tokens([
+          (access_token, 'access_token'),
+          (refresh_token, 'refresh_token'),
+        ])
     except ValidationError as e:
       status = HTTPStatus.BAD_REQUEST
       error_msg = e.normalized_messages()
     except ApiException as e:
       status = e.status
       error_msg = str(e)
+    except (HashingBusy, BrokenProcessPool) as e:
+      status = HTTPStatus.SERVICE_UNAVAILABLE
+      error_msg = str(e)
+    except StorageUnavailable as e:
+      status = HTTPStatus.SERVICE_UNAVAILABLE
+      error_msg = str(e)
     except Exception as e:
       error_msg = str(e)
       if status == HTTPStatus.OK:
@@ -135,10 +148,14 @@ class TokenApi(Resource):
         msg = 'Access token is not in body.'
         raise ApiException(msg, status=HTTPStatus.BAD_REQUEST)
 
-      self.probate_access_token(token=access_token)
+      if blacklist.probation_enabled:
+        self.probate_access_token(token=access_token)
     except ApiException as e:
       status = e.status
       error_msg = str(e)
+    except StorageUnavailable as e:
+      status = HTTPStatus.SERVICE_UNAVAILABLE
+      error_msg = str(e)
     except Exception as e:
       status = HTTPStatus.INTERNAL_SERVER_ERROR
       error_msg = f'{str(type(e))}: {str(e)}'
@@ -157,36 +174,73 @@ class TokenApi(Resource):
 
     try:
       access_jti = get_raw_jwt()['jti']
+      access_exp = get_raw_jwt()['exp']
 
       refresh_jti = None
+      refresh_exp = None
       if request.json is not None and 'refresh_token' in request.json:
         if len(request.json['refresh_token']) == 0:
           msg = 'Given refresh token is empty.'
           raise ApiException(msg, status=HTTPStatus.BAD_REQUEST)
         refresh_token = request.json['refresh_token']
-        try_revoke_refresh_token(refresh_token)
       else:
         msg = 'Refresh token is not in body.'
         raise ApiException(msg, status=HTTPStatus.BAD_REQUEST)
 
-      blacklist.revoke_access_token(access_jti)
+      tokens = [(access_jti, 'access_token')]
+      exps = [access_exp]
+      refresh_claims = try_decode_token(refresh_token)
+      if refresh_claims is not None:
+        refresh_jti = refresh_claims['jti']
+        refresh_exp = refresh_claims['exp']
+        tokens.append((refresh_jti, 'refresh_token'))
+        exps.append(refresh_exp)
+      blacklist.revoke_many(tokens, exps)
     except ApiException as e:
       status = e.status
       error_msg = str(e)
+    except StorageUnavailable as e:
+      status = HTTPStatus.SERVICE_UNAVAILABLE
+      error_msg = str(e)
     except Exception as e:
       status = HTTPStatus.INTERNAL_SERVER_ERROR
       error_msg = str(e)
     finally:
+      # Tokens are not reverted while storage is unavailable, since it would
+      # fail as well. Those already revoked stay revoked, which is safe.
       if error_msg != '':
-        if 'access_jti' in locals():
-          blacklist.probate_access_token(access_jti)
-        if 'refresh_jti' in locals() and refresh_jti is not None:
-          blacklist.probate_refresh_token(refresh_jti)
+        if status != HTTPStatus.SERVICE_UNAVAILABLE:
+          if 'access_exp' in locals():
+            self.unrevoke_access_token(access_jti, access_exp)
+          if 'refresh_jti' in locals() and refresh_jti is not None:
+            self.unrevoke_refresh_token(refresh_jti, refresh_exp)
         ret = { 'error': { 'message': error_msg } }
         logger.error(ret)
 
     return make_response(jsonify(ret), status)
 
+  def update_password(self, user, pwhash):
+    """Skipped if password was changed since it was read."""
+    try:
+      User.query.filter_by(id=user.id, password=user.password)\
+          .update({'password': pwhash}, synchronize_session=False)
+      db.session.commit()
+    except Exception:
+      db.session.rollback()
+      raise
+
+  def unrevoke_access_token(self, jti, exp=None):
+    if blacklist.probation_enabled:
+      blacklist.probate_access_token(jti, exp=exp)
+    else:
+      blacklist.delete(jti, exp=exp)
+
+  def unrevoke_refresh_token(self, jti, exp=None):
+    if blacklist.probation_enabled:
+      blacklist.probate_refresh_token(jti, exp=exp)
+    else:
+      blacklist.delete(jti, exp=exp)
+
   def probate_access_token(self, token):
     self.probate_token(token, token_type_hint='access_token')
 
@@ -194,16 +248,24 @@ class TokenApi(Resource):
     self.probate_token(token, token_type_hint='refresh_token')
 
   def probate_token(self, token, token_type_hint):
-    jti = get_jti(encoded_token=token)
-    if blacklist.has_as_key(jti):
-      raise ApiException(
-          f'Given {token_type_hint}:{jti} is already in blacklist.',
-          status=HTTPStatus.UNAUTHORIZED)
-
-    if token_type_hint == 'access_token':
-      blacklist.probate_access_token(jti)
-    elif token_type_hint == 'refresh_token':
-      blacklist.probate_refresh_token(jti)
-    else:
-      msg = f'Unknown token{token_type_hint} is given.'
-      raise ValueError(msg)
+    self.probate_tokens([(token, token_type_hint)])
+
+  def probate_tokens(self, tokens):
+    """
+    tokens is list of (token, token_type_hint).
+    Tokens are probated only if they are not in blacklist yet, atomically
+    and in one batch.
+    """
+    claims = [decode_token(token) for token, _ in tokens]
+    tokens = [(c['jti'], hint) for c, (_, hint) in zip(claims, tokens)]
+    for _, token_type_hint in tokens:
+      if token_type_hint not in ['access_token', 'refresh_token']:
+        msg = f'Unknown token{token_type_hint} is given.'
+        raise ValueError(msg)
+
+    existed = blacklist.probate_many_if_absent(tokens, [c['exp'] for c in claims])
+    for (jti, token_type_hint), exists in zip(tokens, existed):
+      if exists:
+        raise ApiException(
+            f'Given {token_type_hint}:{jti} is already in blacklist.',
+            status=HTTPStatus.UNAUTHORIZED)
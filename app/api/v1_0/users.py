@@ -1,17 +1,19 @@
 import json
 import logging
 
+from concurrent.futures.process import BrokenProcessPool
 from flask import jsonify, make_response, request
 from flask_jwt_extended import jwt_required
 from flask_restful import Resource
 from http import HTTPStatus
 from marshmallow import ValidationError, Schema
-from werkzeug.security import generate_password_hash
 
+from app.auth.password import password_hasher
 from app.models import db
+from app.models.queries import find_user_by_id
 from app.models.user import User, user_schema
 from app.api.utils import get_url
-from app.utils.exceptions import ApiException
+from app.utils.exceptions import ApiException, HashingBusy
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +70,7 @@ class UserListApi(Resource):
         raise ApiException(
           f"Email:{data['email']} is already used.", status=HTTPStatus.CONFLICT)
 
-      data['password'] = generate_password_hash(data['password'])
+      data['password'] = password_hasher.hash(data['password'])
       user = User(**data)
       db.session.add(user)
       db.session.commit()
@@ -80,6 +82,9 @@ class UserListApi(Resource):
     except ApiException as e:
       status = e.status
       error_msg = str(e)
+    except (HashingBusy, BrokenProcessPool) as e:
+      status = HTTPStatus.SERVICE_UNAVAILABLE
+      error_msg = str(e)
     except Exception as e:
       error_msg = f'{type(e)} : {str(e)} '
       if status == HTTPStatus.CREATED:
@@ -109,8 +114,7 @@ class UserApi(Resource):
     error_msg = ''
 
     try:
-      query = User.query.filter_by(id=id)
-      user = query.first()
+      user = find_user_by_id(id)
       if not user:
         raise ApiException(
           f'User ID:{id} was not found.', status=HTTPStatus.NOT_FOUND)
@@ -1,24 +1,78 @@
+import atexit
+import calendar
+import datetime
+import hashlib
+import heapq
+import itertools
 import logging
 import redis
+import threading
+import time
+import uuid
 from collections import namedtuple
-from sqlalchemy import func
-
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.auth import journal, shared_table
+from app.auth.breaker import CircuitBreaker
+from app.auth.broadcast import DatabaseBroadcast, RedisBroadcast
+from app.auth.cache import LocalCache
+from app.auth.feed import DatabaseFeed, MemoryFeed, RedisFeed
+from app.auth.filter import BloomFilter
+from app.auth.journal import Journal
+from app.auth.ring import HashRing
+from app.auth.shared_table import SharedHashTable
 from app.models import db
+from app.models.queries import CompiledStatement
 from app.models.revoked_token import RevokedToken
+from app.models.token_generation import TokenGeneration
+from app.utils.exceptions import StorageFull, StorageLocked, StorageUnavailable
 
 
 logger = logging.getLogger(__name__)
 
 __BlacklistStorage = namedtuple('BlacklistStorage', ['types'])
-BlacklistStorage = __BlacklistStorage(['memory', 'redis', 'database'])
+BlacklistStorage = __BlacklistStorage(
+    ['memory', 'redis', 'database', 'shared_memory'])
+
+__BlacklistFallback = namedtuple('BlacklistFallback', ['types'])
+BlacklistFallback = __BlacklistFallback(['fail_closed', 'fail_open', 'local'])
+
+# Errors meaning storage is unreachable or too slow, which open the circuit.
+UNAVAILABLE_ERRORS = (
+    redis.ConnectionError, redis.TimeoutError, OperationalError, PoolTimeoutError)
+
+
+def fill_exps(exps, count):
+  return [None] * count if exps is None else exps
+
+
+def jti_to_bytes(jti):
+  """
+  Return jti as 16 bytes. UUID is packed, and any other string is hashed.
+  """
+  if isinstance(jti, bytes):
+    return jti
+  try:
+    return uuid.UUID(jti).bytes
+  except ValueError:
+    return hashlib.blake2b(jti.encode(), digest_size=16).digest()
 
 
 class Storage:
+  """
+  exp of each method is the exp claim of the token, i.e. unix time at which
+  it expires, and exps is list of them for batch methods. Storages which
+  find jti by it, like RedisBucketStorage, require it and the others
+  ignore it.
+  """
   def init_app(self, app):
     msg = self.get_error_msg('init_app')
     raise NotImplementedError(msg)
 
-  def get(self, jti):
+  def get(self, jti, exp=None):
     """
     Return None if not exists in list.
     Return True if exists revoked, and False if exists but not revoked.
@@ -26,23 +80,77 @@ class Storage:
     msg = self.get_error_msg('get')
     raise NotImplementedError(msg)
 
-  def probate_access_token(self, jti):
+  def probate_access_token(self, jti, exp=None):
     msg = self.get_error_msg('probate_access_token')
     raise NotImplementedError(msg)
 
-  def probate_refresh_token(self, jti):
+  def probate_refresh_token(self, jti, exp=None):
     msg = self.get_error_msg('probate_refresh_token')
     raise NotImplementedError(msg)
 
-  def revoke_access_token(self, jti):
+  def revoke_access_token(self, jti, exp=None):
     msg = self.get_error_msg('revoke_access_token')
     raise NotImplementedError(msg)
 
-  def revoke_refresh_token(self, jti):
+  def revoke_refresh_token(self, jti, exp=None):
     msg = self.get_error_msg('revoke_refresh_token')
     raise NotImplementedError(msg)
 
-  def delete(self, jti):
+  def get_many(self, jtis, exps=None):
+    """Return list of what get returns for each jti."""
+    return [self.get(jti, exp) for jti, exp in zip(jtis, fill_exps(exps, len(jtis)))]
+
+  def probate_many(self, tokens, exps=None):
+    """tokens is list of (jti, token_type_hint)."""
+    for (jti, token_type_hint), exp in zip(tokens, fill_exps(exps, len(tokens))):
+      if token_type_hint == 'access_token':
+        self.probate_access_token(jti, exp)
+      else:
+        self.probate_refresh_token(jti, exp)
+
+  def revoke_many(self, tokens, exps=None):
+    """tokens is list of (jti, token_type_hint)."""
+    for (jti, token_type_hint), exp in zip(tokens, fill_exps(exps, len(tokens))):
+      if token_type_hint == 'access_token':
+        self.revoke_access_token(jti, exp)
+      else:
+        self.revoke_refresh_token(jti, exp)
+
+  def probate_if_absent(self, jti, token_type_hint, exp=None):
+    """
+    Probate token only if jti doesn't exist in list, atomically.
+    Return True if jti already existed.
+    """
+    return self.probate_many_if_absent([(jti, token_type_hint)], [exp])[0]
+
+  def probate_many_if_absent(self, tokens, exps=None):
+    """
+    tokens is list of (jti, token_type_hint). Return list of what
+    probate_if_absent returns for each token.
+    This fallback is not atomic. Derived classes should override it.
+    """
+    exps = fill_exps(exps, len(tokens))
+    entries = self.get_many([t[0] for t in tokens], exps)
+    existed = [entry is not None for entry in entries]
+    absent = [i for i, e in enumerate(existed) if not e]
+    self.probate_many([tokens[i] for i in absent], [exps[i] for i in absent])
+    return existed
+
+  def get_generation(self, identity):
+    """Return generation of tokens of identity, which is 0 until bumped."""
+    msg = self.get_error_msg('get_generation')
+    raise NotImplementedError(msg)
+
+  def get_generation_many(self, identities):
+    """Return list of what get_generation returns for each identity."""
+    return [self.get_generation(identity) for identity in identities]
+
+  def bump_generation(self, identity):
+    """Increment generation of identity atomically, and return the new one."""
+    msg = self.get_error_msg('bump_generation')
+    raise NotImplementedError(msg)
+
+  def delete(self, jti, exp=None):
     msg = self.get_error_msg('delete')
     raise NotImplementedError(msg)
 
@@ -50,48 +158,476 @@ class Storage:
     msg = self.get_error_msg('flushall')
     raise NotImplementedError(msg)
 
+  def scan(self):
+    """
+    Iterate all entries as tuples of (jti, revoked, expires_at).
+    expires_at is unix time at which the entry expires.
+    """
+    msg = self.get_error_msg('scan')
+    raise NotImplementedError(msg)
+
+  def restore_many(self, entries):
+    """
+    entries is list of (jti, revoked, expires_at) as scan yields them.
+    Store each to expire at expires_at, unless jti already exists.
+    """
+    msg = self.get_error_msg('restore_many')
+    raise NotImplementedError(msg)
+
+  def scan_generations(self):
+    """Iterate generations which were bumped, as tuples of (identity, generation)."""
+    msg = self.get_error_msg('scan_generations')
+    raise NotImplementedError(msg)
+
+  def restore_generations(self, generations):
+    """
+    generations is list of (identity, generation) as scan_generations yields
+    them. Store each unless generation of identity already exists.
+    """
+    msg = self.get_error_msg('restore_generations')
+    raise NotImplementedError(msg)
+
+  def stats(self):
+    """Return stats specific to storage, or None."""
+    return None
+
   def get_error_msg(self, method):
     msg = f'{method} must be called from derived class of BlacklistImpl.'
     return msg
 
 
 class MemoryStorage(Storage):
+  """
+  Entries expire like RedisStorage, i.e. JWT_XXXX_TOKEN_EXPIRES * 1.2.
+  Expired entries are dropped incrementally on each write by popping at most
+  MEMORY_STORAGE_EXPIRE_BATCH entries from a heap ordered by expiry, so there
+  is no full sweep. When MEMORY_STORAGE_MAX_ENTRIES is reached,
+  MEMORY_STORAGE_EVICTION_POLICY decides what happens.
+  - volatile-ttl : Evict the probated entry which expires soonest. Revoked
+    entries are never evicted, since the token would be valid again, so
+    the write is refused by raising StorageFull if no probated entry is left.
+  - noeviction : Refuse the write by raising StorageFull.
+
+  If MEMORY_STORAGE_PATH is set, writes are journaled to files there and
+  the blacklist is reloaded from them on startup. See app.auth.journal.
+  Entries of the snapshot loaded on startup, base, are looked up where it's
+  mapped instead of being copied into storage, which holds only the entries
+  written since and takes precedence. Entries of base which were written,
+  deleted or evicted since are in hidden until they expire. base is sorted
+  by expiry, so it's expired and evicted by moving cursors over it.
+  Each worker has its own blacklist in memory, so with GUNICORN_WORKERS > 1,
+  each takes its own journal of MEMORY_STORAGE_PATH.{n} (see open_journal).
+  """
+  eviction_policies = ['volatile-ttl', 'noeviction']
+
   def __init__(self):
     self.storage = dict()
-    msg = """Blacklist to store revoked token is stored in memory with current config. Once the server is down, whole blacklist is gone. If you'd like to persist blacklist, use redis as storage."""
-    logger.warning(msg)
+    self.expiry = []
+    self.probations = []
+    self.generations = dict()
+    self.lock = threading.Lock()
+    self.journal = None
+    self.reset_base(None, 0.0)
 
   def init_app(self, app):
-    pass
+    self.access_token_expires = int(app.config['JWT_ACCESS_TOKEN_EXPIRES']*1.2)
+    self.refresh_token_expires = int(app.config['JWT_REFRESH_TOKEN_EXPIRES']*1.2)
+    self.max_entries = int(app.config.get('MEMORY_STORAGE_MAX_ENTRIES', 0))
+    self.expire_batch = int(app.config.get('MEMORY_STORAGE_EXPIRE_BATCH', 16))
+    self.eviction_policy = app.config.get(
+        'MEMORY_STORAGE_EVICTION_POLICY', 'volatile-ttl')
+    if self.eviction_policy not in self.eviction_policies:
+      msg = f'Not supported eviction policy: {self.eviction_policy}.'
+      raise ValueError(msg)
 
-  def get(self, jti):
-    if jti not in self.storage:
+    path = app.config.get('MEMORY_STORAGE_PATH')
+    if path is None:
+      msg = """Blacklist to store revoked token is stored in memory with current config. Once the server is down, whole blacklist is gone. If you'd like to persist blacklist, set MEMORY_STORAGE_PATH or use redis as storage."""
+      logger.warning(msg)
+      return
+
+    self.fsync_interval = float(app.config.get('MEMORY_STORAGE_FSYNC_INTERVAL', 1.0))
+    self.snapshot_interval = float(
+        app.config.get('MEMORY_STORAGE_SNAPSHOT_INTERVAL', 60 * 60))
+    self.journal = self.open_journal(path, int(app.config.get('GUNICORN_WORKERS', 1)))
+    started_at = time.time()
+    with self.lock:
+      self.reset_base(self.journal.load_snapshot(), started_at)
+      self.generations = dict() if self.base is None else self.base.generations()
+      for record in self.journal.replay():
+        self.replay(*record)
+    self.snapshot_at = time.time()
+    logger.info(f'Blacklist of {self.count()} tokens was loaded from '
+                f'{self.journal.snapshot_path} in {self.snapshot_at - started_at:.3f} seconds.')
+
+    thread = threading.Thread(target=self.run_journal, daemon=True)
+    thread.start()
+    atexit.register(self.journal.flush)
+
+  def open_journal(self, path, workers):
+    """
+    Journal is locked by the process using it, and gunicorn workers don't
+    share one, so each worker takes the first of path.0 ... path.{workers - 1}
+    not locked by another. A worker restarted by gunicorn takes over the
+    journal of the one it replaces, once that one has exited.
+    """
+    if workers <= 1:
+      return Journal(path, self.fsync_interval)
+
+    for n in range(workers):
+      try:
+        return Journal(f'{path}.{n}', self.fsync_interval)
+      except StorageLocked:
+        continue
+    msg = f'Journals of all {workers} workers at {path} are used by other processes.'
+    raise StorageLocked(msg)
+
+  def run_journal(self):
+    """Flush journal every fsync_interval and take snapshot every snapshot_interval."""
+    while True:
+      time.sleep(max(self.fsync_interval, 0.1))
+      try:
+        self.journal.flush()
+        if self.snapshot_interval > 0 and \
+            time.time() - self.snapshot_at >= self.snapshot_interval:
+          self.snapshot()
+      except Exception as e:
+        logger.error(f'Failed to write blacklist journal. {type(e)}: {str(e)}')
+
+  def snapshot(self):
+    """Blacklist is copied with lock held, and written without it not to block writes."""
+    with self.lock:
+      position = self.journal.position()
+      entries = self.storage.copy()
+      base, hidden = self.base, set(self.hidden)
+      generations = dict(self.generations)
+    self.journal.snapshot(
+        self.alive(entries, base, hidden, time.time()), generations, position)
+    self.snapshot_at = time.time()
+
+  def get(self, jti, exp=None):
+    entry = self.storage.get(jti)
+    if entry is None:
+      base = self.base
+      if base is None or jti in self.hidden:
+        return None
+      n = base.find(jti)
+      if n is None:
+        return None
+      revoked, expires_at = base.entry(n)
+      return revoked if expires_at > time.time() else None
+
+    revoked, expires_at = entry
+    if expires_at <= time.time():
+      with self.lock:
+        if self.storage.get(jti) == entry:
+          self.storage.pop(jti)
       return None
-    else:
-      return self.storage[jti]
+    return revoked
 
-  def probate_access_token(self, jti):
-    self.storage[jti] = False
+  def probate_access_token(self, jti, exp=None):
+    self.set(jti, False, self.access_token_expires)
 
-  def probate_refresh_token(self, jti):
-    self.storage[jti] = False
+  def probate_refresh_token(self, jti, exp=None):
+    self.set(jti, False, self.refresh_token_expires)
 
-  def revoke_access_token(self, jti):
-    self.storage[jti] = True
+  def revoke_access_token(self, jti, exp=None):
+    self.set(jti, True, self.access_token_expires)
 
-  def revoke_refresh_token(self, jti):
-    self.storage[jti] = True
+  def revoke_refresh_token(self, jti, exp=None):
+    self.set(jti, True, self.refresh_token_expires)
 
-  def delete(self, jti):
-    self.storage.pop(jti)
+  def probate_many(self, tokens, exps=None):
+    self.set_many([(jti, False, self.expires(hint)) for jti, hint in tokens])
+
+  def revoke_many(self, tokens, exps=None):
+    self.set_many([(jti, True, self.expires(hint)) for jti, hint in tokens])
+
+  def probate_many_if_absent(self, tokens, exps=None):
+    entries = [(jti, False, self.expires(hint)) for jti, hint in tokens]
+    return self.set_many(entries, if_absent=True)
+
+  def expires(self, token_type_hint):
+    if token_type_hint == 'access_token':
+      return self.access_token_expires
+    return self.refresh_token_expires
+
+  def set(self, jti, revoked, expires):
+    self.set_many([(jti, revoked, expires)])
+
+  def set_many(self, entries, if_absent=False):
+    """
+    If if_absent is True, entries whose jti exists are skipped.
+    Return list of whether jti existed for each entry.
+    """
+    existed = []
+    with self.lock:
+      now = time.time()
+      self.expire(now)
+      for jti, revoked, expires in entries:
+        entry = self.lookup(jti)
+        exists = entry is not None and entry[1] > now
+        existed.append(exists)
+        if exists and if_absent:
+          continue
+        if entry is None and self.is_full():
+          self.evict()
+
+        expires_at = now + expires
+        self.put(jti, revoked, expires_at)
+        if self.journal is not None:
+          self.journal.append(journal.SET, jti, revoked, expires_at)
+      self.compact()
+    return existed
+
+  def get_generation(self, identity):
+    return self.generations.get(identity, 0)
+
+  def get_generation_many(self, identities):
+    return [self.generations.get(identity, 0) for identity in identities]
+
+  def bump_generation(self, identity):
+    with self.lock:
+      generation = self.generations.get(identity, 0) + 1
+      self.generations[identity] = generation
+      if self.journal is not None:
+        self.journal.append(journal.GENERATION, identity, expires_at=generation)
+    return generation
+
+  def delete(self, jti, exp=None):
+    if self.journal is None:
+      self.storage.pop(jti, None)
+      return
+
+    with self.lock:
+      if self.remove(jti):
+        self.journal.append(journal.DELETE, jti)
 
   def flushall(self):
+    with self.lock:
+      self.clear()
+      if self.journal is not None:
+        self.journal.append(journal.FLUSH)
+
+  def scan(self):
+    with self.lock:
+      entries = self.storage.copy()
+      base, hidden = self.base, set(self.hidden)
+    yield from self.alive(entries, base, hidden, time.time())
+
+  def alive(self, entries, base, hidden, now):
+    """Iterate (jti, revoked, expires_at) of copies of storage and hidden, and base."""
+    for jti, (revoked, expires_at) in entries.items():
+      if expires_at > now:
+        yield jti, revoked, expires_at
+    if base is None:
+      return
+    for n in range(base.first_alive(now), base.count):
+      jti = base.key(n)
+      if jti not in hidden:
+        yield (jti, *base.entry(n))
+
+  def restore_many(self, entries):
+    now = time.time()
+    self.set_many(
+        [(jti, revoked, expires_at - now) for jti, revoked, expires_at in entries],
+        if_absent=True)
+
+  def scan_generations(self):
+    yield from list(self.generations.items())
+
+  def restore_generations(self, generations):
+    with self.lock:
+      for identity, generation in generations:
+        if identity in self.generations:
+          continue
+        self.generations[identity] = generation
+        if self.journal is not None:
+          self.journal.append(journal.GENERATION, identity, expires_at=generation)
+
+  def count(self):
+    """Number of entries, including expired ones not dropped yet."""
+    return len(self.storage) + self.base_alive
+
+  def is_full(self):
+    return self.max_entries > 0 and self.count() >= self.max_entries
+
+  def reset_base(self, base, now):
+    """
+    base_expired is cursor of base before which entries were expired, and
+    base_alive is the number of entries of base after it which are not hidden.
+    """
+    self.base = base
+    self.hidden = set()
+    self.base_expired = 0 if base is None else base.first_alive(now)
+    self.base_evicted = self.base_expired
+    self.base_alive = 0 if base is None else base.count - self.base_expired
+
+  def replay(self, op, jti, revoked, value):
+    """Apply record of journal. Must be called with lock."""
+    if op == journal.SET:
+      self.put(jti, revoked, value)
+    elif op == journal.DELETE:
+      self.remove(jti)
+    elif op == journal.FLUSH:
+      self.clear()
+    elif op == journal.GENERATION:
+      self.generations[jti] = int(value)
+
+  def lookup(self, jti):
+    """Return (revoked, expires_at) of jti, or None. Must be called with lock."""
+    entry = self.storage.get(jti)
+    if entry is not None or self.base is None or jti in self.hidden:
+      return entry
+    n = self.base.find(jti)
+    if n is None or n < self.base_expired:
+      return None
+    return self.base.entry(n)
+
+  def put(self, jti, revoked, expires_at):
+    """Must be called with lock."""
+    if jti not in self.storage:
+      self.hide(jti)
+    self.storage[jti] = (revoked, expires_at)
+    heapq.heappush(self.expiry, (expires_at, jti))
+    if not revoked:
+      heapq.heappush(self.probations, (expires_at, jti))
+
+  def remove(self, jti):
+    """Return True if jti existed. Must be called with lock."""
+    removed = self.storage.pop(jti, None) is not None
+    hidden = self.hide(jti)
+    return removed or hidden
+
+  def hide(self, jti):
+    """Hide entry of jti in base. Return True if it existed. Must be called with lock."""
+    if self.base is None or jti in self.hidden:
+      return False
+    n = self.base.find(jti)
+    if n is None or n < self.base_expired:
+      return False
+    self.hidden.add(jti)
+    self.base_alive -= 1
+    return True
+
+  def clear(self):
+    """Must be called with lock."""
     self.storage = dict()
+    self.expiry = []
+    self.probations = []
+    self.generations = dict()
+    self.reset_base(None, 0.0)
+
+  def expire(self, now):
+    """Drop at most expire_batch expired entries. Must be called with lock."""
+    base = self.base
+    for _ in range(self.expire_batch):
+      if self.expiry and self.expiry[0][0] <= now:
+        self.pop_expiry()
+      elif base is not None and self.base_expired < base.count and \
+          base.values[self.base_expired] <= now:
+        self.expire_base()
+      else:
+        break
+
+  def expire_base(self):
+    """Move cursor of expiry over base by one entry. Must be called with lock."""
+    n = self.base_expired
+    self.base_expired += 1
+    if self.hidden:
+      jti = self.base.key(n)
+      if jti in self.hidden:
+        # Hidden entries were not counted already, and need no hiding once expired.
+        self.hidden.discard(jti)
+        return
+    self.base_alive -= 1
+
+  def evict(self):
+    """Make room for one entry by evicting a probated one. Must be called with lock."""
+    if self.eviction_policy == 'volatile-ttl':
+      # Entry may have been revoked, overwritten or dropped after pushed.
+      while self.probations and \
+          self.storage.get(self.probations[0][1]) != (False, self.probations[0][0]):
+        heapq.heappop(self.probations)
+      n = self.next_base_probation()
+
+      jti = None
+      if self.probations and (n is None or self.probations[0][0] <= self.base.values[n]):
+        _, jti = heapq.heappop(self.probations)
+        self.storage.pop(jti)
+      elif n is not None:
+        jti = self.base.key(n)
+        self.hide(jti)
+      if jti is not None:
+        # Unlike expired ones, evicted entry would be alive again on reload.
+        if self.journal is not None:
+          self.journal.append(journal.DELETE, jti)
+        return
+
+    msg = f'Blacklist reached MEMORY_STORAGE_MAX_ENTRIES({self.max_entries}).'
+    if self.eviction_policy == 'volatile-ttl':
+      msg += ' All of them are revoked, which are never evicted.'
+    raise StorageFull(msg)
+
+  def next_base_probation(self):
+    """
+    Return number of the probated entry of base which expires soonest, or
+    None. Must be called with lock.
+    """
+    base = self.base
+    if base is None:
+      return None
+    self.base_evicted = max(self.base_evicted, self.base_expired)
+    while self.base_evicted < base.count:
+      n = self.base_evicted
+      revoked, _ = base.entry(n)
+      if not revoked and (not self.hidden or base.key(n) not in self.hidden):
+        return n
+      self.base_evicted += 1
+    return None
+
+  def pop_expiry(self):
+    """
+    Pop the head of expiry heap and delete its entry unless it was
+    overwritten after pushed. Return jti of the deleted entry, or None.
+    """
+    expires_at, jti = heapq.heappop(self.expiry)
+    entry = self.storage.get(jti)
+    if entry is not None and entry[1] == expires_at:
+      self.storage.pop(jti)
+      return jti
+    return None
+
+  def compact(self):
+    """
+    Overwritten or deleted entries leave stale items in heaps.
+    Rebuild them once they dominate, which is amortized O(1) per write.
+    """
+    if len(self.expiry) + len(self.probations) <= 2 * max(len(self.storage), 1024):
+      return
+    self.expiry = [(v[1], k) for k, v in self.storage.items()]
+    heapq.heapify(self.expiry)
+    self.probations = [(v[1], k) for k, v in self.storage.items() if not v[0]]
+    heapq.heapify(self.probations)
 
 
 class RedisStorage(Storage):
+  """
+  Keys are spread over REDIS_NODES by consistent hashing, or all stored in
+  REDIS_HOST if REDIS_NODES is empty. Batch operations send one pipeline
+  per node. Errors of each node are counted, and a node is reported unhealthy
+  from its failure until its next success. A key is never moved to another
+  node on failure, since it would be missed once the node is back.
+  Every key starts with REDIS_KEY_PREFIX, so flushall removes only the keys
+  of blacklist, with SCAN and UNLINK in batches not to block redis. With the
+  empty prefix, which keys of older versions have, keys of blacklist can't be
+  told from the others, so flushall runs FLUSHDB as older versions did.
+  """
   def __init__(self):
     self.storage = None
+    self.nodes = dict()
+    self.ring = None
+    self.health = dict()
 
   def init_app(self, app):
     host = app.config['REDIS_HOST']
@@ -99,67 +635,567 @@ class RedisStorage(Storage):
     port = app.config['REDIS_PORT']
     db = app.config['REDIS_DB_INDEX']
 
-    self.storage = redis.StrictRedis(host=host, port=port, db=db, password=password)
+    timeout = app.config.get('BLACKLIST_STORAGE_TIMEOUT')
+    timeouts = {'socket_timeout': timeout, 'socket_connect_timeout': timeout}
+    urls = app.config.get('REDIS_NODES', [])
+    if urls:
+      clients = [redis.StrictRedis.from_url(url, **timeouts) for url in urls]
+    else:
+      clients = [redis.StrictRedis(
+          host=host, port=port, db=db, password=password, **timeouts)]
+
+    self.nodes = {self.node_name(client): client for client in clients}
+    self.ring = HashRing(
+        self.nodes.keys(), replicas=int(app.config.get('REDIS_NODE_REPLICAS', 160)))
+    self.health = {node: RedisNodeHealth() for node in self.nodes}
+    self.storage = clients[0]
     self.access_token_expires = int(app.config['JWT_ACCESS_TOKEN_EXPIRES']*1.2)
     self.refresh_token_expires = int(app.config['JWT_REFRESH_TOKEN_EXPIRES']*1.2)
+    self.binary_jti = app.config.get('BLACKLIST_BINARY_JTI', False)
+    self.prefix = app.config.get('REDIS_KEY_PREFIX', '')
+    self.prefix_bytes = self.prefix.encode()
+
+  def node_name(self, client):
+    """Name is the place of node on the ring, so it must not change over restart."""
+    kwargs = client.connection_pool.connection_kwargs
+    return f"{kwargs.get('host')}:{kwargs.get('port')}/{kwargs.get('db', 0)}"
+
+  def call(self, node, command, *args, **kwargs):
+    """Run command on node, tracking health of the node."""
+    health = self.health[node]
+    try:
+      ret = command(*args, **kwargs)
+    except redis.RedisError as e:
+      health.fail(e)
+      raise
+    health.succeed()
+    return ret
 
-  def get(self, jti):
-    entry = self.storage.get(jti)
+  def key(self, name):
+    """Return redis key of name, which is jti or other name like generation:{identity}."""
+    if isinstance(name, bytes):
+      return self.prefix_bytes + name
+    return self.prefix + name
+
+  def pattern(self, match):
+    """Return SCAN pattern of keys starting with prefix and followed by match."""
+    escaped = ''.join('\\' + c if c in '*?[]\\' else c for c in self.prefix)
+    return escaped + match
+
+  def run(self, name, method, *args, **kwargs):
+    """Run method on key of name. Node is chosen by name, not to move with prefix."""
+    return self.run_on(name, method, self.key(name), *args, **kwargs)
+
+  def run_on(self, jti, method, *args, **kwargs):
+    """Run method on the node which jti belongs to."""
+    node = self.ring.get(jti)
+    command = getattr(self.nodes[node], method)
+    return self.call(node, command, *args, **kwargs)
+
+  def run_pipelines(self, keys, build):
+    """
+    Group keys by node and run one pipeline per node. build(pipeline, i) adds
+    commands for keys[i]. Return results in the order of keys, which are
+    tuples if build adds more than one command.
+    """
+    results = [None] * len(keys)
+    for node, indexes in self.ring.group(keys).items():
+      pipeline = self.nodes[node].pipeline(transaction=False)
+      for i in indexes:
+        build(pipeline, i)
+      values = self.call(node, pipeline.execute)
+      width = len(values) // len(indexes)
+      for n, i in enumerate(indexes):
+        chunk = values[n * width:(n + 1) * width]
+        results[i] = chunk[0] if width == 1 else tuple(chunk)
+    return results
+
+  def get(self, jti, exp=None):
+    entry = self.run(jti, 'get')
     ret = None if entry is None else entry == b'true'
     return ret
 
-  def probate_access_token(self, jti):
-    self.storage.set(jti, 'false', self.access_token_expires)
+  def probate_access_token(self, jti, exp=None):
+    self.run(jti, 'set', 'false', self.access_token_expires)
 
-  def probate_refresh_token(self, jti):
-    self.storage.set(jti, 'false', self.refresh_token_expires)
+  def probate_refresh_token(self, jti, exp=None):
+    self.run(jti, 'set', 'false', self.refresh_token_expires)
 
-  def revoke_access_token(self, jti):
-    self.storage.set(jti, 'true', self.access_token_expires)
+  def revoke_access_token(self, jti, exp=None):
+    self.run(jti, 'set', 'true', self.access_token_expires)
 
-  def revoke_refresh_token(self, jti):
-    self.storage.set(jti, 'true', self.refresh_token_expires)
+  def revoke_refresh_token(self, jti, exp=None):
+    self.run(jti, 'set', 'true', self.refresh_token_expires)
 
-  def delete(self, jti):
-    self.storage.delete(jti)
+  def get_many(self, jtis, exps=None):
+    entries = self.mget(jtis)
+    return [None if entry is None else entry == b'true' for entry in entries]
 
-  def flushall(self):
-    self.storage.flushdb()
+  def mget(self, names):
+    """Return values of keys of names with one MGET per node."""
+    values = [None] * len(names)
+    for node, indexes in self.ring.group(names).items():
+      keys = [self.key(names[i]) for i in indexes]
+      for i, value in zip(indexes, self.call(node, self.nodes[node].mget, keys)):
+        values[i] = value
+    return values
+
+  def probate_many(self, tokens, exps=None):
+    self.set_many(tokens, 'false', exps=exps)
+
+  def revoke_many(self, tokens, exps=None):
+    self.set_many(tokens, 'true', exps=exps)
+
+  def probate_many_if_absent(self, tokens, exps=None):
+    results = self.set_many(tokens, 'false', nx=True, exps=exps)
+    return [not result for result in results]
+
+  def set_many(self, tokens, value, nx=False, exps=None):
+    """Return list of whether each jti was set."""
+    def build(pipeline, i):
+      jti, token_type_hint = tokens[i]
+      if token_type_hint == 'access_token':
+        pipeline.set(self.key(jti), value, self.access_token_expires, nx=nx)
+      else:
+        pipeline.set(self.key(jti), value, self.refresh_token_expires, nx=nx)
+    return self.run_pipelines([jti for jti, _ in tokens], build)
+
+  def get_generation(self, identity):
+    generation = self.run(self.generation_key(identity), 'get')
+    return 0 if generation is None else int(generation)
+
+  def get_generation_many(self, identities):
+    generations = self.mget([self.generation_key(identity) for identity in identities])
+    return [0 if generation is None else int(generation) for generation in generations]
+
+  def bump_generation(self, identity):
+    return self.run(self.generation_key(identity), 'incr')
+
+  def generation_key(self, identity):
+    """
+    Generation never expires, otherwise it would go back to 0 and
+    tokens of an older generation would be valid again.
+    Its value is neither true nor false, so scan skips it.
+    """
+    return f'generation:{identity}'
+
+  def delete(self, jti, exp=None):
+    self.run(jti, 'unlink')
+
+  def flushall(self, count=1000):
+    """
+    UNLINK frees memory in background, and SCAN returns a few keys at a time,
+    so token checks on the same node are served in between batches.
+    Without prefix, the whole DB of each node is flushed.
+    """
+    if not self.prefix:
+      for node, client in self.nodes.items():
+        self.call(node, client.flushdb)
+      return
+
+    for node, client in self.nodes.items():
+      keys = []
+      for key in client.scan_iter(match=self.pattern('*'), count=count):
+        keys.append(key)
+        if len(keys) >= count:
+          self.call(node, client.unlink, *keys)
+          keys = []
+      if keys:
+        self.call(node, client.unlink, *keys)
+
+  def scan(self, count=1000):
+    for node, client in self.nodes.items():
+      keys = []
+      for key in client.scan_iter(match=self.pattern('*'), count=count):
+        keys.append(key)
+        if len(keys) >= count:
+          yield from self.scan_entries(node, keys)
+          keys = []
+      yield from self.scan_entries(node, keys)
+
+  def scan_entries(self, node, keys):
+    pipeline = self.nodes[node].pipeline(transaction=False)
+    for key in keys:
+      pipeline.get(key)
+      pipeline.ttl(key)
+    values = self.call(node, pipeline.execute)
+
+    now = time.time()
+    for key, entry, ttl in zip(keys, values[0::2], values[1::2]):
+      if entry not in (b'true', b'false') or ttl < 0:
+        continue
+      jti = key[len(self.prefix_bytes):]
+      jti = jti if self.binary_jti else jti.decode()
+      yield jti, entry == b'true', now + ttl
+
+  def restore_many(self, entries):
+    now = time.time()
+    def build(pipeline, i):
+      jti, revoked, expires_at = entries[i]
+      milliseconds = max(int((expires_at - now) * 1000), 1)
+      pipeline.set(self.key(jti), 'true' if revoked else 'false', px=milliseconds, nx=True)
+    self.run_pipelines([jti for jti, _, _ in entries], build)
+
+  def scan_generations(self, count=1000):
+    start = len(self.key('generation:'))
+    for node, client in self.nodes.items():
+      keys = []
+      for key in client.scan_iter(match=self.pattern('generation:*'), count=count):
+        keys.append(key)
+        if len(keys) >= count:
+          yield from self.scan_generation_values(node, keys, start)
+          keys = []
+      yield from self.scan_generation_values(node, keys, start)
+
+  def scan_generation_values(self, node, keys, start):
+    if not keys:
+      return
+    values = self.call(node, self.nodes[node].mget, keys)
+    for key, value in zip(keys, values):
+      if value is not None:
+        yield key[start:].decode(), int(value)
+
+  def restore_generations(self, generations):
+    names = [self.generation_key(identity) for identity, _ in generations]
+    self.run_pipelines(names, lambda pipeline, i: pipeline.set(
+        self.key(names[i]), generations[i][1], nx=True))
+
+  def stats(self):
+    return {
+      'nodes': {node: health.stats() for node, health in self.health.items()},
+    }
+
+
+class RedisBucketStorage(RedisStorage):
+  """
+  Instead of a key with TTL per jti, jtis are stored as fields of hashes,
+  one per REDIS_BUCKET_INTERVAL seconds of exp of tokens. Each hash expires
+  as a whole once all of its tokens have expired, which saves the overhead
+  of a key and its TTL per jti both in memory and in expiry cycles of redis.
+  exp is required by every method since it tells which hash jti is in.
+  With multiple nodes, each node has its own hash per bucket for its jtis.
+  """
+  def init_app(self, app):
+    super().init_app(app)
+    self.bucket_interval = int(app.config.get('REDIS_BUCKET_INTERVAL', 60 * 60))
+
+  def bucket(self, exp):
+    if exp is None:
+      raise ValueError('exp of token is required with bucket layout of redis.')
+    return int(exp) // self.bucket_interval
+
+  def bucket_key(self, exp):
+    return self.key(f'bucket:{self.bucket(exp)}')
+
+  def get(self, jti, exp=None):
+    entry = self.run_on(jti, 'hget', self.bucket_key(exp), jti)
+    ret = None if entry is None else entry == b'true'
+    return ret
+
+  def probate_access_token(self, jti, exp=None):
+    self.set_many([(jti, 'access_token')], 'false', exps=[exp])
+
+  def probate_refresh_token(self, jti, exp=None):
+    self.set_many([(jti, 'refresh_token')], 'false', exps=[exp])
+
+  def revoke_access_token(self, jti, exp=None):
+    self.set_many([(jti, 'access_token')], 'true', exps=[exp])
+
+  def revoke_refresh_token(self, jti, exp=None):
+    self.set_many([(jti, 'refresh_token')], 'true', exps=[exp])
+
+  def get_many(self, jtis, exps=None):
+    exps = fill_exps(exps, len(jtis))
+    entries = self.run_pipelines(
+        jtis, lambda pipeline, i: pipeline.hget(self.bucket_key(exps[i]), jtis[i]))
+    return [None if entry is None else entry == b'true' for entry in entries]
+
+  def set_many(self, tokens, value, nx=False, exps=None):
+    exps = fill_exps(exps, len(tokens))
+    def build(pipeline, i):
+      jti = tokens[i][0]
+      bucket = self.bucket(exps[i])
+      key = self.key(f'bucket:{bucket}')
+      if nx:
+        pipeline.hsetnx(key, jti, value)
+      else:
+        pipeline.hset(key, jti, value)
+      pipeline.expireat(key, (bucket + 1) * self.bucket_interval)
+    results = self.run_pipelines([jti for jti, _ in tokens], build)
+    # HSET returns 0 when it overwrites a field, which still counts as set.
+    return [True if not nx else bool(result[0]) for result in results]
+
+  def delete(self, jti, exp=None):
+    self.run_on(jti, 'hdel', self.bucket_key(exp), jti)
+
+  def restore_many(self, entries):
+    """
+    expires_at of entries must be the ones scan of this layout yields, i.e.
+    the end of their buckets. Entries from the other storages expire later
+    than exp of their tokens, and would be put in a later bucket than the
+    one lookups look into.
+    """
+    for value in [True, False]:
+      chosen = [(jti, expires_at) for jti, revoked, expires_at in entries if revoked == value]
+      self.set_many(
+          [(jti, None) for jti, _ in chosen], 'true' if value else 'false', nx=True,
+          exps=[expires_at - 1 for _, expires_at in chosen])
+
+  def scan(self, count=1000):
+    for node, client in self.nodes.items():
+      for key in client.scan_iter(match=self.pattern('bucket:*'), count=count):
+        expires_at = (int(key.rsplit(b':', 1)[1]) + 1) * self.bucket_interval
+        for field, entry in client.hscan_iter(key, count=count):
+          jti = field if self.binary_jti else field.decode()
+          yield jti, entry == b'true', expires_at
+
+
+class RedisNodeHealth:
+  def __init__(self):
+    self.healthy = True
+    self.requests = 0
+    self.failures = 0
+    self.last_error = None
+    self.last_failure_at = None
+
+  def succeed(self):
+    self.requests += 1
+    self.healthy = True
+
+  def fail(self, error):
+    self.requests += 1
+    self.failures += 1
+    self.healthy = False
+    self.last_error = f'{type(error).__name__}: {str(error)}'
+    self.last_failure_at = time.time()
+    logger.warning(f'Blacklist redis node failed. {self.last_error}')
+
+  def stats(self):
+    return {
+      'healthy': self.healthy,
+      'requests': self.requests,
+      'failures': self.failures,
+      'last_error': self.last_error,
+      'last_failure_at': self.last_failure_at,
+    }
 
 
 class DatabaseStorage(Storage):
+  """
+  If DATABASE_STORAGE_WRITE_BEHIND is True, probate_many_if_absent, which
+  probates newly issued tokens, only queues rows and returns. A background
+  thread inserts queued rows in batches of DATABASE_STORAGE_FLUSH_BATCH at
+  most every DATABASE_STORAGE_FLUSH_INTERVAL seconds. Queued rows are visible
+  to lookups of this process, and every other write waits for queued rows of
+  its jtis to be inserted first, so they are applied in order.
+  Rows are inserted if absent, so a revocation is never overwritten by them.
+  With DATABASE_STORAGE_WAIT_FOR_COMMIT, probate_many_if_absent returns after
+  its rows are committed, which still shares one commit among requests.
+  Otherwise rows queued within the last interval are lost on crash.
+
+  If feed is set by Blacklist, events of revocations are inserted in the
+  same transaction as the revocations, so neither is committed without
+  the other.
+  """
   def __init__(self):
     self.storage = None
+    self.write_behind = False
+    self.feed = None
 
   def init_app(self, app):
+    """
+    With BLACKLIST_BINARY_JTI, jti is stored in jti_bin column of 16 bytes
+    instead of jti column of text.
+    """
     self.token_expires = {
       'access_token': int(app.config['JWT_ACCESS_TOKEN_EXPIRES']),
       'refresh_token': int(app.config['JWT_REFRESH_TOKEN_EXPIRES']),
     }
+    self.jti_key = 'jti_bin' if app.config.get('BLACKLIST_BINARY_JTI', False) else 'jti'
+    self.jti_column = getattr(RevokedToken, self.jti_key)
+    self.timeout = app.config.get('BLACKLIST_STORAGE_TIMEOUT')
+    statement = select([RevokedToken.revoked])\
+        .where(self.jti_column == bindparam('jti'))
+    if self.timeout is not None:
+      statement = statement.prefix_with(self.mysql_timeout_hint(), dialect='mysql')
+    self.revoked_by_jti = CompiledStatement(statement, model=RevokedToken)
+    self.write_behind = app.config.get('DATABASE_STORAGE_WRITE_BEHIND', False)
+    if self.write_behind:
+      self.init_write_behind(app)
+
+  def init_write_behind(self, app):
+    self.app = app
+    self.queue_size = int(app.config.get('DATABASE_STORAGE_QUEUE_SIZE', 10000))
+    self.flush_batch = int(app.config.get('DATABASE_STORAGE_FLUSH_BATCH', 500))
+    self.flush_interval = float(app.config.get('DATABASE_STORAGE_FLUSH_INTERVAL', 0.05))
+    self.wait_for_commit = app.config.get('DATABASE_STORAGE_WAIT_FOR_COMMIT', False)
+    # Queued rows by jti, in the order of queueing.
+    self.pending = dict()
+    self.lock = threading.Lock()
+    self.queued = threading.Condition(self.lock)
+    self.flushed = threading.Condition(self.lock)
+    self.flush_lock = threading.Lock()
+    self.urgent = False
+    self.flushed_rows = 0
+    self.flushed_batches = 0
+    self.flush_failures = 0
+
+    thread = threading.Thread(target=self.run_flusher, daemon=True)
+    thread.start()
+    atexit.register(self.close)
+
+  def run_flusher(self):
+    while True:
+      with self.lock:
+        if not self.urgent:
+          self.queued.wait(self.flush_interval)
+        self.urgent = False
+      try:
+        self.flush()
+      except Exception as e:
+        logger.error(f'Failed to flush probations. {type(e)}: {str(e)}')
+        time.sleep(self.flush_interval)
+
+  def flush(self):
+    """
+    Insert queued rows in batches. Must not be called in a request, since
+    it uses a session of its own app context.
+    """
+    with self.flush_lock:
+      while True:
+        with self.lock:
+          batch = list(itertools.islice(self.pending.items(), self.flush_batch))
+        if not batch:
+          return
+
+        try:
+          with self.app.app_context():
+            db.session.execute(
+                self.insert_if_absent_statement(), [row for _, row in batch])
+            db.session.commit()
+        except Exception:
+          with self.lock:
+            self.flush_failures += 1
+            self.flushed.notify_all()
+          raise
+
+        with self.lock:
+          for jti, _ in batch:
+            self.pending.pop(jti, None)
+          self.flushed_rows += len(batch)
+          self.flushed_batches += 1
+          self.flushed.notify_all()
+
+  def close(self):
+    try:
+      self.flush()
+    except Exception as e:
+      count = len(self.pending)
+      logger.error(f'{count} probations were lost on exit. {type(e)}: {str(e)}')
+
+  def wait_flushed(self, done):
+    """
+    Wake up flusher and wait until done() is True. Raise StorageUnavailable
+    if flush fails meanwhile. Must be called with lock held.
+    """
+    failures = self.flush_failures
+    while not done():
+      if self.flush_failures != failures:
+        msg = 'Failed to flush probations to database.'
+        raise StorageUnavailable(msg)
+      self.urgent = True
+      self.queued.notify()
+      self.flushed.wait()
+
+  def settle(self, jtis=None):
+    """Wait until queued rows of jtis, or all queued rows if None, are inserted."""
+    if not self.write_behind:
+      return
+    if jtis is None:
+      done = lambda: not self.pending
+    else:
+      done = lambda: not any(jti in self.pending for jti in jtis)
+    with self.lock:
+      if done():
+        return
 
-  def get(self, jti):
-    query = RevokedToken.query.filter_by(jti=jti)
-    token = query.first()
-    ret = None if token is None else token.revoked
+    # Locks held by transaction of this session, like SHARED lock of sqlite,
+    # would block flusher.
+    db.session.commit()
+    with self.lock:
+      self.wait_flushed(done)
+
+  def enqueue(self, rows):
+    """rows is list of (jti, row). Block while queue is full."""
+    with self.lock:
+      self.wait_flushed(
+          lambda: not self.pending or len(self.pending) + len(rows) <= self.queue_size)
+      for jti, row in rows:
+        self.pending[jti] = row
+      if len(self.pending) >= self.flush_batch:
+        self.urgent = True
+        self.queued.notify()
+    if self.wait_for_commit:
+      self.settle([jti for jti, _ in rows])
+
+  def bounded(self, query):
+    """Limit execution time of lookup query on mysql to BLACKLIST_STORAGE_TIMEOUT."""
+    if self.timeout is None:
+      return query
+
+    if self.dialect() == 'mysql':
+      query = query.prefix_with(self.mysql_timeout_hint())
+    return query
+
+  def run_bounded(self, lookup):
+    """
+    Run lookup, and return its result. On postgresql, statement_timeout is
+    set to BLACKLIST_STORAGE_TIMEOUT by SET LOCAL before it, and set back to
+    the default of the connection after it, so the rest of the transaction,
+    e.g. revocation by the same request, is not limited.
+    If lookup fails, the transaction is rolled back, which resets it anyway.
+    """
+    if self.timeout is None or self.dialect() != 'postgresql':
+      return lookup()
+
+    db.session.execute(f'SET LOCAL statement_timeout = {int(self.timeout * 1000)}')
+    ret = lookup()
+    db.session.execute('SET LOCAL statement_timeout TO DEFAULT')
+    return ret
+
+  def dialect(self):
+    return db.session.get_bind().dialect.name
+
+  def mysql_timeout_hint(self):
+    return f'/*+ MAX_EXECUTION_TIME({int(self.timeout * 1000)}) */'
+
+  def get(self, jti, exp=None):
+    """Run on every request with a token, so it skips ORM."""
+    if self.write_behind and jti in self.pending:
+      return False
+    row = self.run_bounded(lambda: self.revoked_by_jti.first(jti=jti))
+    ret = None if row is None else row.revoked
     return ret
 
-  def probate_access_token(self, jti):
+  def probate_access_token(self, jti, exp=None):
     self.probate_token_impl(jti, token_type_hint='access_token')
 
-  def probate_refresh_token(self, jti):
+  def probate_refresh_token(self, jti, exp=None):
     self.probate_token_impl(jti, token_type_hint='refresh_token')
 
   def probate_token_impl(self, jti, token_type_hint):
-    query = RevokedToken.query.filter_by(
-        jti=jti, token_type_hint=token_type_hint)
+    self.settle([jti])
+    query = RevokedToken.query.filter(self.jti_column == jti)\
+        .filter_by(token_type_hint=token_type_hint)
     token = query.first()
 
     if token is None:
       revoked_token = RevokedToken(**{
-        'jti': jti,
+        self.jti_key: jti,
         'revoked': False,
         'token_type_hint': token_type_hint,
         'expires_in': self.token_expires[token_type_hint],
+        'expires_at': self.expires_at(token_type_hint),
         'revoked_at': None,
       })
       db.session.add(revoked_token)
@@ -167,43 +1203,445 @@ class DatabaseStorage(Storage):
       token.revoked = False
     db.session.commit()
 
-  def revoke_access_token(self, jti):
+  def revoke_access_token(self, jti, exp=None):
     self.revoke_token_impl(jti, token_type_hint='access_token')
 
-  def revoke_refresh_token(self, jti):
+  def revoke_refresh_token(self, jti, exp=None):
     self.revoke_token_impl(jti, token_type_hint='refresh_token')
 
   def revoke_token_impl(self, jti, token_type_hint):
-    query = RevokedToken.query.filter_by(
-        jti=jti, token_type_hint=token_type_hint)
+    self.settle([jti])
+    query = RevokedToken.query.filter(self.jti_column == jti)\
+        .filter_by(token_type_hint=token_type_hint)
     token = query.first()
 
     if token is None:
       revoked_token = RevokedToken(**{
-        'jti': jti,
+        self.jti_key: jti,
         'revoked': True,
         'token_type_hint': token_type_hint,
         'expires_in': self.token_expires[token_type_hint],
-        'revoked_at': func.now(),
+        'expires_at': self.expires_at(token_type_hint),
+        'revoked_at': self.now(),
       })
       db.session.add(revoked_token)
     else:
       token.revoked = True
-      token.revoked_at = func.now()
+      token.revoked_at = self.now()
+    self.commit_revoked([jti])
+
+  def get_many(self, jtis, exps=None):
+    query = db.session.query(self.jti_column, RevokedToken.revoked)\
+        .filter(self.jti_column.in_(jtis))
+    revoked = dict(self.run_bounded(self.bounded(query).all))
+    if self.write_behind:
+      revoked.update({jti: False for jti in jtis if jti in self.pending})
+    return [revoked.get(jti) for jti in jtis]
+
+  def probate_many(self, tokens, exps=None):
+    self.write_many_impl(tokens, revoked=False)
+
+  def revoke_many(self, tokens, exps=None):
+    self.write_many_impl(tokens, revoked=True)
+
+  def probate_many_if_absent(self, tokens, exps=None):
+    """Insert rows ignoring conflicts in one transaction."""
+    if self.write_behind:
+      return self.probate_many_later(tokens)
+
+    statement = self.insert_if_absent_statement()
+    existed = []
+    for jti, token_type_hint in tokens:
+      result = db.session.execute(statement, self.probation_row(jti, token_type_hint))
+      existed.append(result.rowcount == 0)
     db.session.commit()
+    return existed
 
-  def delete(self, jti):
-    RevokedToken.query.filter_by(jti=jti).delete()
+  def probate_many_later(self, tokens):
+    """
+    Queue rows of jtis which are neither stored nor queued. Unlike
+    INSERT, checking and queueing are not atomic across processes, which
+    doesn't matter for jtis of new tokens, which are random UUIDs.
+    """
+    jtis = [jti for jti, _ in tokens]
+    existing = {jti for jti, value in zip(jtis, self.get_many(jtis)) if value is not None}
+    # Not to block flusher while waiting for a full queue.
     db.session.commit()
+    existed = []
+    rows = []
+    for jti, token_type_hint in tokens:
+      existed.append(jti in existing)
+      if jti not in existing:
+        existing.add(jti)
+        rows.append((jti, self.probation_row(jti, token_type_hint)))
+    self.enqueue(rows)
+    return existed
+
+  def probation_row(self, jti, token_type_hint):
+    return {
+      self.jti_key: jti,
+      'revoked': False,
+      'token_type_hint': token_type_hint,
+      'expires_in': self.token_expires[token_type_hint],
+      'expires_at': self.expires_at(token_type_hint),
+      'revoked_at': None,
+    }
 
-  def flushall(self):
-    db.session.query(RevokedToken).delete()
+  def insert_if_absent_statement(self, model=RevokedToken, key=None):
+    """Return INSERT which skips rows conflicting on unique column key."""
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+      return postgresql.insert(table).on_conflict_do_nothing(
+          index_elements=[key or self.jti_key])
+    elif dialect == 'sqlite':
+      return table.insert().prefix_with('OR IGNORE')
+    elif dialect == 'mysql':
+      return table.insert().prefix_with('IGNORE')
+    else:
+      msg = f'probate_if_absent is not supported with {dialect}.'
+      raise NotImplementedError(msg)
+
+  def write_many_impl(self, tokens, revoked):
+    """Update existing rows and insert the others with one query and commit."""
+    revoked_at = self.now() if revoked else None
+    self.settle([jti for jti, _ in tokens])
+    query = RevokedToken.query.filter(
+        self.jti_column.in_([jti for jti, _ in tokens]))
+    existing = {getattr(token, self.jti_key): token for token in query.all()}
+
+    for jti, token_type_hint in tokens:
+      token = existing.get(jti)
+      if token is None:
+        revoked_token = RevokedToken(**{
+          self.jti_key: jti,
+          'revoked': revoked,
+          'token_type_hint': token_type_hint,
+          'expires_in': self.token_expires[token_type_hint],
+          'expires_at': self.expires_at(token_type_hint),
+          'revoked_at': revoked_at,
+        })
+        db.session.add(revoked_token)
+      else:
+        token.revoked = revoked
+        if revoked:
+          token.revoked_at = revoked_at
+    if revoked:
+      self.commit_revoked([jti for jti, _ in tokens])
+    else:
+      db.session.commit()
+
+  def commit_revoked(self, jtis):
+    """Commit revocations of jtis together with their events of feed."""
+    if self.feed is None:
+      db.session.commit()
+      return
+    try:
+      self.feed.append([jti_to_bytes(jti) for jti in jtis], commit=False)
+      db.session.commit()
+    except Exception:
+      db.session.rollback()
+      raise
+    self.feed.trim_if_due()
+
+  def now(self):
+    """
+    Time when the statement runs, which tells DatabaseBroadcast of the write.
+    now() of postgresql is when the transaction started, which may be long
+    before commit.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+      return func.clock_timestamp()
+    return func.now()
+
+  def expires_at(self, token_type_hint):
+    """expires_at is naive datetime in UTC."""
+    expires_in = self.token_expires[token_type_hint]
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+
+  def get_generation(self, identity):
+    query = db.session.query(TokenGeneration.generation)\
+        .filter_by(identity=identity)
+    generation = self.run_bounded(self.bounded(query).scalar)
+    return 0 if generation is None else generation
+
+  def get_generation_many(self, identities):
+    query = db.session.query(TokenGeneration.identity, TokenGeneration.generation)\
+        .filter(TokenGeneration.identity.in_(identities))
+    generations = dict(self.run_bounded(self.bounded(query).all))
+    return [generations.get(identity, 0) for identity in identities]
+
+  def bump_generation(self, identity):
+    """Increment by one UPDATE, or INSERT the first generation."""
+    while True:
+      query = TokenGeneration.query.filter_by(identity=identity)
+      # updated_at tells DatabaseBroadcast of the bump.
+      updated = query.update(
+          {TokenGeneration.generation: TokenGeneration.generation + 1,
+           TokenGeneration.updated_at: self.now()},
+          synchronize_session=False)
+      if updated == 0:
+        db.session.add(TokenGeneration(identity=identity, generation=1))
+      try:
+        db.session.flush()
+        generation = self.get_generation(identity)
+        db.session.commit()
+        return generation
+      except IntegrityError:
+        # Another request inserted the first generation. Retry with UPDATE.
+        db.session.rollback()
+
+  def delete(self, jti, exp=None):
+    self.settle([jti])
+    RevokedToken.query.filter(self.jti_column == jti).delete()
+    db.session.commit()
+
+  def flushall(self, chunk_size=1000):
+    self.settle()
+    self.delete_in_chunks(chunk_size=chunk_size)
+    TokenGeneration.query.delete()
+    db.session.commit()
+
+  def sweep(self, chunk_size=1000, pause=0.0):
+    """Delete expired rows. Return the number of deleted rows."""
+    now = datetime.datetime.utcnow()
+    return self.delete_in_chunks(
+        RevokedToken.expires_at < now, chunk_size=chunk_size, pause=pause)
+
+  def delete_in_chunks(self, *criterion, chunk_size=1000, pause=0.0):
+    """
+    Delete rows matching criterion, committing every chunk_size rows
+    so that the table is never locked for long.
+    """
+    deleted = 0
+    while True:
+      query = db.session.query(RevokedToken.id).filter(*criterion)
+      ids = [row.id for row in query.limit(chunk_size)]
+      if not ids:
+        return deleted
+
+      RevokedToken.query.filter(RevokedToken.id.in_(ids))\
+          .delete(synchronize_session=False)
+      db.session.commit()
+      deleted += len(ids)
+      if len(ids) < chunk_size:
+        return deleted
+      if pause > 0:
+        time.sleep(pause)
+
+  def scan(self, count=1000):
+    self.settle()
+    query = db.session.query(
+        self.jti_column, RevokedToken.revoked, RevokedToken.expires_at)\
+        .filter(self.jti_column.isnot(None))
+    for jti, revoked, expires_at in query.yield_per(count):
+      yield jti, revoked, calendar.timegm(expires_at.utctimetuple())
+
+  def restore_many(self, entries):
+    """token_type_hint, which is not kept by the other storages, is guessed from expiry."""
+    now = time.time()
+    revoked_at = datetime.datetime.utcnow()
+    rows = []
+    for jti, revoked, expires_at in entries:
+      expires_in = int(expires_at - now)
+      if expires_in <= self.token_expires['access_token']:
+        token_type_hint = 'access_token'
+      else:
+        token_type_hint = 'refresh_token'
+      rows.append({
+        self.jti_key: jti,
+        'revoked': revoked,
+        'token_type_hint': token_type_hint,
+        'expires_in': expires_in,
+        'expires_at': datetime.datetime.utcfromtimestamp(expires_at),
+        'revoked_at': revoked_at if revoked else None,
+      })
+    if rows:
+      db.session.execute(self.insert_if_absent_statement(), rows)
     db.session.commit()
 
+  def scan_generations(self, count=1000):
+    query = db.session.query(TokenGeneration.identity, TokenGeneration.generation)
+    yield from query.yield_per(count)
+
+  def restore_generations(self, generations):
+    rows = [
+      {'identity': identity, 'generation': generation}
+      for identity, generation in generations
+    ]
+    if rows:
+      statement = self.insert_if_absent_statement(TokenGeneration, 'identity')
+      db.session.execute(statement, rows)
+    db.session.commit()
+
+  def stats(self):
+    if not self.write_behind:
+      return None
+
+    return {
+      'write_behind': {
+        'pending': len(self.pending),
+        'flushed_rows': self.flushed_rows,
+        'flushed_batches': self.flushed_batches,
+        'flush_failures': self.flush_failures,
+      },
+    }
+
+
+class SharedMemoryStorage(Storage):
+  """
+  Blacklist shared by all processes on the node through a memory-mapped file.
+  Use this instead of memory when gunicorn runs multiple workers.
+  """
+  def __init__(self):
+    self.storage = None
+
+  def init_app(self, app):
+    path = app.config.get(
+        'SHARED_MEMORY_STORAGE_PATH', '/dev/shm/flask-app-blacklist')
+    capacity = int(app.config.get('SHARED_MEMORY_STORAGE_CAPACITY', 1 << 20))
+
+    self.storage = SharedHashTable(path, capacity)
+    self.access_token_expires = int(app.config['JWT_ACCESS_TOKEN_EXPIRES']*1.2)
+    self.refresh_token_expires = int(app.config['JWT_REFRESH_TOKEN_EXPIRES']*1.2)
+
+  def get(self, jti, exp=None):
+    entry = self.storage.get(self.key(jti))
+    ret = None if entry is None else entry[0] == shared_table.REVOKED
+    return ret
+
+  def probate_access_token(self, jti, exp=None):
+    self.set(jti, shared_table.PROBATED, self.access_token_expires)
+
+  def probate_refresh_token(self, jti, exp=None):
+    self.set(jti, shared_table.PROBATED, self.refresh_token_expires)
+
+  def revoke_access_token(self, jti, exp=None):
+    self.set(jti, shared_table.REVOKED, self.access_token_expires)
+
+  def revoke_refresh_token(self, jti, exp=None):
+    self.set(jti, shared_table.REVOKED, self.refresh_token_expires)
+
+  def probate_many_if_absent(self, tokens, exps=None):
+    existed = []
+    for jti, token_type_hint in tokens:
+      if token_type_hint == 'access_token':
+        expires = self.access_token_expires
+      else:
+        expires = self.refresh_token_expires
+      existed.append(self.storage.set_if_absent(
+          self.key(jti), shared_table.PROBATED, time.time() + expires))
+    return existed
+
+  def set(self, jti, state, expires):
+    self.storage.set(self.key(jti), state, time.time() + expires)
+
+  def get_generation(self, identity):
+    entry = self.storage.get(self.generation_key(identity))
+    return 0 if entry is None else int(entry[1])
+
+  def bump_generation(self, identity):
+    return self.storage.increment(self.generation_key(identity))
+
+  def generation_key(self, identity):
+    return self.key(f'generation:{identity}')
+
+  def delete(self, jti, exp=None):
+    self.storage.delete(self.key(jti))
+
+  def flushall(self):
+    self.storage.clear()
+
+  def scan(self):
+    """
+    jti is the 16 bytes key stored in the table, which is the packed UUID
+    for UUID, and a hash, which can't be reversed, for any other string.
+    """
+    for key, state, expires_at in self.storage.scan():
+      yield key, state == shared_table.REVOKED, expires_at
+
+  def restore_many(self, entries):
+    for jti, revoked, expires_at in entries:
+      state = shared_table.REVOKED if revoked else shared_table.PROBATED
+      self.storage.set_if_absent(self.key(jti), state, expires_at)
+
+  def scan_generations(self):
+    """Identities are hashed into keys of the table, so they can't be listed."""
+    return iter(())
+
+  def restore_generations(self, generations):
+    for identity, generation in generations:
+      self.storage.set_if_absent(
+          self.generation_key(identity), shared_table.COUNTER, float(generation))
+
+  def key(self, jti):
+    """
+    Same as jti_to_bytes, so that UUID finds the same entry whether it's
+    given as str or as 16 bytes by BLACKLIST_BINARY_JTI.
+    """
+    return jti_to_bytes(jti)
+
 
 class Blacklist:
+  """
+  If BLACKLIST_PROBATION_ENABLED is False, issued tokens are not probated
+  and only revoked tokens are stored. Then has_as_key is False for tokens
+  which are valid. JTI of each token is a random UUID given by
+  flask_jwt_extended, so duplicate issuance needs no check against storage.
+
+  If BLACKLIST_CACHE_ENABLED is True, results of storage are cached in each
+  worker.
+
+  If BLACKLIST_FILTER_ENABLED is True, a bloom filter of revoked tokens is
+  built from storage in each worker, and has_revoked skips storage for tokens
+  which are definitely not in it. The filter is rebuilt every
+  BLACKLIST_FILTER_REBUILD_INTERVAL seconds to drop expired/deleted tokens.
+  It's built by a thread of its own, since it scans whole storage, and
+  lookups go to storage until it's ready.
+
+  Both are kept consistent across workers by broadcasting revocations.
+  Broadcast is polled at most every BLACKLIST_CACHE_MAX_STALENESS seconds
+  before lookup, and both are bypassed while polling fails, so a revocation
+  on any worker takes effect on the others within that bound.
+
+  If BLACKLIST_BINARY_JTI is True, JTI is stored as 16 bytes instead of
+  a string of 36 characters. Either form is accepted by every method.
+
+  If BLACKLIST_GENERATION_ENABLED is True, each token carries the generation
+  of its identity at issuance, and bumping the generation revokes all tokens
+  of the identity issued before, with one write.
+
+  If BLACKLIST_BREAKER_ENABLED is True, storage is called through a circuit
+  breaker. While storage is unavailable, lookups are answered by
+  BLACKLIST_FALLBACK without waiting for storage, and writes raise
+  StorageUnavailable. With local fallback, revocations seen by this worker
+  are kept to answer lookups.
+
+  If BLACKLIST_FEED_ENABLED is True, revocations are appended to a feed
+  (see app.auth.feed), from which services checking tokens by themselves
+  keep a copy of revoked jtis.
+  """
+  # Seconds to wait before building filter again once it failed.
+  filter_retry_interval = 5.0
+
   def __init__(self):
     self.storage = None
+    self.storage_type = None
+    self.probation_enabled = True
+    self.binary_jti = False
+    self.generation_enabled = False
+    self.cache = None
+    self.generations = None
+    self.filter = None
+    self.filter_enabled = False
+    self.filter_building = None
+    self.broadcast = None
+    self.breaker = None
+    self.fallback = None
+    self.recent = None
+    self.recent_generations = None
+    self.feed = None
+    self.feed_in_storage = False
 
   def init_app(self, app):
     storage_type = app.config['BLACKLIST_STORAGE_TYPE']
@@ -214,44 +1652,641 @@ class Blacklist:
     if storage_type == 'memory':
       self.storage = MemoryStorage()
     elif storage_type == 'redis':
-      self.storage = RedisStorage()
+      layout = app.config.get('REDIS_STORAGE_LAYOUT', 'key')
+      if layout == 'key':
+        self.storage = RedisStorage()
+      elif layout == 'bucket':
+        self.storage = RedisBucketStorage()
+      else:
+        msg = f'Not supported redis storage layout: {layout}.'
+        raise ValueError(msg)
     elif storage_type == 'database':
       self.storage = DatabaseStorage()
+    elif storage_type == 'shared_memory':
+      self.storage = SharedMemoryStorage()
     else:
       msg = f'Not supported storage type: {storage_type}.'
       raise ValueError(msg)
 
+    self.storage_type = storage_type
+    self.probation_enabled = app.config.get('BLACKLIST_PROBATION_ENABLED', True)
+    self.binary_jti = app.config.get('BLACKLIST_BINARY_JTI', False)
+    self.generation_enabled = app.config.get('BLACKLIST_GENERATION_ENABLED', False)
+    if self.generation_enabled and \
+        not app.config.get('JWT_CLAIMS_IN_REFRESH_TOKEN', False):
+      msg = 'BLACKLIST_GENERATION_ENABLED requires JWT_CLAIMS_IN_REFRESH_TOKEN.'
+      raise ValueError(msg)
     self.storage.init_app(app)
+    self.init_breaker(app)
+    self.init_cache(app)
+    self.init_filter(app)
+    self.init_broadcast(app)
+    self.init_feed(app)
+
+  def init_cache(self, app):
+    """With BLACKLIST_GENERATION_ENABLED, generations are cached as well."""
+    self.cache = None
+    self.generations = None
+    if not app.config.get('BLACKLIST_CACHE_ENABLED', False):
+      return
+
+    if self.storage_type not in ['redis', 'database']:
+      msg = f'Blacklist cache is not supported with {self.storage_type}.'
+      raise ValueError(msg)
+
+    max_entries = int(app.config.get('BLACKLIST_CACHE_MAX_ENTRIES', 100000))
+    ttl = int(app.config.get(
+        'BLACKLIST_CACHE_TTL', app.config['JWT_ACCESS_TOKEN_EXPIRES']))
+    self.cache = LocalCache(max_entries, ttl)
+    if self.generation_enabled:
+      self.generations = LocalCache(max_entries, ttl)
+
+  def init_breaker(self, app):
+    self.breaker = None
+    self.recent = None
+    self.recent_generations = None
+    if not app.config.get('BLACKLIST_BREAKER_ENABLED', False):
+      return
+
+    self.fallback = app.config.get('BLACKLIST_FALLBACK', 'fail_closed')
+    if self.fallback not in BlacklistFallback.types:
+      msg = f'Not supported blacklist fallback: {self.fallback}.'
+      raise ValueError(msg)
+
+    self.breaker = CircuitBreaker(
+        f'blacklist {self.storage_type} storage',
+        failure_threshold=int(app.config.get('BLACKLIST_BREAKER_FAILURE_THRESHOLD', 5)),
+        reset_timeout=float(app.config.get('BLACKLIST_BREAKER_RESET_TIMEOUT', 30)))
+    self.fallbacks = 0
+    if self.fallback == 'local':
+      max_entries = int(app.config.get('BLACKLIST_FALLBACK_MAX_ENTRIES', 100000))
+      ttl = int(max(
+          app.config['JWT_ACCESS_TOKEN_EXPIRES'], app.config['JWT_REFRESH_TOKEN_EXPIRES']))
+      self.recent = LocalCache(max_entries, ttl)
+      self.recent_generations = LocalCache(max_entries, ttl)
+
+  def init_filter(self, app):
+    """Filter is built at the first lookup since storage may not be ready yet."""
+    self.filter = None
+    self.filter_enabled = app.config.get('BLACKLIST_FILTER_ENABLED', False)
+    if not self.filter_enabled:
+      return
+
+    if self.storage_type not in ['memory', 'redis', 'database']:
+      msg = f'Blacklist filter is not supported with {self.storage_type}.'
+      raise ValueError(msg)
+
+    self.filter_capacity = int(app.config.get('BLACKLIST_FILTER_CAPACITY', 100000))
+    self.filter_error_rate = float(
+        app.config.get('BLACKLIST_FILTER_ERROR_RATE', 0.001))
+    self.filter_rebuild_interval = float(
+        app.config.get('BLACKLIST_FILTER_REBUILD_INTERVAL', 3600))
+    self.filter_built_at = 0.0
+    self.filter_failed_at = 0.0
+    self.filter_lock = threading.Lock()
+    self.app = app
+    self.filter_negatives = 0
+    self.filter_false_positives = 0
+
+  def init_broadcast(self, app):
+    self.broadcast = None
+    if self.cache is None and not self.filter_enabled:
+      return
+
+    if self.storage_type == 'redis':
+      self.broadcast = RedisBroadcast()
+    elif self.storage_type == 'database':
+      self.broadcast = DatabaseBroadcast()
+    else:
+      return
+
+    self.max_staleness = float(
+        app.config.get('BLACKLIST_CACHE_MAX_STALENESS', 1.0))
+    self.synced_at = 0.0
+    self.synced = True
+    self.sync_lock = threading.Lock()
+    self.broadcast.init_app(app)
+
+  def init_feed(self, app):
+    self.feed = None
+    self.feed_in_storage = False
+    if self.storage_type == 'database':
+      self.storage.feed = None
+    if not app.config.get('BLACKLIST_FEED_ENABLED', False):
+      return
+
+    if self.storage_type == 'memory':
+      self.feed = MemoryFeed()
+    elif self.storage_type == 'redis':
+      self.feed = RedisFeed()
+    elif self.storage_type == 'database':
+      self.feed = DatabaseFeed()
+    else:
+      msg = f'Blacklist feed is not supported with {self.storage_type}.'
+      raise ValueError(msg)
+
+    self.feed.init_app(app)
+    # Database storage appends events in the transaction of revocations.
+    self.feed_in_storage = self.storage_type == 'database'
+    if self.feed_in_storage:
+      self.storage.feed = self.feed
+    self.feed_retries = []
+    self.feed_lock = threading.Lock()
+    self.snapshot_ttl = float(app.config.get('BLACKLIST_FEED_SNAPSHOT_TTL', 10))
+    self.snapshot = None
+    self.snapshot_at = 0.0
+    self.snapshot_lock = threading.Lock()
+
+  def to_key(self, jti):
+    """
+    Return jti in the form stored in storage. With BLACKLIST_BINARY_JTI,
+    UUID is packed into 16 bytes, and any other string is hashed into them.
+    """
+    if not self.binary_jti:
+      return jti
+    return jti_to_bytes(jti)
+
+  def to_keys(self, jtis):
+    return [self.to_key(jti) for jti in jtis]
+
+  def to_tokens(self, tokens):
+    return [(self.to_key(jti), hint) for jti, hint in tokens]
+
+  def get(self, jti, exp=None):
+    jti = self.to_key(jti)
+    if self.cache is not None and self.sync():
+      hit, value = self.cache.get(jti)
+      if hit:
+        return value
+
+    available, value = self.read(self.storage.get, jti, exp)
+    if not available:
+      return self.fallback_get(jti)
+    self.remember(jti, value)
+    return value
+
+  def get_many(self, jtis, exps=None):
+    jtis = self.to_keys(jtis)
+    exps = fill_exps(exps, len(jtis))
+    if self.cache is None and self.breaker is None:
+      return self.storage.get_many(jtis, exps)
+
+    values = [None] * len(jtis)
+    missed = list(range(len(jtis)))
+    if self.cache is not None and self.sync():
+      missed = []
+      for i, jti in enumerate(jtis):
+        hit, values[i] = self.cache.get(jti)
+        if not hit:
+          missed.append(i)
+
+    if missed:
+      available, fetched = self.read(
+          self.storage.get_many, [jtis[i] for i in missed], [exps[i] for i in missed])
+      for n, i in enumerate(missed):
+        if available:
+          values[i] = fetched[n]
+          self.remember(jtis[i], fetched[n])
+        else:
+          values[i] = self.fallback_get(jtis[i])
+    return values
+
+  def read(self, method, *args):
+    """
+    Return (available, value) of lookup by method of storage.
+    available is False if storage failed or the circuit is open.
+    """
+    if self.breaker is None:
+      return True, method(*args)
+
+    if not self.breaker.allow():
+      self.fallbacks += 1
+      return False, None
+    try:
+      value = method(*args)
+    except UNAVAILABLE_ERRORS as e:
+      self.on_unavailable(e)
+      self.fallbacks += 1
+      return False, None
+    except Exception:
+      self.breaker.release()
+      raise
+    self.breaker.succeed()
+    return True, value
+
+  def call(self, method, *args):
+    """Run method of storage, raising StorageUnavailable if the circuit is open."""
+    if self.breaker is None:
+      return method(*args)
+
+    if not self.breaker.allow():
+      msg = 'Blacklist storage is unavailable.'
+      raise StorageUnavailable(msg)
+    try:
+      ret = method(*args)
+    except UNAVAILABLE_ERRORS as e:
+      self.on_unavailable(e)
+      raise
+    except Exception:
+      self.breaker.release()
+      raise
+    self.breaker.succeed()
+    return ret
 
-  def has_as_key(self, jti):
-    has = self.storage.get(jti)
+  def on_unavailable(self, error):
+    self.breaker.fail(error)
+    if self.storage_type == 'database':
+      db.session.rollback()
+
+  def remember(self, jti, value):
+    """Keep value looked up from storage in cache and recent revocations."""
+    if self.cache is not None:
+      self.cache.set(jti, value)
+    if self.recent is not None and value is True:
+      self.recent.set(jti, True)
+
+  def fallback_get(self, jti):
+    if self.fallback == 'fail_open':
+      return None
+    if self.fallback == 'local':
+      hit, _ = self.recent.get(jti)
+      return True if hit else None
+    return True
+
+  def sync(self, force=False):
+    """
+    Apply events broadcast by the other workers to cache and filter.
+    Return False if they can't be trusted.
+    Broadcast is polled by one thread at a time, since pubsub of redis-py is
+    not thread-safe. The others don't wait for it, and answer by the result
+    of the last poll.
+    """
+    if self.broadcast is None:
+      return True
+
+    now = time.time()
+    if not force and now - self.synced_at < self.max_staleness:
+      return True
+
+    if not self.sync_lock.acquire(blocking=False):
+      return self.synced
+    try:
+      for op, jti in self.broadcast.poll():
+        self.apply(op, jti)
+    except Exception as e:
+      logger.warning(f'Failed to sync blacklist. {type(e)}: {str(e)}')
+      self.apply('reset')
+      self.synced_at = 0.0
+      self.synced = False
+    else:
+      self.synced_at = now
+      self.synced = True
+    finally:
+      self.sync_lock.release()
+    return self.synced
+
+  def apply(self, op, jti=None):
+    bloom_filter = self.filter
+    if op == 'revoke':
+      if self.cache is not None:
+        self.cache.set(jti, True)
+      if self.recent is not None:
+        self.recent.set(jti, True)
+      if bloom_filter is not None:
+        bloom_filter.add(jti)
+      if self.filter_building is not None:
+        self.filter_building.add(jti)
+    elif op == 'probate':
+      if self.cache is not None:
+        self.cache.set(jti, False)
+    elif op == 'delete':
+      if self.cache is not None:
+        self.cache.invalidate(jti)
+      if self.recent is not None:
+        self.recent.invalidate(jti)
+    elif op == 'generation':
+      # jti is the identity whose generation was bumped.
+      if self.generations is not None:
+        self.generations.invalidate(jti)
+    elif op == 'reset':
+      # Events may have been lost. Filter, as well as the one being built,
+      # is dropped and built again.
+      if self.cache is not None:
+        self.cache.clear()
+      if self.generations is not None:
+        self.generations.clear()
+      self.filter = None
+      self.filter_building = None
+    elif op == 'flush':
+      if self.cache is not None:
+        self.cache.clear()
+      if self.generations is not None:
+        self.generations.clear()
+      if self.recent is not None:
+        self.recent.clear()
+        self.recent_generations.clear()
+      if bloom_filter is not None:
+        self.filter = BloomFilter(self.filter_capacity, self.filter_error_rate)
+      # The one being built may have flushed tokens.
+      self.filter_building = None
+
+  def get_filter(self):
+    """
+    Return filter, or None if it's not built yet. If it's not built yet or
+    too old, start building it, unless the last build failed less than
+    filter_retry_interval seconds ago.
+    """
+    now = time.time()
+    stale = self.filter_rebuild_interval > 0 and \
+        now - self.filter_built_at > self.filter_rebuild_interval
+    if self.filter is not None and not stale:
+      return self.filter
+    if now - self.filter_failed_at < self.filter_retry_interval:
+      return self.filter
+
+    if self.filter_lock.acquire(blocking=False):
+      thread = threading.Thread(target=self.build_filter, daemon=True)
+      thread.start()
+    return self.filter
+
+  def build_filter(self):
+    """Run by thread started by get_filter, which holds filter_lock for it."""
+    started_at = time.time()
+    try:
+      with self.app.app_context():
+        # Revocations after sync are applied to the new filter by the next sync.
+        if not self.sync(force=True):
+          self.filter_failed_at = time.time()
+          return
+        # Revocations during scan are applied to the new filter by apply.
+        bloom_filter = BloomFilter(self.filter_capacity, self.filter_error_rate)
+        self.filter_building = bloom_filter
+        for jti, revoked, _ in self.storage.scan():
+          if revoked:
+            bloom_filter.add(jti)
+      # Dropped by reset or flush meanwhile.
+      if self.filter_building is not bloom_filter:
+        return
+      self.filter = bloom_filter
+      self.filter_built_at = started_at
+      logger.info(f'Blacklist filter was built with {bloom_filter.entries} tokens '
+                  f'in {time.time() - started_at:.3f} seconds.')
+    except Exception as e:
+      self.filter_failed_at = time.time()
+      logger.error(f'Failed to build blacklist filter. {type(e)}: {str(e)}')
+    finally:
+      self.filter_building = None
+      self.filter_lock.release()
+
+  def has_as_key(self, jti, exp=None):
+    has = self.get(jti, exp)
     has = False if has is None else True
     return has
 
-  def has_revoked(self, jti):
-    revoked = self.storage.get(jti)
+  def has_revoked(self, jti, exp=None):
+    jti = self.to_key(jti)
+    bloom_filter = None
+    if self.filter_enabled and self.sync():
+      bloom_filter = self.get_filter()
+    if bloom_filter is not None and not bloom_filter.might_contain(jti):
+      self.filter_negatives += 1
+      return False
+
+    revoked = self.get(jti, exp)
     revoked = False if revoked is None else revoked
+    if bloom_filter is not None and not revoked:
+      self.filter_false_positives += 1
     return revoked
 
-  def probate_access_token(self, jti):
-    self.storage.probate_access_token(jti)
+  def has_as_keys(self, jtis, exps=None):
+    return [has is not None for has in self.get_many(jtis, exps)]
+
+  def has_revoked_many(self, jtis, exps=None):
+    jtis = self.to_keys(jtis)
+    exps = fill_exps(exps, len(jtis))
+    bloom_filter = None
+    if self.filter_enabled and self.sync():
+      bloom_filter = self.get_filter()
+
+    revoked = [False] * len(jtis)
+    candidates = list(range(len(jtis)))
+    if bloom_filter is not None:
+      candidates = [i for i, jti in enumerate(jtis) if bloom_filter.might_contain(jti)]
+      self.filter_negatives += len(jtis) - len(candidates)
+
+    if candidates:
+      values = self.get_many(
+          [jtis[i] for i in candidates], [exps[i] for i in candidates])
+      for i, value in zip(candidates, values):
+        revoked[i] = value is True
+        if bloom_filter is not None and not revoked[i]:
+          self.filter_false_positives += 1
+    return revoked
+
+  def get_generation(self, identity):
+    return self.call(self.storage.get_generation, identity)
 
-  def probate_refresh_token(self, jti):
-    self.storage.probate_refresh_token(jti)
+  def bump_generation(self, identity):
+    generation = self.call(self.storage.bump_generation, identity)
+    self.on_write('generation', identity)
+    if self.generations is not None:
+      self.generations.set(identity, generation)
+    if self.recent_generations is not None:
+      self.recent_generations.set(identity, generation)
+    logger.debug(f'tokens of {identity} before generation {generation} were revoked.')
+    return generation
 
-  def revoke_access_token(self, jti):
-    self.storage.revoke_access_token(jti)
+  def has_stale_generation(self, identity, generation):
+    """Return True if token of identity was issued in an older generation."""
+    return self.has_stale_generations([(identity, generation)])[0]
+
+  def has_stale_generations(self, tokens):
+    """
+    Batch version of has_stale_generation, which looks up generations not
+    in cache with one call of storage. tokens is list of (identity, generation).
+    """
+    if not self.generation_enabled:
+      return [False] * len(tokens)
+
+    current = dict()
+    if self.generations is not None and self.sync():
+      for identity, _ in tokens:
+        hit, value = self.generations.get(identity)
+        if hit:
+          current[identity] = value
+
+    missing = list(dict.fromkeys(identity for identity, _ in tokens if identity not in current))
+    if missing:
+      available, values = self.read(self.storage.get_generation_many, missing)
+      if available:
+        for identity, value in zip(missing, values):
+          current[identity] = value
+          if self.generations is not None:
+            self.generations.set(identity, value)
+          if self.recent_generations is not None:
+            self.recent_generations.set(identity, value)
+      elif self.fallback == 'local':
+        for identity in missing:
+          _, value = self.recent_generations.get(identity)
+          current[identity] = 0 if value is None else value
+      else:
+        stale = self.fallback == 'fail_closed'
+        return [
+          stale if identity not in current else generation < current[identity]
+          for identity, generation in tokens
+        ]
+    return [generation < current[identity] for identity, generation in tokens]
+
+  def probate_access_token(self, jti, exp=None):
+    jti = self.to_key(jti)
+    self.call(self.storage.probate_access_token, jti, exp)
+    self.on_write('probate', jti)
+
+  def probate_refresh_token(self, jti, exp=None):
+    jti = self.to_key(jti)
+    self.call(self.storage.probate_refresh_token, jti, exp)
+    self.on_write('probate', jti)
+
+  def revoke_access_token(self, jti, exp=None):
+    jti = self.to_key(jti)
+    self.call(self.storage.revoke_access_token, jti, exp)
+    self.on_write('revoke', jti)
+    self.feed_revoked([jti])
     logger.debug(f'token: {jti} was revoked.')
 
-  def revoke_refresh_token(self, jti):
-    self.storage.revoke_refresh_token(jti)
+  def revoke_refresh_token(self, jti, exp=None):
+    jti = self.to_key(jti)
+    self.call(self.storage.revoke_refresh_token, jti, exp)
+    self.on_write('revoke', jti)
+    self.feed_revoked([jti])
     logger.debug(f'token: {jti} was revoked.')
 
-  def delete(self, jti):
-    self.storage.delete(jti)
+  def probate_many(self, tokens, exps=None):
+    """tokens is list of (jti, token_type_hint)."""
+    tokens = self.to_tokens(tokens)
+    self.call(self.storage.probate_many, tokens, exps)
+    for jti, _ in tokens:
+      self.on_write('probate', jti)
+
+  def probate_if_absent(self, jti, token_type_hint, exp=None):
+    """Return True if jti already existed, in which case nothing is done."""
+    return self.probate_many_if_absent([(jti, token_type_hint)], [exp])[0]
+
+  def probate_many_if_absent(self, tokens, exps=None):
+    """tokens is list of (jti, token_type_hint)."""
+    tokens = self.to_tokens(tokens)
+    existed = self.call(self.storage.probate_many_if_absent, tokens, exps)
+    for (jti, _), exists in zip(tokens, existed):
+      if not exists:
+        self.on_write('probate', jti)
+    return existed
+
+  def revoke_many(self, tokens, exps=None):
+    """tokens is list of (jti, token_type_hint)."""
+    tokens = self.to_tokens(tokens)
+    self.call(self.storage.revoke_many, tokens, exps)
+    for jti, _ in tokens:
+      self.on_write('revoke', jti)
+      logger.debug(f'token: {jti} was revoked.')
+    self.feed_revoked([jti for jti, _ in tokens])
+
+  def delete(self, jti, exp=None):
+    jti = self.to_key(jti)
+    self.call(self.storage.delete, jti, exp)
+    self.on_write('delete', jti)
 
   def flushall(self):
-    self.storage.flushall()
+    self.call(self.storage.flushall)
+    self.on_write('flush')
+    if self.feed is not None:
+      self.feed.flush()
+      self.snapshot = None
+      self.feed_retries = []
+
+  def feed_revoked(self, jtis):
+    """
+    Append to feed after storage is written, see app.auth.feed.
+    Revocations are stored by then, so failure of feed is logged rather than
+    raised, which would make callers revert them. Keys which failed to be
+    appended are retried with the next ones, up to BLACKLIST_FEED_MAX_EVENTS.
+    """
+    if self.feed is None or self.feed_in_storage:
+      return
+
+    with self.feed_lock:
+      keys = self.feed_retries + [jti_to_bytes(jti) for jti in jtis]
+      self.feed_retries = []
+    try:
+      self.feed.append(keys)
+    except Exception as e:
+      logger.error(f'Failed to append revocations to feed. {type(e)}: {str(e)}')
+      with self.feed_lock:
+        self.feed_retries = (keys + self.feed_retries)[-self.feed.max_events:]
+
+  def feed_snapshot(self):
+    """
+    Return (sequence, sorted 16 bytes keys of revoked tokens which are not
+    expired). Sequence is read before storage is scanned, so the snapshot
+    has every revocation up to it. It is scanned at most once every
+    BLACKLIST_FEED_SNAPSHOT_TTL seconds, since scan reads whole storage.
+    """
+    with self.snapshot_lock:
+      now = time.time()
+      if self.snapshot is not None and now - self.snapshot_at < self.snapshot_ttl:
+        return self.snapshot
+
+      sequence = self.feed.sequence()
+      keys = {
+        jti_to_bytes(jti)
+        for jti, revoked, expires_at in self.storage.scan()
+        if revoked and expires_at > now
+      }
+      self.snapshot = (sequence, sorted(keys))
+      self.snapshot_at = now
+      return self.snapshot
+
+  def on_write(self, op, jti=None):
+    """
+    Probation is not broadcast since it only matters to the worker which
+    issued the token.
+    """
+    self.apply(op, jti)
+    if self.broadcast is not None and op != 'probate':
+      self.broadcast.publish(op, jti)
+
+  def stats(self):
+    return {
+      'storage_type': self.storage_type,
+      'storage': self.storage.stats(),
+      'cache': None if self.cache is None else self.cache.stats(),
+      'filter': self.filter_stats(),
+      'breaker': self.breaker_stats(),
+      'feed': None if self.feed is None else self.feed.stats(),
+    }
+
+  def breaker_stats(self):
+    if self.breaker is None:
+      return None
+
+    return {
+      **self.breaker.stats(),
+      'fallback': self.fallback,
+      'fallbacks': self.fallbacks,
+      'recent_revocations': None if self.recent is None else len(self.recent.entries),
+    }
+
+  def filter_stats(self):
+    if self.filter is None:
+      return None
+
+    lookups = self.filter_negatives + self.filter_false_positives
+    return {
+      **self.filter.stats(),
+      'negatives': self.filter_negatives,
+      'false_positives': self.filter_false_positives,
+      'false_positive_rate': \
+          self.filter_false_positives / lookups if lookups > 0 else 0.0,
+    }
 
 
 blacklist = Blacklist()
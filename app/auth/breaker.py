@@ -0,0 +1,91 @@
+"""
+Circuit breaker which stops calling a backend once it keeps failing.
+
+closed : Calls go through. failure_threshold failures in a row open it.
+open : Calls are rejected without touching the backend, until reset_timeout
+       seconds have passed since it opened.
+half_open : A single call is let through as a probe. Its success closes
+            the breaker, and its failure opens it again. If it ends with
+            neither, e.g. by an error of the query, it's released and the
+            next call is the probe.
+"""
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+  def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+    self.name = name
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.lock = threading.Lock()
+    self.state = CLOSED
+    self.failures = 0
+    self.opened_at = 0.0
+    self.probing = False
+    self.rejected = 0
+    self.transitions = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+    self.last_error = None
+
+  def allow(self):
+    """Return True if a call may go to the backend."""
+    with self.lock:
+      if self.state == CLOSED:
+        return True
+      if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+        self.transition(HALF_OPEN)
+      if self.state == HALF_OPEN and not self.probing:
+        self.probing = True
+        return True
+      self.rejected += 1
+      return False
+
+  def succeed(self):
+    with self.lock:
+      self.failures = 0
+      self.probing = False
+      if self.state != CLOSED:
+        self.transition(CLOSED)
+
+  def release(self):
+    """End a call which tells nothing about availability of the backend."""
+    with self.lock:
+      self.probing = False
+
+  def fail(self, error):
+    with self.lock:
+      self.failures += 1
+      self.probing = False
+      self.last_error = f'{type(error).__name__}: {str(error)}'
+      if self.state == HALF_OPEN or \
+          (self.state == CLOSED and self.failures >= self.failure_threshold):
+        self.opened_at = time.time()
+        self.transition(OPEN)
+
+  def transition(self, state):
+    """Must be called with lock held."""
+    self.state = state
+    self.transitions[state] += 1
+    if state == OPEN:
+      logger.warning(
+          f'Circuit of {self.name} was opened after {self.failures} failures. '
+          f'{self.last_error}')
+    else:
+      logger.info(f'Circuit of {self.name} became {state}.')
+
+  def stats(self):
+    return {
+      'state': self.state,
+      'failures': self.failures,
+      'rejected': self.rejected,
+      'transitions': dict(self.transitions),
+      'last_error': self.last_error,
+    }
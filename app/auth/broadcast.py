@@ -0,0 +1,123 @@
+"""
+Broadcast blacklist changes to every worker on every node, so that
+each worker can keep its local cache of blacklist consistent.
+
+poll() returns events which happened since the last poll.
+Each event is a tuple of (op, jti) where op is one of
+- revoke : jti was revoked.
+- delete : jti was deleted from blacklist.
+- generation : Generation of identity was bumped. jti is the identity.
+- flush : Whole blacklist was flushed. jti is None.
+- reset : Events may have been lost, e.g. while reconnecting. jti is None.
+"""
+import datetime
+
+import redis
+from sqlalchemy import func, select
+
+from app.models import db
+from app.models.revoked_token import RevokedToken
+from app.models.token_generation import TokenGeneration
+
+
+class RedisBroadcast:
+  """
+  Publish/subscribe events through redis pub/sub. redis-py subscribes again
+  when it reconnects, and messages published meanwhile are lost, so every
+  confirmation of subscription is polled as reset.
+  """
+  def __init__(self):
+    self.storage = None
+    self.pubsub = None
+
+  def init_app(self, app):
+    host = app.config['REDIS_HOST']
+    password = app.config['REDIS_PASSWORD']
+    port = app.config['REDIS_PORT']
+    db = app.config['REDIS_DB_INDEX']
+
+    self.channel = app.config.get('BLACKLIST_CACHE_CHANNEL', 'blacklist')
+    self.binary_jti = app.config.get('BLACKLIST_BINARY_JTI', False)
+    timeout = app.config.get('BLACKLIST_STORAGE_TIMEOUT')
+    self.storage = redis.StrictRedis(
+        host=host, port=port, db=db, password=password,
+        socket_timeout=timeout, socket_connect_timeout=timeout)
+    self.pubsub = self.storage.pubsub()
+    self.pubsub.subscribe(self.channel)
+
+  def publish(self, op, jti=None):
+    message = op.encode() if jti is None else op.encode() + b':' + self.to_bytes(jti)
+    self.storage.publish(self.channel, message)
+
+  def poll(self):
+    events = []
+    while True:
+      message = self.pubsub.get_message()
+      if message is None:
+        return events
+      if message['type'] == 'subscribe':
+        events.append(('reset', None))
+      if message['type'] != 'message':
+        continue
+      op, _, jti = message['data'].partition(b':')
+      if not jti:
+        jti = None
+      elif op == b'generation' or not self.binary_jti:
+        jti = jti.decode()
+      events.append((op.decode(), jti))
+
+  def to_bytes(self, jti):
+    return jti if isinstance(jti, bytes) else jti.encode()
+
+
+class DatabaseBroadcast:
+  """
+  Poll revoked_tokens table for rows revoked since the last poll, and
+  token_generations table for generations bumped since then.
+  Deletion and flush are not visible to the other workers, which only makes
+  their cache keep such tokens as revoked until the cache entry expires.
+
+  revoked_at is set when the statement runs (see DatabaseStorage.now) but
+  becomes visible only after commit, so rows are polled with an overlap of
+  BLACKLIST_BROADCAST_OVERLAP seconds. Rows returned by the last poll are
+  not returned again, so the overlap costs only the scan of its rows.
+  """
+  def __init__(self):
+    self.watermark = None
+    self.seen = set()
+    self.jti_column = RevokedToken.jti
+
+  def init_app(self, app):
+    if app.config.get('BLACKLIST_BINARY_JTI', False):
+      self.jti_column = RevokedToken.jti_bin
+    self.overlap = datetime.timedelta(
+        seconds=float(app.config.get('BLACKLIST_BROADCAST_OVERLAP', 10)))
+
+  def publish(self, op, jti=None):
+    pass
+
+  def poll(self):
+    with db.engine.connect() as connection:
+      if self.watermark is None:
+        self.watermark = connection.execute(select([func.now()])).scalar()
+        return []
+
+      query = select([self.jti_column, RevokedToken.revoked_at]).where(
+          RevokedToken.revoked_at >= self.watermark - self.overlap)
+      rows = connection.execute(query).fetchall()
+      query = select([TokenGeneration.identity, TokenGeneration.updated_at]).where(
+          TokenGeneration.updated_at >= self.watermark - self.overlap)
+      generations = connection.execute(query).fetchall()
+
+    # Rows in the overlap were returned by the last poll as well.
+    seen = set()
+    for jti, revoked_at in rows:
+      if jti is not None:
+        seen.add(('revoke', jti, revoked_at))
+      self.watermark = max(self.watermark, revoked_at)
+    for identity, updated_at in generations:
+      seen.add(('generation', identity, updated_at))
+      self.watermark = max(self.watermark, updated_at)
+    events = [(op, key) for op, key, _ in seen - self.seen]
+    self.seen = seen
+    return events
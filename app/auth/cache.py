@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCache:
+  """
+  Bounded LRU cache whose entries expire after ttl seconds.
+  It caches the result of Storage.get, so None is a valid value and
+  get returns (hit, value).
+  """
+  def __init__(self, max_entries, ttl):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.invalidations = 0
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None or entry[1] <= time.time():
+        self.misses += 1
+        return False, None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return True, entry[0]
+
+  def set(self, key, value, expires_at=None):
+    """Entry expires at expires_at if it's earlier than ttl."""
+    with self.lock:
+      expires = time.time() + self.ttl
+      if expires_at is not None:
+        expires = min(expires, expires_at)
+      self.entries[key] = (value, expires)
+      self.entries.move_to_end(key)
+      if len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  def invalidate(self, key):
+    with self.lock:
+      if self.entries.pop(key, None) is not None:
+        self.invalidations += 1
+
+  def clear(self):
+    with self.lock:
+      self.invalidations += len(self.entries)
+      self.entries = OrderedDict()
+
+  def stats(self):
+    total = self.hits + self.misses
+    return {
+      'entries': len(self.entries),
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / total if total > 0 else 0.0,
+      'invalidations': self.invalidations,
+    }
@@ -0,0 +1,244 @@
+"""
+Feed of revocations for services which check tokens by themselves, like
+API gateways. They load a snapshot of revoked jtis tagged with a sequence,
+and then poll revocations since the sequence.
+
+Each revocation is appended with the next sequence after it's written to
+storage, so a snapshot scanned after reading the sequence has every
+revocation up to the sequence. With database storage, it's appended in the
+transaction which writes it. jti is always 16 bytes in the feed, see
+jti_to_bytes of app.auth.blacklist.
+
+since(sequence, limit) returns (sequence, keys, reset). reset is True when
+revocations since the given sequence are not in the feed any more, because
+they were trimmed or blacklist was flushed, or the sequence is unknown to
+the feed, e.g. after memory storage was restarted. Then the reader must
+load a snapshot again.
+
+Only revocations are fed. Deletion of tokens from blacklist and bumps of
+generations are not.
+"""
+import collections
+import datetime
+import itertools
+import threading
+
+import redis
+from sqlalchemy import func, select
+
+from app.models import db
+from app.models.revocation_event import RevocationEvent
+
+
+class MemoryFeed:
+  """Feed of this process, for memory storage."""
+  def __init__(self):
+    self.events = None
+
+  def init_app(self, app):
+    self.max_events = int(app.config.get('BLACKLIST_FEED_MAX_EVENTS', 100000))
+    self.events = collections.deque()
+    self.last = 0
+    self.floor = 0
+    self.lock = threading.Lock()
+
+  def append(self, keys):
+    with self.lock:
+      for key in keys:
+        self.last += 1
+        self.events.append((self.last, key))
+      while len(self.events) > self.max_events:
+        self.floor, _ = self.events.popleft()
+
+  def flush(self):
+    with self.lock:
+      self.last += 1
+      self.events.clear()
+      self.floor = self.last
+
+  def sequence(self):
+    return self.last
+
+  def since(self, sequence, limit):
+    with self.lock:
+      if sequence < self.floor or sequence > self.last:
+        return self.last, [], True
+      # Sequences of events are consecutive from floor + 1.
+      start = max(sequence - self.floor, 0)
+      events = list(itertools.islice(self.events, start, start + limit))
+      last = events[-1][0] if len(events) == limit else self.last
+      return max(last, sequence), [key for _, key in events], False
+
+  def stats(self):
+    return {'sequence': self.last, 'floor': self.floor, 'events': len(self.events)}
+
+
+class RedisFeed:
+  """
+  Events are members of a sorted set scored by sequence. A jti revoked
+  again only moves to the later sequence. Scripts keep sequence, events and
+  floor consistent without a round trip for each.
+  """
+  append_script = """
+local sequence = redis.call('INCRBY', KEYS[1], #ARGV - 1)
+local first = sequence - #ARGV + 2
+for i = 2, #ARGV do
+  redis.call('ZADD', KEYS[2], first + i - 2, ARGV[i])
+end
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[1])
+if excess > 0 then
+  local dropped = redis.call('ZRANGE', KEYS[2], excess - 1, excess - 1, 'WITHSCORES')
+  redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+  redis.call('SET', KEYS[3], dropped[2])
+end
+return sequence
+"""
+
+  flush_script = """
+local sequence = redis.call('INCR', KEYS[1])
+redis.call('UNLINK', KEYS[2])
+redis.call('SET', KEYS[3], sequence)
+return sequence
+"""
+
+  def __init__(self):
+    self.storage = None
+
+  def init_app(self, app):
+    host = app.config['REDIS_HOST']
+    password = app.config['REDIS_PASSWORD']
+    port = app.config['REDIS_PORT']
+    db = app.config['REDIS_DB_INDEX']
+
+    prefix = app.config.get('REDIS_KEY_PREFIX', '')
+    self.keys = [prefix + 'feed:sequence', prefix + 'feed:events', prefix + 'feed:floor']
+    self.max_events = int(app.config.get('BLACKLIST_FEED_MAX_EVENTS', 100000))
+    timeout = app.config.get('BLACKLIST_STORAGE_TIMEOUT')
+    self.storage = redis.StrictRedis(
+        host=host, port=port, db=db, password=password,
+        socket_timeout=timeout, socket_connect_timeout=timeout)
+    self.append_events = self.storage.register_script(self.append_script)
+    self.flush_events = self.storage.register_script(self.flush_script)
+
+  def append(self, keys):
+    if keys:
+      self.append_events(keys=self.keys, args=[self.max_events, *keys])
+
+  def flush(self):
+    self.flush_events(keys=self.keys)
+
+  def sequence(self):
+    return int(self.storage.get(self.keys[0]) or 0)
+
+  def since(self, sequence, limit):
+    sequence_key, events_key, floor_key = self.keys
+    pipeline = self.storage.pipeline(transaction=True)
+    pipeline.get(sequence_key)
+    pipeline.get(floor_key)
+    pipeline.zrangebyscore(
+        events_key, f'({sequence}', '+inf', start=0, num=limit, withscores=True)
+    last, floor, events = pipeline.execute()
+    last = int(last or 0)
+    if sequence < int(floor or 0) or sequence > last:
+      return last, [], True
+    if len(events) == limit:
+      last = int(events[-1][1])
+    return max(last, sequence), [key for key, _ in events], False
+
+  def stats(self):
+    sequence_key, events_key, floor_key = self.keys
+    pipeline = self.storage.pipeline(transaction=False)
+    pipeline.get(sequence_key)
+    pipeline.get(floor_key)
+    pipeline.zcard(events_key)
+    sequence, floor, events = pipeline.execute()
+    return {'sequence': int(sequence or 0), 'floor': int(floor or 0), 'events': events}
+
+
+class DatabaseFeed:
+  """
+  Events are rows of revocation_events, and the sequence is their id.
+  A row with NULL key marks a flush.
+
+  Ids are allocated in the order of insertion but become visible in the
+  order of commit, so a gap in ids may be filled later by a transaction
+  still running. since() stops before a gap followed by rows younger than
+  overlap. Gaps left by rolled back transactions are skipped after that.
+  """
+  overlap = datetime.timedelta(seconds=2)
+
+  def __init__(self):
+    self.appended = 0
+
+  def init_app(self, app):
+    self.max_events = int(app.config.get('BLACKLIST_FEED_MAX_EVENTS', 100000))
+    self.trim_interval = max(self.max_events // 10, 1)
+
+  def append(self, keys, commit=True):
+    """
+    With commit False, events are inserted in the transaction of the session
+    for the caller to commit, and trim_if_due should be called after that.
+    """
+    if not keys:
+      return
+    db.session.execute(RevocationEvent.__table__.insert(), [{'key': key} for key in keys])
+    self.appended += len(keys)
+    if commit:
+      db.session.commit()
+      self.trim_if_due()
+
+  def trim_if_due(self):
+    if self.appended >= self.trim_interval:
+      self.appended = 0
+      self.trim()
+
+  def flush(self):
+    db.session.execute(RevocationEvent.__table__.insert(), [{'key': None}])
+    db.session.commit()
+    self.trim(keep=1)
+
+  def trim(self, keep=None):
+    """Delete old events, keeping the latest one which holds the sequence."""
+    keep = self.max_events if keep is None else keep
+    last = self.sequence()
+    RevocationEvent.query.filter(RevocationEvent.id <= last - keep)\
+        .delete(synchronize_session=False)
+    db.session.commit()
+
+  def sequence(self):
+    return db.session.query(func.coalesce(func.max(RevocationEvent.id), 0)).scalar()
+
+  def since(self, sequence, limit):
+    query = db.session.query(func.min(RevocationEvent.id), func.max(RevocationEvent.id))
+    floor, last = query.one()
+    if sequence > (last or 0) or (floor is not None and sequence < floor - 1):
+      return last or 0, [], True
+
+    now = db.session.execute(select([func.now()])).scalar()
+    query = db.session.query(
+        RevocationEvent.id, RevocationEvent.key, RevocationEvent.created_at)\
+        .filter(RevocationEvent.id > sequence)\
+        .order_by(RevocationEvent.id)\
+        .limit(limit)
+
+    last = sequence
+    keys = []
+    for id, key, created_at in query:
+      if id != last + 1 and created_at is not None and created_at > now - self.overlap:
+        break
+      if key is None:
+        return self.sequence(), [], True
+      last = id
+      keys.append(key)
+    return last, keys, False
+
+  def stats(self):
+    query = db.session.query(
+        func.max(RevocationEvent.id), func.min(RevocationEvent.id),
+        func.count(RevocationEvent.id))
+    last, first, count = query.one()
+    return {
+      'sequence': last or 0,
+      'floor': 0 if first is None else first - 1,
+      'events': count,
+    }
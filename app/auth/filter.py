@@ -0,0 +1,59 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+  """
+  If might_contain returns False, the key was definitely not added.
+  Number of bits and hashes are derived from expected number of
+  entries(capacity) and acceptable false positive rate(error_rate).
+
+  Entries can't be removed. Rebuild the filter to drop them.
+  Adding the same key twice doesn't count it twice, so broadcast events
+  delivered more than once don't skew false_positive_rate.
+  """
+  def __init__(self, capacity, error_rate):
+    self.capacity = capacity
+    self.error_rate = error_rate
+    self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    self.hashes = max(1, round(self.size / capacity * math.log(2)))
+    self.bits = bytearray((self.size + 7) // 8)
+    self.entries = 0
+    self.lock = threading.Lock()
+
+  def indexes(self, key):
+    if isinstance(key, str):
+      key = key.encode()
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+  def add(self, key):
+    indexes = self.indexes(key)
+    with self.lock:
+      added = False
+      for i in indexes:
+        if not self.bits[i >> 3] & (1 << (i & 7)):
+          self.bits[i >> 3] |= 1 << (i & 7)
+          added = True
+      if added:
+        self.entries += 1
+
+  def might_contain(self, key):
+    bits = self.bits
+    return all(bits[i >> 3] & (1 << (i & 7)) for i in self.indexes(key))
+
+  def false_positive_rate(self):
+    """Estimated from the number of entries currently in the filter."""
+    return (1 - math.exp(-self.hashes * self.entries / self.size)) ** self.hashes
+
+  def stats(self):
+    return {
+      'capacity': self.capacity,
+      'size': self.size,
+      'hashes': self.hashes,
+      'entries': self.entries,
+      'estimated_false_positive_rate': self.false_positive_rate(),
+    }
@@ -0,0 +1,274 @@
+"""
+Append-only log and snapshot which make MemoryStorage survive restart.
+
+Writes are appended to {path}.log. They are buffered and written with fsync
+in batches, at most every fsync_interval seconds. Periodically the whole
+blacklist is written to {path}.snapshot and the log is compacted, so that
+the log never grows beyond the writes of one snapshot interval.
+On startup, the snapshot is memory-mapped and the log is replayed over it.
+{path}.lock is locked while a process uses them.
+
+Every record of the log sets a value, rather than changes it, so replaying
+records which are already in the snapshot leaves the same result. Thus a
+snapshot is written from a copy of the blacklist while writes go on, and
+only the records before the copy are cut from the log afterwards.
+
+Log record
+==========
+op(uint8) + flags(uint8) + key length(uint16) + expires_at(float64) + key.
+op is one of SET, DELETE, FLUSH and GENERATION. flags tells if the entry
+is revoked, and if the key is bytes rather than str. For GENERATION, key is
+the identity and expires_at holds its generation.
+
+Snapshot
+========
+header : magic(8 bytes) + number of entries(uint64)
+         + number of generations(uint64) + size of keys(uint64)
+         + number of slots of index(uint64).
+columns : value(float64) and offset of key(uint64) of every record, index,
+          and flags(uint8) of every record, one column after another, and
+          then keys concatenated. offsets has one more item at the end.
+Records of entries come first, sorted by expires_at which is their value.
+Records of generations follow, whose value is the generation.
+index is an open-addressing table by crc32 of key with linear probing,
+whose slot is record number of an entry + 1(uint32), or 0 if empty.
+Snapshot is looked up where it's mapped, so loading it takes no time
+whatever its size. Columns are in native byte order since the file never
+leaves the node.
+"""
+import array
+import bisect
+import fcntl
+import mmap
+import operator
+import os
+import struct
+import threading
+import zlib
+
+from app.utils.exceptions import StorageLocked
+
+
+SET = 1
+DELETE = 2
+FLUSH = 3
+GENERATION = 4
+
+REVOKED = 1
+BYTES_KEY = 2
+
+RECORD = struct.Struct('<BBHd')
+MAGIC = b'BLKSNP02'
+HEADER = struct.Struct('<8sQQQQ')
+
+
+def to_key(jti):
+  """Return (key, flags) of jti as stored in log and snapshot."""
+  if isinstance(jti, bytes):
+    return jti, BYTES_KEY
+  return jti.encode(), 0
+
+
+def index_slots(count):
+  """Number of slots of index, a power of 2 at least twice count."""
+  slots = 2
+  while slots < 2 * count:
+    slots <<= 1
+  return slots
+
+
+class Snapshot:
+  """Snapshot file mapped in memory. It never changes once written."""
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, self.count, generation_count, keys_size, slots = HEADER.unpack_from(self.mm, 0)
+    if magic != MAGIC:
+      raise ValueError(f'{path} is not a blacklist snapshot.')
+
+    self.total = self.count + generation_count
+    self.mask = slots - 1
+    view = memoryview(self.mm)
+    offset = HEADER.size
+    self.values = view[offset:offset + 8 * self.total].cast('d')
+    offset += 8 * self.total
+    self.offsets = view[offset:offset + 8 * (self.total + 1)].cast('Q')
+    offset += 8 * (self.total + 1)
+    self.index = view[offset:offset + 4 * slots].cast('I')
+    offset += 4 * slots
+    self.flags = view[offset:offset + self.total]
+    offset += self.total
+    self.keys = view[offset:offset + keys_size]
+
+  def find(self, jti):
+    """Return record number of jti, or None."""
+    key, flags = to_key(jti)
+    slot = zlib.crc32(key) & self.mask
+    while True:
+      n = self.index[slot]
+      if n == 0:
+        return None
+      n -= 1
+      if self.keys[self.offsets[n]:self.offsets[n + 1]] == key and \
+          self.flags[n] & BYTES_KEY == flags:
+        return n
+      slot = (slot + 1) & self.mask
+
+  def entry(self, n):
+    """Return (revoked, expires_at) of record n."""
+    return bool(self.flags[n] & REVOKED), self.values[n]
+
+  def key(self, n):
+    key = self.keys[self.offsets[n]:self.offsets[n + 1]].tobytes()
+    return key if self.flags[n] & BYTES_KEY else key.decode()
+
+  def first_alive(self, now):
+    """Return number of the first record of entry which expires after now."""
+    return bisect.bisect_right(self.values, now, 0, self.count)
+
+  def generations(self):
+    return {self.key(n): int(self.values[n]) for n in range(self.count, self.total)}
+
+
+class Journal:
+  def __init__(self, path, fsync_interval=1.0):
+    self.log_path = f'{path}.log'
+    self.snapshot_path = f'{path}.snapshot'
+    self.fsync_interval = fsync_interval
+    self.buffer = bytearray()
+    self.lock = threading.Lock()
+    self.lock_fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+      fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      os.close(self.lock_fd)
+      msg = f'{path} is used by another process.'
+      raise StorageLocked(msg)
+    self.fd = os.open(self.log_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+    self.written = os.fstat(self.fd).st_size
+
+  def load_snapshot(self):
+    """Return Snapshot, or None if it's not taken yet."""
+    if not os.path.exists(self.snapshot_path):
+      return None
+    return Snapshot(self.snapshot_path)
+
+  def replay(self):
+    """
+    Return records of log as list of (op, jti, revoked, value), and cut off
+    a record torn by crash if any.
+    """
+    with open(self.log_path, 'rb') as f:
+      data = f.read()
+
+    records = []
+    offset = 0
+    while offset + RECORD.size <= len(data):
+      op, flags, length, value = RECORD.unpack_from(data, offset)
+      end = offset + RECORD.size + length
+      if end > len(data):
+        break
+      key = data[offset + RECORD.size:end]
+      key = key if flags & BYTES_KEY else key.decode()
+      records.append((op, key, bool(flags & REVOKED), value))
+      offset = end
+
+    if offset < len(data):
+      os.ftruncate(self.fd, offset)
+      self.written = offset
+    return records
+
+  def append(self, op, jti=None, revoked=False, expires_at=0.0):
+    key, flags = (b'', 0) if jti is None else to_key(jti)
+    flags |= REVOKED if revoked else 0
+    with self.lock:
+      self.buffer += RECORD.pack(op, flags, len(key), expires_at)
+      self.buffer += key
+    if self.fsync_interval <= 0:
+      self.flush()
+
+  def flush(self):
+    """Write buffered records and fsync."""
+    with self.lock:
+      if not self.buffer:
+        return
+      buffer, self.buffer = self.buffer, bytearray()
+      os.write(self.fd, buffer)
+      os.fsync(self.fd)
+      self.written += len(buffer)
+
+  def position(self):
+    """Return position in log after the last appended record."""
+    with self.lock:
+      return self.written + len(self.buffer)
+
+  def snapshot(self, entries, generations, position):
+    """
+    Write snapshot of entries, which are (jti, revoked, expires_at), and
+    generations, which is dict of identity to generation, and cut records
+    before position from log. They must be a copy of the blacklist taken
+    when log was at position, and writes may go on meanwhile.
+    """
+    entries = sorted(entries, key=operator.itemgetter(2))
+    records = [(jti, REVOKED if revoked else 0, value) for jti, revoked, value in entries]
+    records += [(identity, 0, value) for identity, value in generations.items()]
+
+    values = array.array('d', [record[2] for record in records])
+    offsets = array.array('Q', [0])
+    flags = bytearray()
+    keys = bytearray()
+    for jti, flag, _ in records:
+      key, key_flags = to_key(jti)
+      keys += key
+      offsets.append(len(keys))
+      flags.append(flag | key_flags)
+
+    slots = index_slots(len(entries))
+    index = array.array('I', bytes(4 * slots))
+    mask = slots - 1
+    for n in range(len(entries)):
+      slot = zlib.crc32(keys[offsets[n]:offsets[n + 1]]) & mask
+      while index[slot]:
+        slot = (slot + 1) & mask
+      index[slot] = n + 1
+
+    tmp_path = f'{self.snapshot_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+      f.write(HEADER.pack(MAGIC, len(entries), len(generations), len(keys), slots))
+      f.write(values.tobytes())
+      f.write(offsets.tobytes())
+      f.write(index.tobytes())
+      f.write(flags)
+      f.write(keys)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, self.snapshot_path)
+    self.compact(position)
+
+  def compact(self, position):
+    """
+    Replace log with its records after position. Until log is replaced,
+    records before position are replayed over the snapshot, which is harmless.
+    """
+    with self.lock:
+      # Records before position may still be buffered.
+      start = min(position, self.written)
+      with open(self.log_path, 'rb') as f:
+        f.seek(start)
+        tail = (f.read() + self.buffer)[position - start:]
+
+      tmp_path = f'{self.log_path}.tmp'
+      with open(tmp_path, 'wb') as f:
+        f.write(tail)
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_path, self.log_path)
+      os.close(self.fd)
+      self.fd = os.open(self.log_path, os.O_RDWR | os.O_APPEND)
+      self.buffer = bytearray()
+      self.written = len(tail)
+
+  def close(self):
+    self.flush()
+    os.close(self.fd)
+    os.close(self.lock_fd)
@@ -1,9 +1,12 @@
 import redis
-from flask import jsonify, make_response
+from flask import g, jsonify, make_response
 from flask_jwt_extended import JWTManager
+from flask_jwt_extended.config import config
 from http import HTTPStatus
+from jwt.exceptions import InvalidTokenError
 
 from app.auth.blacklist import blacklist
+from app.auth.keys import key_ring
 
 jwt = JWTManager()
 
@@ -40,7 +43,91 @@ def token_is_revoked():
   return make_response(jsonify(ret), status)
 
 
+@jwt.user_claims_loader
+def add_generation_to_claims(identity):
+  if not blacklist.generation_enabled:
+    return {}
+  return { 'generation': blacklist.get_generation(identity) }
+
+
+@jwt.additional_headers_loader
+def add_kid_to_headers(identity):
+  """Called before encode_key, which signs with the key chosen here."""
+  if not key_ring.enabled:
+    return None
+  key = key_ring.signing_key()
+  g.jwt_signing_key = key
+  return { 'kid': key.kid }
+
+
+@jwt.encode_key_loader
+def encode_key(identity):
+  if not key_ring.enabled:
+    return config.encode_key
+  key = g.pop('jwt_signing_key', None) or key_ring.signing_key()
+  return key.private_key
+
+
+@jwt.decode_key_loader
+def decode_key(claims, headers):
+  """
+  With JWT_SIGNING_KEYS, tokens without kid are accepted only if they are
+  signed by JWT_SECRET_KEY with an algorithm of JWT_DECODE_ALGORITHMS,
+  which is for tokens issued before switching to asymmetric algorithm.
+  """
+  if not key_ring.enabled:
+    return config.decode_key
+  algorithm = headers.get('alg', '')
+  if 'kid' in headers:
+    return key_ring.verification_key(headers['kid'], algorithm)
+  if algorithm.startswith('HS') and algorithm in config.decode_algorithms:
+    return config._secret_key
+  raise InvalidTokenError('Missing kid in header')
+
+
 @jwt.token_in_blacklist_loader
 def check_if_token_in_blacklist(decrypted_token):
+  identity = decrypted_token[config.identity_claim_key]
+  generation = decrypted_token.get(config.user_claims_key, {}).get('generation', 0)
+  if blacklist.has_stale_generation(identity, generation):
+    return True
+
   jti = decrypted_token['jti']
-  return blacklist.has_revoked(jti)
+  return blacklist.has_revoked(jti, exp=decrypted_token['exp'])
+
+
+def check_if_tokens_in_blacklist(decrypted_tokens):
+  """
+  Batch version of check_if_token_in_blacklist, which looks up jtis with one
+  call of storage. Tokens of types not in JWT_BLACKLIST_TOKEN_CHECKS are not
+  checked, like flask_jwt_extended does.
+  """
+  if not config.blacklist_enabled:
+    return [False] * len(decrypted_tokens)
+
+  checked_types = []
+  if config.blacklist_access_tokens:
+    checked_types.append('access')
+  if config.blacklist_refresh_tokens:
+    checked_types.append('refresh')
+
+  revoked = [False] * len(decrypted_tokens)
+  checked = [i for i, token in enumerate(decrypted_tokens) if token['type'] in checked_types]
+  generations = [
+    (decrypted_tokens[i][config.identity_claim_key],
+     decrypted_tokens[i].get(config.user_claims_key, {}).get('generation', 0))
+    for i in checked
+  ]
+  candidates = []
+  for i, stale in zip(checked, blacklist.has_stale_generations(generations)):
+    if stale:
+      revoked[i] = True
+    else:
+      candidates.append(i)
+
+  if candidates:
+    jtis = [decrypted_tokens[i]['jti'] for i in candidates]
+    exps = [decrypted_tokens[i]['exp'] for i in candidates]
+    for i, value in zip(candidates, blacklist.has_revoked_many(jtis, exps)):
+      revoked[i] = value
+  return revoked
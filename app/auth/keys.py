@@ -0,0 +1,173 @@
+"""
+Keys to sign tokens with asymmetric algorithms, identified by kid in the
+header of tokens, so that other services verify tokens by public keys of
+the JWKS endpoint instead of calling back this API.
+
+Each key of JWT_SIGNING_KEYS is a dict of
+- kid : Unique id of the key.
+- private_key or private_key_path : PEM of the private key, or its path.
+- activate_at : Time from which tokens are signed with the key. Optional.
+- retire_at : Time from which tokens are not signed with the key. Optional.
+Times are epoch seconds or ISO 8601 strings in UTC.
+
+Tokens are signed with the active key of the latest activate_at. A key is
+published and accepted from when it's added until the tokens signed with it
+expire, i.e. retire_at + JWT_REFRESH_TOKEN_EXPIRES. So a new key should be
+added with activate_at later than JWKS max age, for verifiers to fetch it
+before the first token signed with it.
+"""
+import datetime
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from jwt.exceptions import InvalidTokenError
+from jwt.utils import base64url_encode
+
+
+ALGORITHMS = [
+  'RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512', 'ES256', 'ES384', 'ES512',
+]
+
+# Curve names of JWK, and sizes of their coordinates in bytes.
+CURVES = {
+  'secp256r1': ('P-256', 32),
+  'secp384r1': ('P-384', 48),
+  'secp521r1': ('P-521', 66),
+}
+
+
+def int_to_base64url(value, size=None):
+  size = (value.bit_length() + 7) // 8 if size is None else size
+  return base64url_encode(value.to_bytes(size, 'big')).decode()
+
+
+def to_timestamp(value):
+  if value is None or isinstance(value, (int, float)):
+    return value
+  moment = datetime.datetime.fromisoformat(value)
+  if moment.tzinfo is None:
+    moment = moment.replace(tzinfo=datetime.timezone.utc)
+  return moment.timestamp()
+
+
+class SigningKey:
+  def __init__(self, kid, algorithm, private_key, activate_at=None, retire_at=None):
+    self.kid = kid
+    self.algorithm = algorithm
+    self.private_key = private_key
+    self.public_key = private_key.public_key()
+    self.activate_at = activate_at
+    self.retire_at = retire_at
+
+  def is_active(self, now):
+    return (self.activate_at is None or self.activate_at <= now) and \
+        (self.retire_at is None or now < self.retire_at)
+
+  def to_jwk(self):
+    """Written here since PyJWT of this version can't export EC keys."""
+    numbers = self.public_key.public_numbers()
+    if isinstance(self.public_key, ec.EllipticCurvePublicKey):
+      crv, size = CURVES[numbers.curve.name]
+      jwk = {
+        'kty': 'EC',
+        'crv': crv,
+        'x': int_to_base64url(numbers.x, size),
+        'y': int_to_base64url(numbers.y, size),
+      }
+    else:
+      jwk = {
+        'kty': 'RSA',
+        'n': int_to_base64url(numbers.n),
+        'e': int_to_base64url(numbers.e),
+      }
+    jwk.update({'kid': self.kid, 'use': 'sig', 'alg': self.algorithm})
+    return jwk
+
+
+class KeyRing:
+  """
+  With a symmetric JWT_ALGORITHM, it's empty and JWT_SECRET_KEY is used.
+  version is incremented every time keys are loaded.
+  """
+  def __init__(self):
+    self.keys = dict()
+    self.version = 0
+
+  def init_app(self, app):
+    self.keys = dict()
+    self.version += 1
+    self.algorithm = app.config.get('JWT_ALGORITHM', 'HS256')
+    self.max_age = int(app.config.get('JWT_JWKS_MAX_AGE', 300))
+    self.token_expires = max(
+        int(app.config['JWT_ACCESS_TOKEN_EXPIRES']),
+        int(app.config['JWT_REFRESH_TOKEN_EXPIRES']))
+    if self.algorithm.startswith('HS'):
+      return
+
+    if self.algorithm == 'EdDSA':
+      msg = 'EdDSA is not supported by PyJWT of this version.'
+      raise ValueError(msg)
+    if self.algorithm not in ALGORITHMS:
+      msg = f'Not supported JWT algorithm: {self.algorithm}.'
+      raise ValueError(msg)
+
+    for config in app.config.get('JWT_SIGNING_KEYS', []):
+      key = self.load_key(config)
+      if key.kid in self.keys:
+        msg = f'Duplicate kid of JWT signing key: {key.kid}.'
+        raise ValueError(msg)
+      self.keys[key.kid] = key
+    if not self.keys:
+      msg = f'JWT_SIGNING_KEYS must be set to use {self.algorithm}.'
+      raise ValueError(msg)
+
+  def load_key(self, config):
+    pem = config.get('private_key')
+    if pem is None:
+      with open(config['private_key_path'], 'rb') as f:
+        pem = f.read()
+    elif isinstance(pem, str):
+      pem = pem.encode()
+    private_key = load_pem_private_key(pem, password=None, backend=default_backend())
+    return SigningKey(
+        config['kid'], self.algorithm, private_key,
+        activate_at=to_timestamp(config.get('activate_at')),
+        retire_at=to_timestamp(config.get('retire_at')))
+
+  @property
+  def enabled(self):
+    return bool(self.keys)
+
+  def signing_key(self, now=None):
+    now = time.time() if now is None else now
+    active = [key for key in self.keys.values() if key.is_active(now)]
+    if not active:
+      msg = 'No JWT signing key is active.'
+      raise RuntimeError(msg)
+    return max(active, key=lambda key: key.activate_at or 0)
+
+  def is_published(self, key, now):
+    return key.retire_at is None or now < key.retire_at + self.token_expires
+
+  def verification_key(self, kid, algorithm, now=None):
+    """Raise InvalidTokenError unless kid is of a published key of algorithm."""
+    now = time.time() if now is None else now
+    key = self.keys.get(kid)
+    if key is None or not self.is_published(key, now):
+      raise InvalidTokenError(f'Unknown kid: {kid}')
+    if algorithm != key.algorithm:
+      raise InvalidTokenError(f'Algorithm {algorithm} does not match kid: {kid}')
+    return key.public_key
+
+  def jwks(self, now=None):
+    now = time.time() if now is None else now
+    return {
+      'keys': [
+        key.to_jwk() for key in self.keys.values() if self.is_published(key, now)
+      ],
+    }
+
+
+key_ring = KeyRing()
@@ -0,0 +1,111 @@
+"""
+WSGI middleware which answers GET /api/v1_0/token/ without Flask routing,
+Flask-RESTful dispatch and @jwt_required, since it only tells whether the
+access token is valid and is called far more than any other endpoint.
+
+Token is checked in the same steps as @jwt_required, and responses are made
+by the same loaders of app.auth.jwt, so they are identical to the ones of
+TokenApi.get. Any error not handled by the loaders is left to the app,
+which checks the token again and responds as usual.
+"""
+import logging
+from re import split
+
+from flask import jsonify, make_response, url_for
+from flask_jwt_extended.config import config
+from flask_jwt_extended.exceptions import (
+    InvalidHeaderError, JWTDecodeError, NoAuthorizationError, RevokedTokenError,
+    WrongTokenError
+)
+from flask_jwt_extended.utils import (
+    verify_token_claims, verify_token_not_blacklisted, verify_token_type
+)
+from http import HTTPStatus
+from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+
+try:
+  from flask import _app_ctx_stack as ctx_stack
+except ImportError:
+  from flask import _request_ctx_stack as ctx_stack
+
+from app.auth.jwt import (
+    invalid_token, token_is_expired, token_is_revoked, token_not_found
+)
+from app.auth.token_cache import verified_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenValidationMiddleware:
+  def __init__(self, app, wsgi_app, endpoint='api.token'):
+    self.app = app
+    self.wsgi_app = wsgi_app
+    with app.test_request_context():
+      self.path = url_for(endpoint)
+    self.handled = 0
+    self.passed = 0
+
+  def __call__(self, environ, start_response):
+    if environ.get('PATH_INFO') != self.path or environ['REQUEST_METHOD'] != 'GET':
+      return self.wsgi_app(environ, start_response)
+
+    try:
+      with self.app.app_context():
+        response = self.validate(environ)
+    except Exception as e:
+      logger.debug(f'Token validation is left to app. {str(type(e))}: {str(e)}')
+      response = None
+    if response is None:
+      self.passed += 1
+      return self.wsgi_app(environ, start_response)
+    self.handled += 1
+    return response(environ, start_response)
+
+  def validate(self, environ):
+    """Return response, or None if the request must be handled by app."""
+    if config.token_location != ['headers']:
+      return None
+
+    try:
+      token = self.token_from_header(environ)
+      decoded_token = verified_tokens.decode_token(token)
+      verify_token_type(decoded_token, expected_type='access')
+      verify_token_not_blacklisted(decoded_token, 'access')
+      verify_token_claims(decoded_token)
+    except NoAuthorizationError as e:
+      return token_not_found(str(e))
+    except ExpiredSignatureError:
+      return token_is_expired(ctx_stack.top.expired_jwt)
+    except RevokedTokenError:
+      return token_is_revoked()
+    except (InvalidHeaderError, InvalidTokenError, JWTDecodeError, WrongTokenError) as e:
+      return invalid_token(str(e))
+    return make_response(jsonify(), HTTPStatus.OK)
+
+  def token_from_header(self, environ):
+    """Same as flask_jwt_extended.view_decorators._decode_jwt_from_headers."""
+    header_name = config.header_name
+    header_type = config.header_type
+
+    key = 'HTTP_' + header_name.upper().replace('-', '_')
+    auth_header = environ.get(key)
+    if not auth_header:
+      raise NoAuthorizationError(f'Missing {header_name} Header')
+
+    if header_type:
+      field_values = split(r',\s*', auth_header)
+      jwt_header = [s for s in field_values if s.split()[0] == header_type]
+      if len(jwt_header) < 1 or len(jwt_header[0].split()) != 2:
+        msg = f"Bad {header_name} header. Expected value '{header_type} <JWT>'"
+        raise InvalidHeaderError(msg)
+      return jwt_header[0].split()[1]
+
+    parts = auth_header.split()
+    if len(parts) != 1:
+      msg = f"Bad {header_name} header. Expected value '<JWT>'"
+      raise InvalidHeaderError(msg)
+    return parts[0]
+
+  def stats(self):
+    return {'handled': self.handled, 'passed': self.passed}
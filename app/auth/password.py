@@ -0,0 +1,257 @@
+"""
+Hashing of passwords by the policy of PASSWORD_HASH_METHOD and
+PASSWORD_SALT_LENGTH, so that its cost is tuned per environment.
+
+Hashes are in the format of werkzeug.security, method$salt$hash, where
+method is one of
+- pbkdf2:<hash function>:<iterations> : Hashed by werkzeug.security.
+- scrypt:<n>:<r>:<p> : Hashed by hashlib.scrypt, which werkzeug of this
+  version doesn't support.
+Hashes of any of them are verified, whatever the policy is, and a hash made
+by another policy is replaced on the next successful login.
+
+If PASSWORD_HASH_WORKERS > 0, hashing runs in a pool of as many processes,
+so that it doesn't hold GIL of the worker serving the other requests. At
+most PASSWORD_HASH_QUEUE_SIZE hashings wait for a free process, and the
+others raise HashingBusy at once instead of waiting. Processes are started
+by forkserver rather than forked from the worker, which runs threads and
+holds locked files and mapped memory of blacklist.
+
+A policy whose hashes don't fit in users.password is refused at start.
+"""
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS, check_password_hash, gen_salt, generate_password_hash
+)
+
+from app.models.user import User
+from app.utils.exceptions import HashingBusy
+
+
+logger = logging.getLogger(__name__)
+
+SCRYPT_DEFAULTS = (32768, 8, 1)
+SCRYPT_KEY_LENGTH = 32
+
+
+def normalize_method(method):
+  """Return method with all of its parameters, as it's written in hashes."""
+  name, _, params = method.partition(':')
+  params = [param for param in params.split(':') if param]
+  if name == 'pbkdf2':
+    if not params or params[0] not in hashlib.algorithms_available or len(params) > 2:
+      msg = f'Invalid password hash method: {method}.'
+      raise ValueError(msg)
+    iterations = int(params[1]) if len(params) == 2 else DEFAULT_PBKDF2_ITERATIONS
+    return f'pbkdf2:{params[0]}:{iterations}'
+  elif name == 'scrypt':
+    if len(params) not in (0, 3):
+      msg = f'Invalid password hash method: {method}.'
+      raise ValueError(msg)
+    n, r, p = [int(param) for param in params] if params else SCRYPT_DEFAULTS
+    return f'scrypt:{n}:{r}:{p}'
+  else:
+    msg = f'Not supported password hash method: {method}.'
+    raise ValueError(msg)
+
+
+def hash_length(method, salt_length):
+  """Length of hashes made by normalized method with salt_length."""
+  name, function = method.split(':')[:2]
+  if name == 'scrypt':
+    key_length = SCRYPT_KEY_LENGTH
+  else:
+    key_length = hashlib.new(function).digest_size
+  return len(method) + 1 + salt_length + 1 + key_length * 2
+
+
+def scrypt_hex(password, salt, method, length=SCRYPT_KEY_LENGTH):
+  n, r, p = [int(param) for param in method.split(':')[1:]]
+  key = hashlib.scrypt(
+      password.encode(), salt=salt.encode(), n=n, r=r, p=p,
+      maxmem=256 * n * r, dklen=length)
+  return key.hex()
+
+
+def make_hash(method, salt_length, password):
+  if method.startswith('scrypt:'):
+    salt = gen_salt(salt_length)
+    return f'{method}${salt}${scrypt_hex(password, salt, method)}'
+  return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def check_hash(pwhash, password):
+  method = pwhash.split('$', 1)[0]
+  if method.startswith('scrypt:') and pwhash.count('$') == 2:
+    _, salt, expected = pwhash.split('$')
+    actual = scrypt_hex(password, salt, method, length=len(expected) // 2)
+    return hmac.compare_digest(actual, expected)
+  return check_password_hash(pwhash, password)
+
+
+def timed(function, *args):
+  """Run in pool. Return (started_at, seconds, result)."""
+  started_at = time.time()
+  start = time.perf_counter()
+  result = function(*args)
+  return started_at, time.perf_counter() - start, result
+
+
+class PasswordHasher:
+  def __init__(self):
+    self.method = None
+
+  def init_app(self, app):
+    self.method = normalize_method(
+        app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'))
+    self.salt_length = int(app.config.get('PASSWORD_SALT_LENGTH', 8))
+    length = hash_length(self.method, self.salt_length)
+    if length > User.password.type.length:
+      msg = f'Hashes of {self.method} with salt of {self.salt_length} are {length} ' \
+          f'characters, longer than {User.password.type.length} of users.password.'
+      raise ValueError(msg)
+    self.lock = threading.Lock()
+    self.schemes = dict()
+    self.rehashes = 0
+    self.rehash_failures = 0
+    self.init_pool(app)
+
+  def init_pool(self, app):
+    """Processes are started at the first hashing, after gunicorn forks workers."""
+    self.pool = None
+    self.workers = int(app.config.get('PASSWORD_HASH_WORKERS', 0))
+    self.queue_size = int(app.config.get('PASSWORD_HASH_QUEUE_SIZE', 16))
+    self.slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.rejected = 0
+    self.waits = 0
+    self.wait_seconds = 0.0
+    self.max_wait_seconds = 0.0
+
+  def hash(self, password):
+    seconds, pwhash = self.run(make_hash, self.method, self.salt_length, password)
+    self.count(self.method, 'hashed', seconds)
+    return pwhash
+
+  def verify(self, pwhash, password):
+    seconds, verified = self.run(check_hash, pwhash, password)
+    method = pwhash.split('$', 1)[0]
+    self.count(method, 'verified' if verified else 'rejected', seconds)
+    return verified
+
+  def run(self, function, *args):
+    """Return (seconds, result) of function, run in pool if it's enabled."""
+    if self.workers == 0:
+      _, seconds, result = timed(function, *args)
+      return seconds, result
+
+    if not self.slots.acquire(blocking=False):
+      with self.lock:
+        self.rejected += 1
+      msg = 'Too many passwords are being hashed. Retry later.'
+      raise HashingBusy(msg)
+    try:
+      with self.lock:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.pool is None:
+          self.pool = ProcessPoolExecutor(
+              max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'))
+        pool = self.pool
+      submitted_at = time.time()
+      try:
+        started_at, seconds, result = pool.submit(timed, function, *args).result()
+      except BrokenProcessPool:
+        with self.lock:
+          if self.pool is pool:
+            self.pool = None
+        raise
+      wait = max(started_at - submitted_at, 0.0)
+      with self.lock:
+        self.waits += 1
+        self.wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+      return seconds, result
+    finally:
+      with self.lock:
+        self.in_flight -= 1
+      self.slots.release()
+
+  def needs_rehash(self, pwhash):
+    """Return True if pwhash was made by another policy than the current one."""
+    if pwhash.count('$') != 2:
+      return True
+    method, salt, _ = pwhash.split('$')
+    return method != self.method or len(salt) != self.salt_length
+
+  def rehash(self, pwhash, password, store):
+    """
+    Pass a new hash of password to store if pwhash needs rehash. Failure of
+    store is only logged, since password was verified anyway.
+    """
+    if not self.needs_rehash(pwhash):
+      return False
+    try:
+      store(self.hash(password))
+    except Exception as e:
+      with self.lock:
+        self.rehash_failures += 1
+      logger.warning(f'Failed to rehash password. {type(e)}: {str(e)}')
+      return False
+    with self.lock:
+      self.rehashes += 1
+    return True
+
+  def count(self, method, event, seconds):
+    with self.lock:
+      scheme = self.schemes.get(method)
+      if scheme is None:
+        scheme = {'hashed': 0, 'verified': 0, 'rejected': 0, 'seconds': 0.0}
+        self.schemes[method] = scheme
+      scheme[event] += 1
+      scheme['seconds'] += seconds
+
+  def stats(self):
+    schemes = dict()
+    for method, scheme in list(self.schemes.items()):
+      total = scheme['hashed'] + scheme['verified'] + scheme['rejected']
+      schemes[method] = {
+        **scheme,
+        'average_milliseconds': scheme['seconds'] / total * 1000 if total > 0 else 0.0,
+      }
+    return {
+      'method': self.method,
+      'salt_length': self.salt_length,
+      'schemes': schemes,
+      'rehashes': self.rehashes,
+      'rehash_failures': self.rehash_failures,
+      'pool': self.pool_stats(),
+    }
+
+  def pool_stats(self):
+    if self.workers == 0:
+      return None
+
+    return {
+      'workers': self.workers,
+      'queue_size': self.queue_size,
+      'in_flight': self.in_flight,
+      'queue_depth': max(self.in_flight - self.workers, 0),
+      'max_in_flight': self.max_in_flight,
+      'rejected': self.rejected,
+      'average_wait_milliseconds': \
+          self.wait_seconds / self.waits * 1000 if self.waits > 0 else 0.0,
+      'max_wait_milliseconds': self.max_wait_seconds * 1000,
+    }
+
+
+password_hasher = PasswordHasher()
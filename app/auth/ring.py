@@ -0,0 +1,59 @@
+"""
+Consistent hash ring to spread keys over multiple nodes.
+
+Each node is placed on the ring at `replicas` points, and a key belongs to
+the first node point at or after the hash of the key. Adding or removing a
+node only moves the keys between its points and the preceding ones, which
+is about 1/N of all keys for N nodes.
+"""
+import bisect
+import hashlib
+
+
+class HashRing:
+  def __init__(self, nodes=(), replicas=160):
+    self.replicas = replicas
+    self.nodes = []
+    self.points = []
+    self.owners = []
+    for node in nodes:
+      self.add(node)
+
+  def hash(self, key):
+    if isinstance(key, str):
+      key = key.encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+  def add(self, node):
+    if node in self.nodes:
+      return
+    self.nodes.append(node)
+    for i in range(self.replicas):
+      point = self.hash(f'{node}#{i}')
+      index = bisect.bisect(self.points, point)
+      self.points.insert(index, point)
+      self.owners.insert(index, node)
+
+  def remove(self, node):
+    if node not in self.nodes:
+      return
+    self.nodes.remove(node)
+    kept = [(p, o) for p, o in zip(self.points, self.owners) if o != node]
+    self.points = [p for p, _ in kept]
+    self.owners = [o for _, o in kept]
+
+  def get(self, key):
+    """Return node which key belongs to."""
+    if len(self.nodes) == 1:
+      return self.nodes[0]
+    if not self.nodes:
+      raise KeyError('No node is in the ring.')
+    index = bisect.bisect_left(self.points, self.hash(key))
+    return self.owners[index % len(self.owners)]
+
+  def group(self, keys):
+    """Return dict of node to list of indexes of keys which belong to it."""
+    groups = dict()
+    for i, key in enumerate(keys):
+      groups.setdefault(self.get(key), []).append(i)
+    return groups
@@ -0,0 +1,237 @@
+"""
+Open-addressing hash table stored in a memory-mapped file.
+
+Every process mapping the same file sees the same table, so gunicorn workers
+on one node share a single blacklist without a network round trip.
+Placing the file on tmpfs (e.g. /dev/shm) keeps it purely in memory.
+
+Layout
+======
+header : magic(8 bytes) + capacity(uint64) + used(uint64) + retry_at(float64)
+         + reserved, 64 bytes in total.
+slots  : capacity * (state(uint8) + padding(7 bytes) + value(float64) + key(16 bytes)).
+
+Keys are 16 bytes and are placed by linear probing. Deleted or expired slots
+are reused by later inserts, but never go back to EMPTY by themselves, and
+lookups probe until an EMPTY slot. used counts slots which are not EMPTY,
+and once it reaches MAX_LOAD of capacity, the table is rebuilt with only
+live entries, so probes stay short however many keys have passed through.
+If live entries alone fill MAX_LOAD, the table is not rebuilt again until
+retry_at, when the first of them expires, or until a delete.
+value is unix time at which the entry expires, except for COUNTER entries
+whose value is the count and which never expire.
+Processes are synchronized by flock on the file, and threads in a process
+by a lock since flock is held per open file.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+from app.utils.exceptions import StorageFull
+
+
+MAGIC = b'BLKLST01'
+HEADER = struct.Struct('<8sQQd32x')
+SLOT = struct.Struct('<B7xd16s')
+
+EMPTY = 0
+PROBATED = 1
+REVOKED = 2
+DELETED = 3
+COUNTER = 4
+
+MAX_LOAD = 0.75
+
+
+class SharedHashTable:
+  def __init__(self, path, capacity):
+    self.path = path
+    self.lock = threading.Lock()
+    self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    fcntl.flock(self.fd, fcntl.LOCK_EX)
+    try:
+      size = os.fstat(self.fd).st_size
+      if size < HEADER.size:
+        os.ftruncate(self.fd, HEADER.size + SLOT.size * capacity)
+        os.pwrite(self.fd, HEADER.pack(MAGIC, capacity, 0, 0.0), 0)
+      else:
+        magic, capacity, _, _ = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        if magic != MAGIC:
+          raise ValueError(f'{path} is not a blacklist table.')
+    finally:
+      fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    self.capacity = capacity
+    self.max_used = max(int(capacity * MAX_LOAD), 1)
+    self.mm = mmap.mmap(self.fd, HEADER.size + SLOT.size * capacity)
+
+  def get(self, key):
+    """Return (state, value) of key, or None if not exists or expired."""
+    with self.lock:
+      fcntl.flock(self.fd, fcntl.LOCK_SH)
+      try:
+        offset, state, value = self.find(key, time.time())[0]
+      finally:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+    return None if offset is None else (state, value)
+
+  def set(self, key, state, value):
+    """Value is unix time at which the entry expires."""
+    with self.lock:
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+      try:
+        offset = self.place(key, time.time())[1]
+        SLOT.pack_into(self.mm, offset, state, value, key)
+      finally:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+  def set_if_absent(self, key, state, value):
+    """Set only if key doesn't exist. Return True if key already existed."""
+    with self.lock:
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+      try:
+        found, offset = self.place(key, time.time())
+        if found[0] is not None:
+          return True
+        SLOT.pack_into(self.mm, offset, state, value, key)
+        return False
+      finally:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+  def increment(self, key):
+    """Increment COUNTER entry of key, creating it if not exists. Return the count."""
+    with self.lock:
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+      try:
+        found, offset = self.place(key, time.time())
+        count = found[2] if found[0] is not None else 0.0
+        SLOT.pack_into(self.mm, offset, COUNTER, count + 1, key)
+        return int(count + 1)
+      finally:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+  def delete(self, key):
+    with self.lock:
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+      try:
+        offset = self.find(key, time.time())[0][0]
+        if offset is not None:
+          SLOT.pack_into(self.mm, offset, DELETED, 0.0, key)
+          self.write_header(self.used(), 0.0)
+      finally:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+  def clear(self):
+    with self.lock:
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+      try:
+        self.mm[HEADER.size:] = bytes(SLOT.size * self.capacity)
+        self.write_header(0, 0.0)
+      finally:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+  def scan(self, count=4096):
+    """
+    Iterate live entries as (key, state, value).
+    Lock is released every count slots not to block writers for long.
+    """
+    for start in range(0, self.capacity, count):
+      entries = []
+      with self.lock:
+        fcntl.flock(self.fd, fcntl.LOCK_SH)
+        try:
+          now = time.time()
+          for i in range(start, min(start + count, self.capacity)):
+            offset = HEADER.size + SLOT.size * i
+            state, value, key = SLOT.unpack_from(self.mm, offset)
+            if state in (PROBATED, REVOKED) and value > now:
+              entries.append((key, state, value))
+        finally:
+          fcntl.flock(self.fd, fcntl.LOCK_UN)
+      yield from entries
+
+  def find(self, key, now):
+    """
+    Return ((offset, state, value), free_offset).
+    offset is None if key doesn't exist as a live entry. free_offset is the
+    first slot available for key, or None if table is full.
+    Must be called with flock held.
+    """
+    index = int.from_bytes(key[:8], 'little') % self.capacity
+    free = None
+    for i in range(self.capacity):
+      offset = HEADER.size + SLOT.size * ((index + i) % self.capacity)
+      state, value, slot_key = SLOT.unpack_from(self.mm, offset)
+      if state == EMPTY:
+        return (None, None, None), offset if free is None else free
+
+      live = state == COUNTER or (state != DELETED and value > now)
+      if slot_key == key:
+        if live:
+          return (offset, state, value), offset
+        return (None, None, None), offset if free is None else free
+      if not live and free is None:
+        free = offset
+    return (None, None, None), free
+
+  def place(self, key, now):
+    """
+    Return (found, offset) where found is what find returns and offset is
+    the slot to write key at. Rebuild the table if it's too loaded to take
+    key into an EMPTY slot. Must be called with LOCK_EX held.
+    """
+    found, free = self.find(key, now)
+    if found[0] is not None:
+      return found, found[0]
+    if free is not None and SLOT.unpack_from(self.mm, free)[0] != EMPTY:
+      return found, free
+
+    used = self.used()
+    if used >= self.max_used and now >= self.retry_at():
+      self.rebuild(now)
+      found, free = self.find(key, now)
+      used = self.used()
+    if free is None:
+      msg = f'Shared blacklist table({self.path}) is full.'
+      raise StorageFull(msg)
+    self.write_header(used + 1, self.retry_at())
+    return found, free
+
+  def rebuild(self, now):
+    """
+    Reinsert live entries into an empty table, dropping deleted and expired
+    slots. Must be called with LOCK_EX held.
+    """
+    entries = []
+    retry_at = float('inf')
+    for state, value, key in SLOT.iter_unpack(self.mm[HEADER.size:]):
+      if state == COUNTER:
+        entries.append((state, value, key))
+      elif state in (PROBATED, REVOKED) and value > now:
+        entries.append((state, value, key))
+        retry_at = min(retry_at, value)
+
+    self.mm[HEADER.size:] = bytes(SLOT.size * self.capacity)
+    for state, value, key in entries:
+      index = int.from_bytes(key[:8], 'little') % self.capacity
+      while SLOT.unpack_from(self.mm, HEADER.size + SLOT.size * index)[0] != EMPTY:
+        index = (index + 1) % self.capacity
+      SLOT.pack_into(self.mm, HEADER.size + SLOT.size * index, state, value, key)
+    self.write_header(len(entries), retry_at if len(entries) >= self.max_used else 0.0)
+
+  def used(self):
+    return HEADER.unpack_from(self.mm, 0)[2]
+
+  def retry_at(self):
+    return HEADER.unpack_from(self.mm, 0)[3]
+
+  def write_header(self, used, retry_at):
+    HEADER.pack_into(self.mm, 0, MAGIC, self.capacity, used, retry_at)
+
+  def close(self):
+    self.mm.close()
+    os.close(self.fd)
@@ -0,0 +1,83 @@
+"""
+Cache of decoded claims of tokens which passed verification, keyed by
+digest of the raw token, so that a token sent again and again by a client
+is verified and decoded once per worker. Entries expire at exp of tokens.
+
+Only decoding is cached. Revocation is still checked on every request by
+the token_in_blacklist_loader.
+
+Each entry keeps kid of the key which verified the token and version of
+key ring then. Once key ring is loaded again, or the key is no longer
+accepted, e.g. past its retire_at, the token is verified again instead.
+"""
+import hashlib
+import time
+
+import flask_jwt_extended.utils
+import flask_jwt_extended.view_decorators
+import jwt
+from flask import current_app
+
+from app.auth.cache import LocalCache
+from app.auth.keys import key_ring
+
+
+class VerifiedTokenCache:
+  def __init__(self):
+    self.cache = None
+    self.app = None
+
+  def init_app(self, app):
+    """
+    Decoding of @jwt_required is replaced, since flask_jwt_extended has no
+    hook for it, and only app given here decodes through the cache.
+    It's put back if the cache is disabled. Claims returned from cache are
+    shared, so must not be modified.
+    """
+    if not app.config.get('TOKEN_CACHE_ENABLED', False):
+      if self.app is None or self.app is app:
+        self.cache = None
+        self.app = None
+        flask_jwt_extended.view_decorators.decode_token = \
+            flask_jwt_extended.utils.decode_token
+      return
+
+    max_entries = int(app.config.get('TOKEN_CACHE_MAX_ENTRIES', 100000))
+    ttl = max(
+        int(app.config['JWT_ACCESS_TOKEN_EXPIRES']),
+        int(app.config['JWT_REFRESH_TOKEN_EXPIRES']))
+    self.cache = LocalCache(max_entries, ttl)
+    self.app = app
+    flask_jwt_extended.view_decorators.decode_token = self.decode_token
+
+  def decode_token(self, encoded_token, csrf_value=None, allow_expired=False):
+    """Same as flask_jwt_extended.decode_token."""
+    if self.cache is None or csrf_value is not None or allow_expired or \
+        current_app._get_current_object() is not self.app:
+      return flask_jwt_extended.utils.decode_token(
+          encoded_token, csrf_value=csrf_value, allow_expired=allow_expired)
+
+    key = hashlib.blake2b(encoded_token.encode(), digest_size=16).digest()
+    hit, entry = self.cache.get(key)
+    if hit and self.is_accepted(*entry[1:]):
+      return entry[0]
+
+    claims = flask_jwt_extended.utils.decode_token(encoded_token)
+    kid = jwt.get_unverified_header(encoded_token).get('kid')
+    self.cache.set(key, (claims, kid, key_ring.version), expires_at=claims.get('exp'))
+    return claims
+
+  def is_accepted(self, kid, version):
+    """Whether the key which verified the token is still accepted."""
+    if version != key_ring.version:
+      return False
+    if kid is None:
+      return True
+    key = key_ring.keys.get(kid)
+    return key is not None and key_ring.is_published(key, time.time())
+
+  def stats(self):
+    return None if self.cache is None else self.cache.stats()
+
+
+verified_tokens = VerifiedTokenCache()
@@ -15,3 +15,5 @@ migrate = Migrate()
 from .user import User
 from .revoked_token import RevokedToken
 from .role import Role
+from .token_generation import TokenGeneration
+from .revocation_event import RevocationEvent
@@ -0,0 +1,53 @@
+"""
+SQLAlchemy Core statements for lookups on hot paths.
+
+ORM query builds and compiles SQL on every call and hydrates model objects
+with their identity map bookkeeping. Statements here are compiled once per
+engine, and return rows of only the needed columns, which are accessed
+by attribute like model objects.
+"""
+from sqlalchemy import bindparam, inspect, select
+
+from app.models import db
+from app.models.user import User
+
+
+class CompiledStatement:
+  def __init__(self, statement, model=None):
+    """model chooses engine of SQLALCHEMY_BINDS like ORM query does."""
+    self.statement = statement
+    self.mapper = None if model is None else inspect(model)
+    self.compiled = dict()
+
+  def execute(self, **params):
+    """Execute in the transaction of session, and return ResultProxy."""
+    connection = db.session.connection(mapper=self.mapper)
+    compiled = self.compiled.get(connection.engine)
+    if compiled is None:
+      compiled = self.statement.compile(dialect=connection.dialect)
+      self.compiled[connection.engine] = compiled
+    return connection.execute(compiled, params)
+
+  def first(self, **params):
+    return self.execute(**params).first()
+
+
+user_by_email = CompiledStatement(
+    select([User.id, User.email, User.password])
+        .where(User.email == bindparam('email')),
+    model=User)
+
+user_by_id = CompiledStatement(
+    select([User.id, User.name, User.email])
+        .where(User.id == bindparam('id')),
+    model=User)
+
+
+def find_user_by_email(email):
+  """Return row of id, email and password, or None."""
+  return user_by_email.first(email=email)
+
+
+def find_user_by_id(id):
+  """Return row of id, name and email, or None."""
+  return user_by_id.first(id=id)
@@ -0,0 +1,21 @@
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
+
+from app.models import db
+
+
+class RevocationEvent(db.Model):
+  """
+  Log of revocations served by revocation feed. id is the sequence.
+  key is the 16 bytes form of jti, and NULL marks a flush of blacklist.
+  AUTOINCREMENT keeps sqlite from reusing ids of deleted rows.
+  """
+  __tablename__ = 'revocation_events'
+  __table_args__ = {'sqlite_autoincrement': True}
+  id = db.Column(db.Integer, primary_key=True)
+  key = db.Column(
+      db.BINARY(16).with_variant(postgresql.BYTEA(), 'postgresql'), nullable=True)
+  created_at = db.Column(db.DateTime, server_default=func.now())
+
+  def __repr__(self):
+    return f'RevocationEvent(id={self.id}, key={self.key})'
@@ -3,6 +3,7 @@ from datetime import datetime
 from marshmallow import Schema
 from marshmallow import fields, validate
 from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import expression
 
 from app.models import db
@@ -11,18 +12,24 @@ from app.models import db
 class RevokedToken(db.Model):
   __tablename__ = 'revoked_tokens'
   id = db.Column(db.Integer, primary_key=True)
-  jti = db.Column(db.Text, unique=True, nullable=False)
+  # One of jti and jti_bin is set, depending on BLACKLIST_BINARY_JTI.
+  jti = db.Column(db.Text, unique=True, nullable=True)
+  jti_bin = db.Column(
+      db.BINARY(16).with_variant(postgresql.BYTEA(), 'postgresql'),
+      unique=True, nullable=True)
   revoked = db.Column(db.Boolean, nullable=False, server_default=expression.false())
   token_type_hint = db.Column(db.String(64), nullable=False)
   expires_in = db.Column(db.BigInteger, nullable=False)
+  expires_at = db.Column(db.DateTime, nullable=False, index=True)
   revoked_at = db.Column(db.DateTime, nullable=True)
   created_at = db.Column(db.DateTime, server_default=func.now())
   updated_at = db.Column(db.DateTime, server_default=func.now(), server_onupdate=func.now())
 
   def __repr__(self):
-    return f'RevokedToken(id={self.id}, jti={self.jti}, ' +\
+    return f'RevokedToken(id={self.id}, jti={self.jti}, jti_bin={self.jti_bin}, ' +\
            f'revoked={self.revoked}, token_type_hint={self.token_type_hint}, ' +\
-           f'expires_in={self.expires_in}, revoked_at={self.revoked_at})'
+           f'expires_in={self.expires_in}, expires_at={self.expires_at}, ' +\
+           f'revoked_at={self.revoked_at})'
 
 
 class RevokedTokenSchema(Schema):
@@ -49,4 +56,5 @@ class RevokedTokenSchema(Schema):
     validate=[
       validate.Range(min=1, error='expires_in must be > 0.'),
     ])
+  expires_at = fields.DateTime()
   revoked_at = fields.DateTime()
@@ -0,0 +1,17 @@
+from sqlalchemy import func
+
+from app.models import db
+
+
+class TokenGeneration(db.Model):
+  """Tokens of identity issued in older generation than this are revoked."""
+  __tablename__ = 'token_generations'
+  id = db.Column(db.Integer, primary_key=True)
+  identity = db.Column(db.String(128), unique=True, nullable=False)
+  generation = db.Column(db.Integer, nullable=False)
+  created_at = db.Column(db.DateTime, server_default=func.now())
+  updated_at = db.Column(db.DateTime, server_default=func.now(), server_onupdate=func.now())
+
+  def __repr__(self):
+    return f'TokenGeneration(id={self.id}, identity={self.identity}, ' +\
+           f'generation={self.generation})'
@@ -12,7 +12,7 @@ class User(db.Model):
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(128), unique=True, nullable=False)
   email = db.Column(db.String(128), unique=True, nullable=False)
-  password = db.Column(db.String(128), nullable=False)
+  password = db.Column(db.String(255), nullable=False)
   role_id = db.Column(db.Boolean, db.ForeignKey('roles.id'), nullable=False)
   role = db.relationship('Role', backref=db.backref('roles', lazy=True))
   created_at = db.Column(db.DateTime, server_default=func.now())
@@ -17,3 +17,23 @@ class ApiException(Exception):
   def __init__(self, message, status):
     super().__init__(message)
     self.status = status
+
+
+class StorageLocked(Exception):
+  def __init__(self, message):
+    super().__init__(message)
+
+
+class StorageFull(Exception):
+  def __init__(self, message):
+    super().__init__(message)
+
+
+class StorageUnavailable(Exception):
+  def __init__(self, message):
+    super().__init__(message)
+
+
+class HashingBusy(Exception):
+  def __init__(self, message):
+    super().__init__(message)
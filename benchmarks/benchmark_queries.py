@@ -0,0 +1,87 @@
+"""
+Compare CPU time per lookup of ORM queries and the compiled Core statements
+of app.models.queries, on an in-memory sqlite database so that the time is
+spent in python rather than in the database.
+
+$ FLASK_ENV=<mode> python benchmarks/benchmark_queries.py [--count N]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.auth.blacklist import DatabaseStorage
+from app.models import db
+from app.models.queries import find_user_by_email, find_user_by_id
+from app.models.revoked_token import RevokedToken
+from app.models.role import Role
+from app.models.user import User
+
+
+app = create_app()
+# Engine is created at the first use, so it's not created with config of mode.
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_BINDS'] = {}
+app.app_context().push()
+
+
+def insert_rows(count):
+  db.create_all()
+  db.session.add(Role(id=1, name='user'))
+  for i in range(count):
+    db.session.add(User(
+        name=f'user-{i}', email=f'user-{i}@example.com',
+        password='hash', role_id=1))
+  storage = DatabaseStorage()
+  storage.init_app(app)
+  jtis = [str(uuid.uuid4()) for _ in range(count)]
+  storage.revoke_many([(jti, 'access_token') for jti in jtis])
+  return storage, jtis
+
+
+def measure(name, lookup, keys):
+  """Print CPU microseconds per lookup."""
+  for key in keys[:100]:
+    lookup(key)
+  db.session.rollback()
+
+  start = time.process_time()
+  for key in keys:
+    lookup(key)
+  elapsed = time.process_time() - start
+  db.session.rollback()
+  print(f'{name:<32}{elapsed / len(keys) * 1e6:>10.1f} us')
+  return elapsed
+
+
+def orm_revoked(jti):
+  token = RevokedToken.query.filter(RevokedToken.jti == jti).first()
+  return None if token is None else token.revoked
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--count', type=int, default=10000, help='Number of lookups of each kind.')
+  args = parser.parse_args()
+
+  storage, jtis = insert_rows(args.count)
+  emails = [f'user-{i}@example.com' for i in range(args.count)]
+  ids = list(range(1, args.count + 1))
+
+  pairs = [
+    ('revoked token by jti', orm_revoked, storage.get, jtis),
+    ('user by email',
+     lambda email: User.query.filter_by(email=email).first(), find_user_by_email, emails),
+    ('user by id',
+     lambda id: User.query.filter_by(id=id).first(), find_user_by_id, ids),
+  ]
+  for name, orm, fast, keys in pairs:
+    orm_elapsed = measure(f'{name} (orm)', orm, keys)
+    fast_elapsed = measure(f'{name} (core)', fast, keys)
+    saved = (orm_elapsed - fast_elapsed) / len(keys) * 1e6
+    print(f'{"saved per lookup":<32}{saved:>10.1f} us\n')
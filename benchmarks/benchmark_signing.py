@@ -0,0 +1,59 @@
+"""
+Compare CPU time per signing and per verification of tokens of each
+algorithm, with keys of the sizes recommended for them. Verification is
+what every service checking tokens by the JWKS endpoint pays per request.
+
+$ python benchmarks/benchmark_signing.py [--count N]
+"""
+import argparse
+import time
+import uuid
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+
+def generate_keys(algorithm):
+  """Return (key to sign, key to verify)."""
+  if algorithm.startswith('HS'):
+    secret = uuid.uuid4().hex
+    return secret, secret
+  if algorithm.startswith('ES'):
+    private_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+  else:
+    private_key = rsa.generate_private_key(65537, 2048, default_backend())
+  return private_key, private_key.public_key()
+
+
+def measure(count, run):
+  """Return CPU microseconds per run."""
+  for _ in range(min(count, 100)):
+    run()
+  start = time.process_time()
+  for _ in range(count):
+    run()
+  return (time.process_time() - start) / count * 1e6
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--count', type=int, default=2000, help='Number of tokens of each algorithm.')
+  args = parser.parse_args()
+
+  claims = {
+    'iat': int(time.time()), 'nbf': int(time.time()), 'exp': int(time.time()) + 900,
+    'jti': str(uuid.uuid4()), 'identity': 'user@example.com', 'fresh': False,
+    'type': 'access', 'user_claims': {},
+  }
+  print(f'{"algorithm":<12}{"sign":>12}{"verify":>12}')
+  for algorithm in ['HS256', 'RS256', 'PS256', 'ES256']:
+    sign_key, verify_key = generate_keys(algorithm)
+    headers = {'kid': 'benchmark'}
+    token = jwt.encode(claims, sign_key, algorithm=algorithm, headers=headers)
+    sign = measure(
+        args.count, lambda: jwt.encode(claims, sign_key, algorithm=algorithm, headers=headers))
+    verify = measure(
+        args.count, lambda: jwt.decode(token, verify_key, algorithms=[algorithm]))
+    print(f'{algorithm:<12}{sign:>9.1f} us{verify:>9.1f} us')
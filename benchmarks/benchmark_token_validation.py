@@ -0,0 +1,53 @@
+"""
+Compare CPU time per request of GET /api/v1_0/token/ through the whole app
+and through TokenValidationMiddleware, with memory storage so that the time
+is spent in python rather than in storage.
+
+$ FLASK_ENV=<mode> python benchmarks/benchmark_token_validation.py [--count N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['BLACKLIST_STORAGE_TYPE'] = 'memory'
+
+from flask_jwt_extended import create_access_token
+from werkzeug.test import Client
+
+from app import create_app
+from app.auth.middleware import TokenValidationMiddleware
+
+
+app = create_app()
+
+
+def measure(name, client, headers, count):
+  """Print CPU microseconds per request."""
+  for _ in range(100):
+    assert client.get('/api/v1_0/token/', headers=headers).status_code == 200
+
+  start = time.process_time()
+  for _ in range(count):
+    client.get('/api/v1_0/token/', headers=headers)
+  elapsed = time.process_time() - start
+  print(f'{name:<32}{elapsed / count * 1e6:>10.1f} us')
+  return elapsed
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--count', type=int, default=10000, help='Number of requests of each kind.')
+  args = parser.parse_args()
+
+  with app.app_context():
+    headers = {'Authorization': f'Bearer {create_access_token(identity="benchmark")}'}
+
+  slow = Client(app.wsgi_app, app.response_class)
+  fast = Client(TokenValidationMiddleware(app, app.wsgi_app), app.response_class)
+  slow_elapsed = measure('app', slow, headers, args.count)
+  fast_elapsed = measure('middleware', fast, headers, args.count)
+  saved = (slow_elapsed - fast_elapsed) / args.count * 1e6
+  print(f'{"saved per request":<32}{saved:>10.1f} us')
@@ -0,0 +1,83 @@
+"""add jti_bin to revoked_tokens
+
+Revision ID: 5f0a3c8e91d2
+Revises: d41c7a9e2b6f
+Create Date: 2026-10-18 20:12:31.554870
+
+"""
+import hashlib
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0a3c8e91d2'
+down_revision = 'd41c7a9e2b6f'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 1000
+UUID_PATTERN = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+
+
+def to_binary(jti):
+    """Same as Blacklist.to_key with BLACKLIST_BINARY_JTI."""
+    try:
+        return uuid.UUID(jti).bytes
+    except ValueError:
+        return hashlib.blake2b(jti.encode(), digest_size=16).digest()
+
+
+def upgrade():
+    jti_bin_type = sa.BINARY(length=16).with_variant(postgresql.BYTEA(), 'postgresql')
+    with op.batch_alter_table('revoked_tokens') as batch_op:
+        batch_op.add_column(sa.Column('jti_bin', jti_bin_type, nullable=True))
+        batch_op.alter_column('jti', existing_type=sa.Text(), nullable=True)
+        batch_op.create_unique_constraint('uq_revoked_tokens_jti_bin', ['jti_bin'])
+
+    # Backfill jti_bin so that existing rows are found after BLACKLIST_BINARY_JTI is enabled.
+    # UUID, which every token issued by flask_jwt_extended has, is packed in SQL.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(
+            "UPDATE revoked_tokens SET jti_bin = decode(replace(jti, '-', ''), 'hex') "
+            "WHERE jti_bin IS NULL AND jti ~* '^" + UUID_PATTERN + "$'")
+    elif dialect == 'mysql':
+        op.execute(
+            "UPDATE revoked_tokens SET jti_bin = UNHEX(REPLACE(jti, '-', '')) "
+            "WHERE jti_bin IS NULL AND jti REGEXP '^" + UUID_PATTERN + "$'")
+
+    # The other rows, or all of them with sqlite, are converted in chunks.
+    revoked_tokens = sa.table(
+        'revoked_tokens',
+        sa.column('id', sa.Integer()),
+        sa.column('jti', sa.Text()),
+        sa.column('jti_bin', jti_bin_type))
+    update = revoked_tokens.update() \
+        .where(revoked_tokens.c.id == sa.bindparam('row_id')) \
+        .values(jti_bin=sa.bindparam('value'))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([revoked_tokens.c.id, revoked_tokens.c.jti])
+            .where(revoked_tokens.c.id > last_id)
+            .where(revoked_tokens.c.jti.isnot(None))
+            .where(revoked_tokens.c.jti_bin.is_(None))
+            .order_by(revoked_tokens.c.id)
+            .limit(CHUNK_SIZE)).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [{'row_id': id, 'value': to_binary(jti)} for id, jti in rows])
+        last_id = rows[-1][0]
+
+def downgrade():
+    # Rows written with BLACKLIST_BINARY_JTI have no jti and can't be kept.
+    op.execute('DELETE FROM revoked_tokens WHERE jti IS NULL')
+    with op.batch_alter_table('revoked_tokens') as batch_op:
+        batch_op.drop_constraint('uq_revoked_tokens_jti_bin', type_='unique')
+        batch_op.alter_column('jti', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('jti_bin')
@@ -0,0 +1,48 @@
+"""add expires_at to revoked_tokens
+
+Revision ID: 8b2e4f1c7d3a
+Revises: 369665d4e136
+Create Date: 2026-10-18 17:40:12.318004
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4f1c7d3a'
+down_revision = '369665d4e136'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('revoked_tokens', sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    # Backfill expires_at from created_at and expires_in.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "UPDATE revoked_tokens SET expires_at = "
+            "datetime(COALESCE(created_at, CURRENT_TIMESTAMP), "
+            "'+' || expires_in || ' seconds')")
+    elif dialect == 'postgresql':
+        op.execute(
+            "UPDATE revoked_tokens SET expires_at = "
+            "COALESCE(created_at, now()) + expires_in * interval '1 second'")
+    elif dialect == 'mysql':
+        op.execute(
+            "UPDATE revoked_tokens SET expires_at = "
+            "DATE_ADD(COALESCE(created_at, now()), INTERVAL expires_in SECOND)")
+    else:
+        raise NotImplementedError(f'Backfill of expires_at is not supported with {dialect}.')
+
+    with op.batch_alter_table('revoked_tokens') as batch_op:
+        batch_op.alter_column('expires_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index(op.f('ix_revoked_tokens_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('revoked_tokens') as batch_op:
+        batch_op.drop_index(op.f('ix_revoked_tokens_expires_at'))
+        batch_op.drop_column('expires_at')
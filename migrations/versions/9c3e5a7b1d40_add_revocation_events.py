@@ -0,0 +1,31 @@
+"""add revocation_events
+
+Revision ID: 9c3e5a7b1d40
+Revises: 5f0a3c8e91d2
+Create Date: 2026-10-18 21:12:09.318550
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e5a7b1d40'
+down_revision = '5f0a3c8e91d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revocation_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.BINARY(length=16).with_variant(postgresql.BYTEA(), 'postgresql'), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+
+
+def downgrade():
+    op.drop_table('revocation_events')
@@ -0,0 +1,32 @@
+"""add token_generations
+
+Revision ID: d41c7a9e2b6f
+Revises: 8b2e4f1c7d3a
+Create Date: 2026-10-18 19:05:47.902113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7a9e2b6f'
+down_revision = '8b2e4f1c7d3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_generations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('identity', sa.String(length=128), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('identity')
+    )
+
+
+def downgrade():
+    op.drop_table('token_generations')
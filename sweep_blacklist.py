@@ -0,0 +1,50 @@
+"""
+Delete expired tokens from revoked_tokens table.
+Only needed when BLACKLIST_STORAGE_TYPE is database, since the other
+storages expire tokens by themselves.
+
+$ FLASK_ENV=<mode> python sweep_blacklist.py [--chunk-size N] [--interval SEC]
+"""
+import argparse
+import time
+
+from app import create_app
+from app.auth.blacklist import blacklist
+from app.models import db
+
+
+app = create_app()
+app.app_context().push()
+
+
+def sweep_blacklist(chunk_size, pause):
+  try:
+    deleted = blacklist.storage.sweep(chunk_size=chunk_size, pause=pause)
+    print(f'{deleted} expired tokens are deleted.')
+  except Exception as e:
+    print(f'Error occurred. {type(e)}: {str(e)}\nExecute rollback.')
+    db.session.rollback()
+    print('Rollback done.')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--chunk-size', type=int, default=1000,
+      help='Number of rows deleted per transaction.')
+  parser.add_argument(
+      '--pause', type=float, default=0.1,
+      help='Seconds to sleep between chunks.')
+  parser.add_argument(
+      '--interval', type=float, default=0,
+      help='If > 0, keep sweeping every interval seconds.')
+  args = parser.parse_args()
+
+  if app.config['BLACKLIST_STORAGE_TYPE'] != 'database':
+    print('Blacklist is not stored in database. Nothing to sweep.')
+    exit(0)
+
+  sweep_blacklist(args.chunk_size, args.pause)
+  while args.interval > 0:
+    time.sleep(args.interval)
+    sweep_blacklist(args.chunk_size, args.pause)
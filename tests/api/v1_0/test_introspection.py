@@ -0,0 +1,58 @@
+import json
+import pytest
+from http import HTTPStatus
+
+from app.auth.blacklist import blacklist
+from helpers.utils import bearer_token, login, me, url_token
+
+
+url_introspection = '/api/v1_0/token/introspect/'
+
+
+@pytest.mark.usefixtures('prepare_users')
+class TestTokenIntrospectionAPI:
+  def test_post(self, client, headers):
+    access_token, refresh_token = login(client, headers)
+    revoked_access_token, revoked_refresh_token = login(client, headers)
+    ret = client.delete(
+        url_token, data=json.dumps({'refresh_token': revoked_refresh_token}),
+        headers={**headers, **bearer_token(revoked_access_token)})
+    assert ret.status_code == HTTPStatus.OK
+
+    tokens = [
+      access_token, refresh_token, revoked_access_token, revoked_refresh_token,
+      access_token[:-2], 'invalid',
+    ]
+    data = json.dumps({'tokens': tokens})
+
+    # Without token, fails.
+    ret = client.post(url_introspection, data=data, headers=headers)
+    assert ret.status_code == HTTPStatus.UNAUTHORIZED
+
+    ret = client.post(
+        url_introspection, data=data, headers={**headers, **bearer_token(access_token)})
+    assert ret.status_code == HTTPStatus.OK
+    results = ret.json['results']
+    assert [result['active'] for result in results] == \
+        [True, True, False, False, False, False]
+    assert results[0]['identity'] == me['email']
+    assert results[0]['type'] == 'access'
+    assert results[1]['type'] == 'refresh'
+    assert results[2] == dict(active=False)
+
+    blacklist.flushall()
+
+  def test_post_invalid(self, client, headers):
+    access_token, _ = login(client, headers)
+    auth_headers = {**headers, **bearer_token(access_token)}
+
+    for body in [{'tokens': 'token'}, ['token'], 'token']:
+      ret = client.post(url_introspection, data=json.dumps(body), headers=auth_headers)
+      assert ret.status_code == HTTPStatus.BAD_REQUEST
+
+    ret = client.post(
+        url_introspection, data=json.dumps({'tokens': ['token'] * 1001}),
+        headers=auth_headers)
+    assert ret.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+    blacklist.flushall()
@@ -0,0 +1,16 @@
+from http import HTTPStatus
+
+
+url_jwks = '/api/v1_0/jwks/'
+
+
+class TestJwksAPI:
+  def test_get(self, client, app):
+    ret = client.get(url_jwks)
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.json == dict(keys=[])
+    assert ret.headers['Cache-Control'] == \
+        f"public, max-age={app.config['JWT_JWKS_MAX_AGE']}"
+
+    ret = client.get(url_jwks, headers={'If-None-Match': ret.headers['ETag']})
+    assert ret.status_code == HTTPStatus.NOT_MODIFIED
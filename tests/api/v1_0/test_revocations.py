@@ -0,0 +1,144 @@
+import json
+import pytest
+import struct
+import uuid
+from flask_jwt_extended import decode_token
+from http import HTTPStatus
+
+from app.auth.blacklist import blacklist
+from helpers.utils import bearer_token, login, url_token
+
+
+url_revocations = '/api/v1_0/revocations/'
+
+
+@pytest.fixture
+def feed_enabled(app):
+  if app.config['BLACKLIST_STORAGE_TYPE'] == 'shared_memory':
+    pytest.skip('Feed is not supported with shared_memory.')
+  app.config['BLACKLIST_FEED_ENABLED'] = True
+  app.config['BLACKLIST_FEED_SNAPSHOT_TTL'] = 0
+  blacklist.init_feed(app)
+  yield
+  blacklist.flushall()
+  app.config['BLACKLIST_FEED_ENABLED'] = False
+  blacklist.init_feed(app)
+
+
+def logout(client, headers, access_token, refresh_token):
+  ret = client.delete(
+      url_token, data=json.dumps({'refresh_token': refresh_token}),
+      headers={**headers, **bearer_token(access_token)})
+  assert ret.status_code == HTTPStatus.OK
+
+
+def jti_hex(app, token):
+  with app.app_context():
+    return uuid.UUID(decode_token(token)['jti']).hex
+
+
+@pytest.mark.usefixtures('prepare_users')
+class TestRevocationsAPI:
+  def test_get(self, app, client, headers, feed_enabled):
+    blacklist.flushall()
+    first = login(client, headers)
+    access_token, refresh_token = login(client, headers)
+
+    # Without token, fails.
+    ret = client.get(url_revocations)
+    assert ret.status_code == HTTPStatus.UNAUTHORIZED
+
+    ret = client.get(url_revocations, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.json['jtis'] == []
+    sequence = ret.json['sequence']
+
+    logout(client, headers, *first)
+    revoked = sorted(jti_hex(app, token) for token in first)
+
+    # Snapshot has revoked tokens, sorted.
+    ret = client.get(url_revocations, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.json['jtis'] == revoked
+    assert ret.json['sequence'] == sequence + 2
+
+    ret = client.get(
+        url_revocations, query_string={'format': 'binary'},
+        headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.headers['Content-Type'] == 'application/octet-stream'
+    magic, binary_sequence, count = struct.unpack('<8sQQ', ret.data[:24])
+    assert (magic, binary_sequence, count) == (b'BLKREV01', sequence + 2, 2)
+    assert [ret.data[24:40].hex(), ret.data[40:56].hex()] == revoked
+
+    # Delta has revocations since the sequence.
+    ret = client.get(
+        url_revocations, query_string={'since': sequence, 'limit': 1},
+        headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.json['reset'] is False
+    assert ret.json['sequence'] == sequence + 1
+    assert len(ret.json['jtis']) == 1
+
+    ret = client.get(
+        url_revocations, query_string={'since': ret.json['sequence']},
+        headers=bearer_token(access_token))
+    assert ret.json['sequence'] == sequence + 2
+    assert len(ret.json['jtis']) == 1
+
+    ret = client.get(
+        url_revocations, query_string={'since': sequence + 2},
+        headers=bearer_token(access_token))
+    assert ret.json == dict(sequence=sequence + 2, jtis=[], reset=False)
+
+    # Readers must load snapshot again after flush.
+    blacklist.flushall()
+    access_token, _ = login(client, headers)
+    ret = client.get(
+        url_revocations, query_string={'since': sequence + 2},
+        headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.json['reset'] is True
+
+    ret = client.get(
+        url_revocations, query_string={'since': -1},
+        headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.BAD_REQUEST
+
+  def test_feed_failure(self, app, client, headers, feed_enabled, monkeypatch):
+    blacklist.flushall()
+    first = login(client, headers)
+    second = login(client, headers)
+    sequence = blacklist.feed.sequence()
+    append = blacklist.feed.append
+    def fail(keys, **kwargs):
+      raise ConnectionError('Feed is down.')
+    monkeypatch.setattr(blacklist.feed, 'append', fail)
+
+    with app.app_context():
+      jtis = [decode_token(token)['jti'] for token in first]
+    if blacklist.feed_in_storage:
+      # Revocations are rolled back with their events, and reverted.
+      ret = client.delete(
+          url_token, data=json.dumps({'refresh_token': first[1]}),
+          headers={**headers, **bearer_token(first[0])})
+      assert ret.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
+      assert blacklist.has_revoked_many(jtis) == [False, False]
+      assert blacklist.feed.sequence() == sequence
+      return
+
+    # Revocations stay, and their events are appended with the next ones.
+    logout(client, headers, *first)
+    assert blacklist.has_revoked_many(jtis) == [True, True]
+    monkeypatch.setattr(blacklist.feed, 'append', append)
+    logout(client, headers, *second)
+    _, keys, reset = blacklist.feed.since(sequence, 10)
+    assert not reset
+    revoked = [jti_hex(app, token) for token in first + second]
+    assert [key.hex() for key in keys] == revoked
+  def test_get_disabled(self, client, headers):
+    access_token, _ = login(client, headers)
+
+    ret = client.get(url_revocations, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.NOT_IMPLEMENTED
+    assert ret.json == dict(error={'message': 'Revocation feed is not enabled.'})
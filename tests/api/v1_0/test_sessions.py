@@ -0,0 +1,50 @@
+import json
+import pytest
+from http import HTTPStatus
+
+from app.auth.blacklist import blacklist
+from helpers.utils import bearer_token, login, url_token
+
+
+url_sessions = '/api/v1_0/sessions/'
+
+
+@pytest.mark.usefixtures("prepare_users")
+class TestSessionsAPI:
+  def test_delete(self, client, headers, monkeypatch):
+    monkeypatch.setattr(blacklist, 'generation_enabled', True)
+    sessions = [login(client, headers) for _ in range(3)]
+
+    # Without token, fails.
+    ret = client.delete(url_sessions)
+    assert ret.status_code == HTTPStatus.UNAUTHORIZED
+
+    ret = client.delete(url_sessions, headers=bearer_token(sessions[0][0]))
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.json == dict({})
+
+    # All tokens issued before are revoked.
+    for access_token, refresh_token in sessions:
+      ret = client.get(url_token, headers=bearer_token(access_token))
+      assert ret.status_code == HTTPStatus.UNAUTHORIZED
+      assert ret.json == dict(error={'message': 'Token has been revoked.'})
+
+      ret = client.put(
+          url_token, data=json.dumps({'access_token': access_token}),
+          headers={**headers, **bearer_token(refresh_token)})
+      assert ret.status_code == HTTPStatus.UNAUTHORIZED
+
+    # Tokens issued after are valid.
+    access_token, refresh_token = login(client, headers)
+    ret = client.get(url_token, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+
+    blacklist.flushall()
+
+  def test_delete_disabled(self, client, headers, monkeypatch):
+    monkeypatch.setattr(blacklist, 'generation_enabled', False)
+    access_token, _ = login(client, headers)
+
+    ret = client.delete(url_sessions, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.NOT_IMPLEMENTED
+    assert ret.json == dict(error={'message': 'Revoking all sessions is not enabled.'})
@@ -0,0 +1,28 @@
+import pytest
+from http import HTTPStatus
+
+from helpers.utils import bearer_token, login
+
+
+url_stats = '/api/v1_0/stats/'
+
+
+@pytest.fixture(scope='class')
+def access_token(prepare_users, client, headers):
+  access_token, _ = login(client, headers)
+  yield access_token
+
+
+class TestStatsAPI:
+  def test_get(self, access_token, client, app, monkeypatch):
+    ret = client.get(url_stats)
+    assert ret.status_code == HTTPStatus.UNAUTHORIZED
+
+    ret = client.get(url_stats, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.NOT_FOUND
+
+    monkeypatch.setitem(app.config, 'STATS_ENABLED', True)
+    ret = client.get(url_stats, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+    assert ret.json['blacklist']['storage_type'] == \
+        app.config['BLACKLIST_STORAGE_TYPE']
@@ -1,8 +1,10 @@
 import json
 import pytest
+from flask_jwt_extended import decode_token, get_jti
 from http import HTTPStatus
 from werkzeug.security import generate_password_hash
 
+from app.auth.blacklist import blacklist
 from app.models import db
 from app.models.user import User
 from helpers.utils import bearer_token
@@ -226,3 +228,54 @@ class TestTokenAPI:
         headers={**headers, **bearer_token(refresh_token)})
     assert ret.status_code == HTTPStatus.UNAUTHORIZED
     assert ret.json == dict(error={'message': 'Token has been revoked.'})
+
+  def test_delete_failure(self, tokens, client, headers, monkeypatch):
+    access_token, refresh_token = tokens
+    with client.application.test_request_context():
+      claims = [decode_token(access_token), decode_token(refresh_token)]
+
+    # Both tokens are put back on probation with their exp.
+    def fail(tokens, exps=None):
+      raise ConnectionError('Blacklist storage is down.')
+    probated = []
+    def probate(jti, exp=None):
+      probated.append((jti, exp))
+    monkeypatch.setattr(blacklist, 'revoke_many', fail)
+    monkeypatch.setattr(blacklist, 'probate_access_token', probate)
+    monkeypatch.setattr(blacklist, 'probate_refresh_token', probate)
+    ret = client.delete(
+        url_token, data=json.dumps({'refresh_token': refresh_token}),
+        headers={**headers, **bearer_token(access_token)})
+    assert ret.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert probated == [(c['jti'], c['exp']) for c in claims]
+
+  def test_without_probation(self, client, headers, monkeypatch):
+    monkeypatch.setattr(blacklist, 'probation_enabled', False)
+    data = dict(email=me['email'], password=me['password'])
+    ret = client.post(url_token, data=json.dumps(data), headers=headers)
+    assert ret.status_code == HTTPStatus.OK
+    access_token = ret.json['access_token']
+    refresh_token = ret.json['refresh_token']
+
+    # Nothing is written to blacklist by login.
+    with client.application.test_request_context():
+      access_jti = get_jti(access_token)
+      refresh_jti = get_jti(refresh_token)
+    assert blacklist.has_as_keys([access_jti, refresh_jti]) == [False, False]
+
+    ret = client.get(url_token, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.OK
+
+    ret = client.delete(url_token, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.BAD_REQUEST
+    assert blacklist.has_as_key(access_jti) == False
+
+    ret = client.delete(
+        url_token, data=json.dumps({'refresh_token': refresh_token}),
+        headers={**headers, **bearer_token(access_token)})
+    assert ret.status_code == HTTPStatus.OK
+    assert blacklist.has_revoked_many([access_jti, refresh_jti]) == [True, True]
+
+    ret = client.get(url_token, headers=bearer_token(access_token))
+    assert ret.status_code == HTTPStatus.UNAUTHORIZED
+    assert ret.json == dict(error={'message': 'Token has been revoked.'})
@@ -1,6 +1,19 @@
+import datetime
 import pytest
+import uuid
 
-from app.auth.blacklist import MemoryStorage, RedisStorage, Blacklist
+from app.auth.blacklist import MemoryStorage, RedisStorage, DatabaseStorage, SharedMemoryStorage
+from app.auth.blacklist import Blacklist
+from app.models import db
+from app.models.revoked_token import RevokedToken
+from app.utils.exceptions import StorageFull
+
+
+def wait_filter(blacklist):
+  """Filter is built by a thread, which holds filter_lock until it's done."""
+  blacklist.get_filter()
+  with blacklist.filter_lock:
+    return blacklist.filter
 
 
 @pytest.fixture(scope="class")
@@ -66,3 +79,369 @@ def test_blacklist(blacklist):
   assert blacklist.has_revoked(dummy_access_jti) == False
   assert blacklist.has_as_key(dummy_refresh_jti) == True
   assert blacklist.has_revoked(dummy_refresh_jti) == False
+
+
+def test_blacklist_many(blacklist):
+  blacklist.flushall()
+  jtis = ['abc', 'xyz', 'uvw']
+  assert blacklist.has_as_keys(jtis) == [False, False, False]
+
+  blacklist.probate_many([('abc', 'access_token'), ('xyz', 'refresh_token')])
+  assert blacklist.has_as_keys(jtis) == [True, True, False]
+  assert blacklist.has_revoked_many(jtis) == [False, False, False]
+
+  blacklist.revoke_many([('xyz', 'refresh_token'), ('uvw', 'access_token')])
+  assert blacklist.has_as_keys(jtis) == [True, True, True]
+  assert blacklist.has_revoked_many(jtis) == [False, True, True]
+  blacklist.flushall()
+
+
+def test_blacklist_probate_if_absent(blacklist):
+  blacklist.flushall()
+  assert blacklist.probate_if_absent('abc', 'access_token') == False
+  assert blacklist.has_as_key('abc') == True
+  assert blacklist.probate_if_absent('abc', 'access_token') == True
+
+  blacklist.revoke_refresh_token('xyz')
+  tokens = [('xyz', 'refresh_token'), ('uvw', 'refresh_token')]
+  assert blacklist.probate_many_if_absent(tokens) == [True, False]
+  assert blacklist.has_revoked_many(['xyz', 'uvw']) == [True, False]
+  blacklist.flushall()
+
+
+@pytest.fixture(scope="function")
+def memory_storage(app):
+  storage = MemoryStorage()
+  storage.init_app(app)
+
+  yield storage
+
+  storage.flushall()
+
+
+def test_memory_storage_expires(memory_storage):
+  memory_storage.revoke_access_token('abc')
+  memory_storage.access_token_expires = -1
+  memory_storage.revoke_access_token('xyz')
+  memory_storage.revoke_access_token('pqr')
+  assert memory_storage.get('abc') == True
+  assert memory_storage.get('pqr') is None
+
+  # Expired entries are dropped on write even if they are never read.
+  memory_storage.probate_refresh_token('uvw')
+  assert 'xyz' not in memory_storage.storage
+  assert memory_storage.get('uvw') == False
+
+
+def test_memory_storage_max_entries(memory_storage):
+  memory_storage.max_entries = 3
+  memory_storage.revoke_access_token('abc')
+  memory_storage.probate_refresh_token('def')
+  memory_storage.probate_access_token('ghi')
+  memory_storage.revoke_refresh_token('jkl')
+  # The probated entry expiring soonest is evicted, even though revoked one expires sooner.
+  assert memory_storage.get_many(['abc', 'def', 'ghi', 'jkl']) == [True, False, None, True]
+
+  # Probation which was revoked later is not evicted.
+  memory_storage.revoke_refresh_token('def')
+  with pytest.raises(StorageFull):
+    memory_storage.probate_access_token('mno')
+  assert memory_storage.get_many(['abc', 'def', 'jkl', 'mno']) == [True, True, True, None]
+
+  # Overwrite needs no room.
+  memory_storage.revoke_access_token('abc')
+  assert len(memory_storage.storage) == 3
+
+  memory_storage.delete('jkl')
+  memory_storage.probate_access_token('mno')
+  memory_storage.eviction_policy = 'noeviction'
+  with pytest.raises(StorageFull):
+    memory_storage.probate_access_token('pqr')
+
+
+def test_blacklist_filter(app, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_STORAGE_TYPE', 'memory')
+  monkeypatch.setitem(app.config, 'BLACKLIST_FILTER_ENABLED', True)
+  blacklist = Blacklist()
+  blacklist.init_app(app)
+
+  blacklist.probate_access_token('abc')
+  blacklist.revoke_access_token('xyz')
+  # Lookups go to storage until filter is built.
+  with blacklist.filter_lock:
+    assert blacklist.has_revoked('xyz') == True
+    assert blacklist.filter is None
+  assert wait_filter(blacklist) is not None
+  assert blacklist.has_revoked('abc') == False
+  assert blacklist.has_revoked('xyz') == True
+
+  # Built from storage, and updated by revocation.
+  assert blacklist.filter.might_contain('xyz')
+  blacklist.revoke_refresh_token('abc')
+  assert blacklist.has_revoked('abc') == True
+
+  stats = blacklist.stats()['filter']
+  assert stats['entries'] == 2
+  assert stats['negatives'] == 1
+  assert stats['false_positives'] == 0
+
+  blacklist.flushall()
+  assert blacklist.has_revoked('abc') == False
+  assert blacklist.stats()['filter']['negatives'] == 2
+
+
+def test_database_storage_sweep(app, init_db):
+  storage = DatabaseStorage()
+  storage.init_app(app)
+  storage.probate_many([(f'access-{i}', 'access_token') for i in range(5)])
+  storage.revoke_many([(f'refresh-{i}', 'refresh_token') for i in range(3)])
+
+  storage.token_expires['access_token'] = -1
+  storage.revoke_access_token('access-5')
+  storage.revoke_access_token('access-6')
+  assert storage.sweep(chunk_size=1) == 2
+  assert storage.get('access-5') is None
+  assert storage.get('access-0') == False
+
+  storage.flushall(chunk_size=3)
+  assert list(storage.scan()) == []
+
+
+def test_blacklist_generation(app, init_db, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_GENERATION_ENABLED', True)
+  blacklist = Blacklist()
+  blacklist.init_app(app)
+  blacklist.flushall()
+
+  assert blacklist.get_generation('abc') == 0
+  assert blacklist.has_stale_generation('abc', 0) == False
+  assert blacklist.bump_generation('abc') == 1
+  assert blacklist.bump_generation('abc') == 2
+  assert blacklist.has_stale_generation('abc', 1) == True
+  assert blacklist.has_stale_generation('abc', 2) == False
+  assert blacklist.get_generation('xyz') == 0
+
+  # Generations are not entries of revoked tokens.
+  assert list(blacklist.storage.scan()) == []
+
+  blacklist.flushall()
+  assert blacklist.get_generation('abc') == 0
+
+  monkeypatch.setitem(app.config, 'JWT_CLAIMS_IN_REFRESH_TOKEN', False)
+  with pytest.raises(ValueError):
+    blacklist.init_app(app)
+
+
+def test_blacklist_generation_cache(app, init_db, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_STORAGE_TYPE', 'database')
+  monkeypatch.setitem(app.config, 'BLACKLIST_GENERATION_ENABLED', True)
+  monkeypatch.setitem(app.config, 'BLACKLIST_CACHE_ENABLED', True)
+  monkeypatch.setitem(app.config, 'BLACKLIST_CACHE_MAX_STALENESS', 0)
+  workers = [Blacklist(), Blacklist()]
+  for worker in workers:
+    worker.init_app(app)
+    worker.sync()
+  workers[0].flushall()
+
+  lookups = []
+  get_generation_many = workers[1].storage.get_generation_many
+  def counted(identities):
+    lookups.extend(identities)
+    return get_generation_many(identities)
+  monkeypatch.setattr(workers[1].storage, 'get_generation_many', counted)
+  assert workers[1].has_stale_generation('abc', 0) == False
+  assert workers[1].has_stale_generation('abc', 0) == False
+  assert lookups == ['abc']
+
+  # Bump on the other worker invalidates the cached generation by broadcast.
+  assert workers[0].bump_generation('abc') == 1
+  assert workers[1].has_stale_generation('abc', 0) == True
+  assert workers[1].has_stale_generation('abc', 1) == False
+  assert lookups == ['abc', 'abc']
+  workers[0].flushall()
+
+
+def test_blacklist_sync(app, init_db, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_STORAGE_TYPE', 'database')
+  monkeypatch.setitem(app.config, 'BLACKLIST_CACHE_ENABLED', True)
+  monkeypatch.setitem(app.config, 'BLACKLIST_FILTER_ENABLED', True)
+  monkeypatch.setitem(app.config, 'BLACKLIST_CACHE_MAX_STALENESS', 0)
+  workers = [Blacklist(), Blacklist()]
+  for worker in workers:
+    worker.init_app(app)
+  workers[0].flushall()
+  workers[0].revoke_access_token('abc')
+  assert [worker.has_revoked_many(['abc', 'xyz']) for worker in workers] == \
+      [[True, False]] * 2
+  assert all(wait_filter(worker) is not None for worker in workers)
+
+  # Revocation on one worker reaches cache and filter of the other.
+  workers[0].revoke_access_token('xyz')
+  assert workers[1].has_revoked('xyz') == True
+  assert workers[1].filter.might_contain('xyz')
+
+  # Revocation committed a few seconds after its statement is still found.
+  workers[1].sync(force=True)
+  revoked_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=5)
+  db.session.add(RevokedToken(
+      jti='late', revoked=True, token_type_hint='access_token', expires_in=60,
+      expires_at=revoked_at + datetime.timedelta(seconds=60), revoked_at=revoked_at))
+  db.session.commit()
+  workers[1].sync(force=True)
+  assert workers[1].cache.get('late') == (True, True)
+
+  # While a thread polls, the others don't poll the same connection.
+  workers[1].sync_lock.acquire()
+  monkeypatch.setattr(workers[1].broadcast, 'poll', lambda: pytest.fail('Polled twice.'))
+  assert workers[1].sync(force=True) == True
+  workers[1].sync_lock.release()
+
+  # Once events may have been lost, cache is cleared and filter is rebuilt.
+  workers[0].flushall()
+  monkeypatch.setattr(workers[1].broadcast, 'poll', lambda: [('reset', None)])
+  workers[1].sync(force=True)
+  assert workers[1].cache.stats()['entries'] == 0
+  assert workers[1].filter is None
+  assert workers[1].has_revoked('abc') == False
+
+
+def test_blacklist_binary_jti(app, init_db, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_BINARY_JTI', True)
+  blacklist = Blacklist()
+  blacklist.init_app(app)
+  blacklist.flushall()
+
+  jti = str(uuid.uuid4())
+  blacklist.revoke_access_token(jti)
+  blacklist.probate_many([('abc', 'refresh_token')])
+  assert blacklist.has_revoked(jti) == True
+  assert blacklist.has_revoked(uuid.UUID(jti).bytes) == True
+  assert blacklist.has_revoked_many([jti, 'abc', 'xyz']) == [True, False, False]
+  assert blacklist.has_as_keys(['abc', 'xyz']) == [True, False]
+
+  # Stored as 16 bytes.
+  assert blacklist.storage.get(uuid.UUID(jti).bytes) == True
+  assert all(len(key) == 16 for key, _, _ in blacklist.storage.scan())
+
+  blacklist.delete(jti)
+  assert blacklist.has_as_key(jti) == False
+  blacklist.flushall()
+
+
+def test_shared_memory_storage_key(app):
+  storage = SharedMemoryStorage()
+  storage.init_app(app)
+  storage.flushall()
+
+  # UUID is the same key as str and as 16 bytes, so switching
+  # BLACKLIST_BINARY_JTI keeps entries, and scan gives it back.
+  jti = str(uuid.uuid4())
+  storage.revoke_access_token(jti)
+  storage.probate_refresh_token('abc')
+  assert storage.get(uuid.UUID(jti).bytes) == True
+  assert storage.get('abc') == False
+  assert (uuid.UUID(jti).bytes, True) in [(key, revoked) for key, revoked, _ in storage.scan()]
+  storage.flushall()
+
+
+@pytest.mark.parametrize('wait_for_commit', [False, True])
+def test_database_storage_write_behind(app, init_db, monkeypatch, wait_for_commit):
+  monkeypatch.setitem(app.config, 'DATABASE_STORAGE_WRITE_BEHIND', True)
+  monkeypatch.setitem(app.config, 'DATABASE_STORAGE_FLUSH_INTERVAL', 60)
+  monkeypatch.setitem(app.config, 'DATABASE_STORAGE_WAIT_FOR_COMMIT', wait_for_commit)
+  storage = DatabaseStorage()
+  storage.init_app(app)
+  storage.flushall()
+
+  tokens = [('abc', 'access_token'), ('xyz', 'refresh_token')]
+  assert storage.probate_many_if_absent(tokens) == [False, False]
+  assert storage.probate_many_if_absent(tokens[:1]) == [True]
+  assert storage.get_many(['abc', 'xyz', 'pqr']) == [False, False, None]
+  assert len(storage.pending) == (0 if wait_for_commit else 2)
+
+  # Revocation waits for the queued probation, and is not overwritten by it.
+  storage.revoke_access_token('abc')
+  assert 'abc' not in storage.pending
+  assert storage.get('abc') == True
+
+  storage.delete('xyz')
+  assert storage.get('xyz') is None
+  assert storage.stats()['write_behind']['flushed_rows'] == 2
+  storage.flushall()
+
+
+def test_memory_storage_restore(app):
+  source = MemoryStorage()
+  source.init_app(app)
+  source.revoke_many([('abc', 'access_token'), (b'x' * 16, 'refresh_token')])
+  source.probate_access_token('xyz')
+  source.bump_generation('user')
+
+  target = MemoryStorage()
+  target.init_app(app)
+  target.revoke_access_token('xyz')
+  target.restore_many(list(source.scan()))
+  target.restore_generations(list(source.scan_generations()))
+
+  # Existing entries are kept, and the others keep expires_at.
+  assert target.get_many(['abc', b'x' * 16, 'xyz']) == [True, True, True]
+  assert target.storage['abc'][1] == pytest.approx(source.storage['abc'][1])
+  assert target.get_generation('user') == 1
+
+
+def test_database_storage_restore(app, init_db):
+  storage = DatabaseStorage()
+  storage.init_app(app)
+  storage.flushall()
+  storage.revoke_access_token('abc')
+  storage.bump_generation('user')
+  entries = list(storage.scan())
+  generations = list(storage.scan_generations())
+
+  storage.flushall()
+  storage.restore_many(entries + [('xyz', False, entries[0][2])])
+  storage.restore_generations(generations)
+  assert sorted(storage.scan()) == sorted(entries + [('xyz', False, entries[0][2])])
+  assert list(storage.scan_generations()) == [('user', 1)]
+  storage.flushall()
+
+
+def test_database_storage_postgresql_timeout(app, init_db, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_STORAGE_TIMEOUT', 0.5)
+  storage = DatabaseStorage()
+  storage.init_app(app)
+  storage.flushall()
+  storage.revoke_access_token('abc')
+
+  # Only lookups are limited, and the limit is reset right after them.
+  statements = []
+  monkeypatch.setattr(storage, 'dialect', lambda: 'postgresql')
+  monkeypatch.setattr(db.session, 'execute', lambda statement: statements.append(statement))
+  assert storage.get('abc') == True
+  assert storage.get_many(['abc', 'xyz']) == [True, None]
+  assert statements == [
+    'SET LOCAL statement_timeout = 500', 'SET LOCAL statement_timeout TO DEFAULT',
+  ] * 2
+  monkeypatch.undo()
+  storage.flushall()
+
+
+def test_blacklist_generation_many(app, init_db, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_GENERATION_ENABLED', True)
+  blacklist = Blacklist()
+  blacklist.init_app(app)
+  blacklist.flushall()
+  blacklist.bump_generation('abc')
+  blacklist.bump_generation('abc')
+  blacklist.bump_generation('xyz')
+
+  lookups = []
+  get_generation_many = blacklist.storage.get_generation_many
+  def counted(identities):
+    lookups.append(identities)
+    return get_generation_many(identities)
+  monkeypatch.setattr(blacklist.storage, 'get_generation_many', counted)
+  tokens = [('abc', 1), ('abc', 2), ('xyz', 0), ('pqr', 0)]
+  assert blacklist.has_stale_generations(tokens) == [True, False, True, False]
+  assert lookups == [['abc', 'xyz', 'pqr']]
+  blacklist.flushall()
@@ -0,0 +1,119 @@
+import json
+import time
+
+import pytest
+import redis
+
+from app.auth import breaker
+from app.auth.blacklist import Blacklist, blacklist as app_blacklist
+from app.auth.breaker import CircuitBreaker
+from app.utils.exceptions import StorageUnavailable
+from helpers.utils import bearer_token, login, me
+
+
+def test_circuit_breaker():
+  circuit = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+  assert circuit.allow()
+  circuit.fail(ValueError('a'))
+  assert circuit.state == breaker.CLOSED
+  circuit.fail(ValueError('b'))
+  assert circuit.state == breaker.OPEN
+  assert not circuit.allow()
+
+  # Only one probe is let through after reset_timeout.
+  time.sleep(0.05)
+  assert circuit.allow()
+  assert not circuit.allow()
+  circuit.fail(ValueError('c'))
+  assert circuit.state == breaker.OPEN
+
+  time.sleep(0.05)
+  assert circuit.allow()
+  circuit.succeed()
+  assert circuit.state == breaker.CLOSED
+
+  stats = circuit.stats()
+  assert stats['transitions'] == {'closed': 1, 'open': 2, 'half_open': 2}
+  assert stats['rejected'] == 2
+  assert stats['last_error'] == 'ValueError: c'
+
+
+@pytest.mark.parametrize('fallback,revoked,other', [
+  ('fail_closed', True, True),
+  ('fail_open', False, False),
+  ('local', True, False),
+])
+def test_blacklist_fallback(app, monkeypatch, fallback, revoked, other):
+  monkeypatch.setitem(app.config, 'BLACKLIST_STORAGE_TYPE', 'memory')
+  monkeypatch.setitem(app.config, 'BLACKLIST_BREAKER_ENABLED', True)
+  monkeypatch.setitem(app.config, 'BLACKLIST_BREAKER_FAILURE_THRESHOLD', 1)
+  monkeypatch.setitem(app.config, 'BLACKLIST_FALLBACK', fallback)
+  blacklist = Blacklist()
+  blacklist.init_app(app)
+  blacklist.revoke_access_token('abc')
+
+  def fail(*args):
+    raise redis.ConnectionError('down')
+  monkeypatch.setattr(blacklist.storage, 'get', fail)
+  assert blacklist.has_revoked('abc') == revoked
+  assert blacklist.has_revoked_many(['abc', 'xyz']) == [revoked, other]
+  with pytest.raises(StorageUnavailable):
+    blacklist.revoke_access_token('xyz')
+
+  stats = blacklist.stats()['breaker']
+  assert stats['state'] == breaker.OPEN
+  assert stats['fallbacks'] == 2
+
+
+def test_blacklist_breaker_released_by_other_error(app, monkeypatch):
+  monkeypatch.setitem(app.config, 'BLACKLIST_STORAGE_TYPE', 'memory')
+  monkeypatch.setitem(app.config, 'BLACKLIST_BREAKER_ENABLED', True)
+  monkeypatch.setitem(app.config, 'BLACKLIST_BREAKER_FAILURE_THRESHOLD', 1)
+  monkeypatch.setitem(app.config, 'BLACKLIST_BREAKER_RESET_TIMEOUT', 0.05)
+  blacklist = Blacklist()
+  blacklist.init_app(app)
+  get = blacklist.storage.get
+
+  def fail(*args):
+    raise redis.ConnectionError('down')
+  monkeypatch.setattr(blacklist.storage, 'get', fail)
+  assert blacklist.has_revoked('abc')
+  assert blacklist.breaker.state == breaker.OPEN
+
+  # Probe raising an error which doesn't tell availability doesn't hold the circuit.
+  def error(*args):
+    raise redis.ResponseError('WRONGTYPE')
+  monkeypatch.setattr(blacklist.storage, 'get', error)
+  time.sleep(0.05)
+  with pytest.raises(redis.ResponseError):
+    blacklist.has_revoked('abc')
+  assert blacklist.breaker.state == breaker.HALF_OPEN
+
+  monkeypatch.setattr(blacklist.storage, 'get', get)
+  assert not blacklist.has_revoked('abc')
+  assert blacklist.breaker.state == breaker.CLOSED
+
+
+@pytest.mark.usefixtures('prepare_users')
+def test_token_storage_unavailable(client, headers, monkeypatch):
+  access_token, refresh_token = login(client, headers)
+
+  def unavailable(*args, **kwargs):
+    raise StorageUnavailable('Blacklist storage is unavailable.')
+  monkeypatch.setattr(app_blacklist, 'probate_many_if_absent', unavailable)
+  monkeypatch.setattr(app_blacklist, 'revoke_access_token', unavailable)
+  monkeypatch.setattr(app_blacklist, 'revoke_many', unavailable)
+
+  data = json.dumps(dict(email=me['email'], password=me['password']))
+  ret = client.post('/api/v1_0/token/', data=data, headers=headers)
+  assert ret.status_code == 503
+
+  ret = client.put(
+      '/api/v1_0/token/', data=json.dumps({'access_token': access_token}),
+      headers={**headers, **bearer_token(refresh_token)})
+  assert ret.status_code == 503
+
+  ret = client.delete(
+      '/api/v1_0/token/', data=json.dumps({'refresh_token': refresh_token}),
+      headers={**headers, **bearer_token(access_token)})
+  assert ret.status_code == 503
@@ -0,0 +1,29 @@
+from app.auth.cache import LocalCache
+
+
+def test_local_cache():
+  cache = LocalCache(max_entries=2, ttl=60)
+  assert cache.get('abc') == (False, None)
+
+  cache.set('abc', None)
+  cache.set('def', True)
+  assert cache.get('abc') == (True, None)
+  assert cache.get('def') == (True, True)
+
+  # 'abc' was used more recently than 'def'.
+  cache.get('abc')
+  cache.set('ghi', False)
+  assert cache.get('def') == (False, None)
+  assert cache.get('ghi') == (True, False)
+
+  cache.invalidate('ghi')
+  assert cache.get('ghi') == (False, None)
+
+  cache.ttl = -1
+  cache.set('jkl', True)
+  assert cache.get('jkl') == (False, None)
+
+  stats = cache.stats()
+  assert stats['hits'] == 4
+  assert stats['misses'] == 4
+  assert stats['invalidations'] == 1
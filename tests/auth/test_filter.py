@@ -0,0 +1,18 @@
+from app.auth.filter import BloomFilter
+
+
+def test_bloom_filter():
+  bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+  jtis = [f'jti-{i}' for i in range(1000)]
+  for jti in jtis:
+    bloom_filter.add(jti)
+  bloom_filter.add(jtis[0])
+
+  # Keys which were false positives when added are not counted.
+  assert 980 <= bloom_filter.entries <= 1000
+  assert all(bloom_filter.might_contain(jti) for jti in jtis)
+  assert abs(bloom_filter.false_positive_rate() - 0.01) < 0.005
+
+  false_positives = sum(
+      bloom_filter.might_contain(f'other-{i}') for i in range(10000))
+  assert false_positives < 300
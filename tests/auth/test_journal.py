@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+from app.auth import journal
+from app.auth.blacklist import MemoryStorage
+from app.auth.journal import Journal
+from app.utils.exceptions import StorageLocked
+
+
+@pytest.fixture(scope="function")
+def path(tmp_path):
+  return str(tmp_path / 'blacklist')
+
+
+def test_journal(path):
+  expires_at = time.time() + 60
+  log = Journal(path, fsync_interval=1.0)
+  assert log.load_snapshot() is None
+  assert log.replay() == []
+
+  log.append(journal.SET, 'abc', True, expires_at)
+  log.append(journal.SET, b'x' * 16, False, expires_at + 1)
+  log.append(journal.GENERATION, 'user', expires_at=2)
+  position = log.position()
+  log.append(journal.SET, 'xyz', False, expires_at)
+  entries = [('abc', True, expires_at), (b'x' * 16, False, expires_at + 1),
+             ('expired', True, time.time() - 1)]
+  log.snapshot(entries, {'user': 2}, position)
+  log.append(journal.DELETE, 'abc')
+  log.close()
+
+  # Torn record at the tail is dropped.
+  with open(f'{path}.log', 'ab') as f:
+    f.write(journal.RECORD.pack(journal.SET, 0, 3, expires_at) + b'a')
+
+  log = Journal(path)
+  snapshot = log.load_snapshot()
+  assert snapshot.count == 3
+  assert snapshot.first_alive(time.time()) == 1
+  assert snapshot.entry(snapshot.find('abc')) == (True, expires_at)
+  assert snapshot.entry(snapshot.find(b'x' * 16)) == (False, expires_at + 1)
+  assert snapshot.find('x' * 16) is None
+  assert snapshot.find('xyz') is None
+  assert snapshot.key(snapshot.find('abc')) == 'abc'
+  assert snapshot.generations() == {'user': 2}
+  # Only records after position are left in log.
+  assert log.replay() == [
+    (journal.SET, 'xyz', False, expires_at),
+    (journal.DELETE, 'abc', False, 0.0),
+  ]
+
+  with pytest.raises(StorageLocked):
+    Journal(path)
+  log.close()
+
+
+def test_memory_storage_reload(app, path, monkeypatch):
+  monkeypatch.setitem(app.config, 'MEMORY_STORAGE_PATH', path)
+  monkeypatch.setitem(app.config, 'MEMORY_STORAGE_FSYNC_INTERVAL', 0)
+  storage = MemoryStorage()
+  storage.init_app(app)
+  storage.revoke_many([('abc', 'access_token'), (b'x' * 16, 'refresh_token')])
+  storage.probate_access_token('xyz')
+  storage.bump_generation('user')
+  storage.snapshot()
+  storage.delete('xyz')
+  storage.max_entries = 3
+  storage.probate_access_token('evicted')
+  storage.revoke_refresh_token('pqr')
+  storage.journal.close()
+
+  reloaded = MemoryStorage()
+  reloaded.init_app(app)
+  assert reloaded.get('abc') is True
+  assert reloaded.get_many([b'x' * 16, 'xyz', 'evicted', 'pqr']) == \
+      [True, None, None, True]
+  assert reloaded.get_generation('user') == 1
+  assert {jti for jti, _, _ in reloaded.scan()} == {b'x' * 16, 'abc', 'pqr'}
+
+  # Entries of snapshot are overwritten, deleted and evicted like the others.
+  reloaded.probate_refresh_token('abc')
+  reloaded.delete(b'x' * 16)
+  assert reloaded.count() == 2
+  reloaded.revoke_access_token('new')
+  assert reloaded.get_many(['abc', b'x' * 16, 'new']) == [False, None, True]
+  reloaded.snapshot()
+  reloaded.journal.close()
+
+  again = MemoryStorage()
+  again.init_app(app)
+  assert {jti for jti, _, _ in again.scan()} == {'abc', 'pqr', 'new'}
+  again.max_entries = 3
+  again.probate_access_token('full')
+  assert again.get_many(['abc', 'pqr', 'new', 'full']) == [None, True, True, False]
+  assert again.count() == 3
+  again.journal.close()
+
+
+def test_memory_storage_journal_per_worker(app, path, monkeypatch):
+  monkeypatch.setitem(app.config, 'MEMORY_STORAGE_PATH', path)
+  monkeypatch.setitem(app.config, 'GUNICORN_WORKERS', 2)
+  storages = [MemoryStorage(), MemoryStorage()]
+  for storage in storages:
+    storage.init_app(app)
+  assert [storage.journal.log_path for storage in storages] == \
+      [f'{path}.0.log', f'{path}.1.log']
+
+  with pytest.raises(StorageLocked):
+    MemoryStorage().init_app(app)
+
+  # A restarted worker takes over the journal released by the old one.
+  storages[0].revoke_access_token('abc')
+  storages[0].journal.close()
+  restarted = MemoryStorage()
+  restarted.init_app(app)
+  assert restarted.journal.log_path == f'{path}.0.log'
+  assert restarted.get('abc') is True
+  restarted.journal.close()
+  storages[1].journal.close()
@@ -0,0 +1,101 @@
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from flask_jwt_extended import create_access_token
+from jwt.utils import base64url_decode
+
+from app.auth.keys import key_ring
+from helpers.utils import bearer_token
+
+
+url_token = '/api/v1_0/token/'
+url_jwks = '/api/v1_0/jwks/'
+
+
+def private_pem(algorithm):
+  if algorithm.startswith('RS'):
+    key = rsa.generate_private_key(65537, 2048, default_backend())
+  else:
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+  return key.private_bytes(
+      serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+      serialization.NoEncryption()).decode()
+
+
+def from_jwk(jwk):
+  def to_int(value):
+    return int.from_bytes(base64url_decode(value), 'big')
+  if jwk['kty'] == 'RSA':
+    numbers = rsa.RSAPublicNumbers(to_int(jwk['e']), to_int(jwk['n']))
+  else:
+    assert jwk['crv'] == 'P-256'
+    numbers = ec.EllipticCurvePublicNumbers(
+        to_int(jwk['x']), to_int(jwk['y']), ec.SECP256R1())
+  return numbers.public_key(default_backend())
+
+
+@pytest.fixture(scope='function')
+def signing_keys(app, monkeypatch):
+  def use(algorithm, keys, decode_algorithms=None):
+    monkeypatch.setitem(app.config, 'JWT_ALGORITHM', algorithm)
+    monkeypatch.setitem(app.config, 'JWT_SIGNING_KEYS', keys)
+    monkeypatch.setitem(app.config, 'JWT_DECODE_ALGORITHMS', decode_algorithms)
+    key_ring.init_app(app)
+  yield use
+  monkeypatch.undo()
+  key_ring.init_app(app)
+
+
+@pytest.mark.parametrize('algorithm', ['RS256', 'ES256'])
+def test_key_rotation(app, client, init_db, signing_keys, algorithm):
+  with app.app_context():
+    hs256_token = create_access_token(identity='test001@test.com')
+
+  now = time.time()
+  signing_keys(algorithm, [
+    {'kid': 'old', 'private_key': private_pem(algorithm), 'retire_at': now - 10},
+    {'kid': 'current', 'private_key': private_pem(algorithm), 'activate_at': now - 100},
+    {'kid': 'next', 'private_key': private_pem(algorithm), 'activate_at': '2100-01-01T00:00:00'},
+  ])
+  assert key_ring.signing_key(now=now - 200).kid == 'old'
+  assert key_ring.signing_key(now=now - 50).kid == 'current'
+  assert key_ring.signing_key().kid == 'current'
+  assert key_ring.signing_key(now=4102444800).kid == 'next'
+
+  with app.app_context():
+    access_token = create_access_token(identity='test001@test.com')
+  assert jwt.get_unverified_header(access_token) == \
+      {'alg': algorithm, 'kid': 'current', 'typ': 'JWT'}
+  ret = client.get(url_token, headers=bearer_token(access_token))
+  assert ret.status_code == 200
+
+  # Tokens of old key are accepted until they expire.
+  jwks = client.get(url_jwks).json
+  assert [key['kid'] for key in jwks['keys']] == ['old', 'current', 'next']
+  public_key = from_jwk(jwks['keys'][1])
+  assert jwt.decode(access_token, public_key, algorithms=[algorithm])['jti']
+  later = now + app.config['JWT_REFRESH_TOKEN_EXPIRES']
+  assert [key['kid'] for key in key_ring.jwks(now=later)['keys']] == ['current', 'next']
+
+  # Tokens signed by secret key, or without known kid, are rejected.
+  ret = client.get(url_token, headers=bearer_token(hs256_token))
+  assert ret.status_code == 422
+  assert ret.json == dict(error={'message': 'Missing kid in header.'})
+  forged = jwt.encode(
+      {'identity': 'x'}, 'secret', algorithm='HS256', headers={'kid': 'current'}).decode()
+  ret = client.get(url_token, headers=bearer_token(forged))
+  assert ret.status_code == 422
+
+  # Unless HS256 is allowed to decode tokens issued before switching.
+  signing_keys(algorithm, app.config['JWT_SIGNING_KEYS'], ['HS256'])
+  ret = client.get(url_token, headers=bearer_token(hs256_token))
+  assert ret.status_code == 200
+
+
+def test_key_ring_eddsa(app, signing_keys):
+  with pytest.raises(ValueError):
+    signing_keys('EdDSA', [])
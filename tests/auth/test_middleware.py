@@ -0,0 +1,49 @@
+import datetime
+
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token
+from werkzeug.test import Client
+
+from app.auth.blacklist import blacklist
+from app.auth.middleware import TokenValidationMiddleware
+from helpers.utils import bearer_token
+
+
+url_token = '/api/v1_0/token/'
+
+
+def test_token_validation_middleware(app, client, init_db):
+  middleware = TokenValidationMiddleware(app, app.wsgi_app)
+  fast_client = Client(middleware, app.response_class)
+
+  with app.app_context():
+    access_token = create_access_token(identity='test001@test.com')
+    revoked_token = create_access_token(identity='test001@test.com')
+    refresh_token = create_refresh_token(identity='test001@test.com')
+    expired_token = create_access_token(
+        identity='test001@test.com', expires_delta=datetime.timedelta(seconds=-1))
+    claims = decode_token(revoked_token)
+    blacklist.revoke_access_token(claims['jti'], exp=claims['exp'])
+
+  cases = [
+    bearer_token(access_token),
+    bearer_token(revoked_token),
+    bearer_token(refresh_token),
+    bearer_token(expired_token),
+    bearer_token(access_token[:-2]),
+    {'Authorization': access_token},
+    {},
+  ]
+  for headers in cases:
+    expected = client.get(url_token, headers=headers)
+    ret = fast_client.get(url_token, headers=headers)
+    assert ret.status_code == expected.status_code
+    assert ret.data == expected.data
+    assert ret.headers == expected.headers
+  assert middleware.stats() == {'handled': len(cases), 'passed': 0}
+
+  # The other requests are left to app.
+  ret = fast_client.put(url_token, headers=bearer_token(access_token))
+  assert ret.status_code == client.put(url_token, headers=bearer_token(access_token)).status_code
+  assert middleware.stats()['handled'] == len(cases)
+
+  blacklist.flushall()
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash
+
+from app.auth.password import PasswordHasher, hash_length, normalize_method, password_hasher
+from app.models import db
+from app.models.user import User
+from app.utils.exceptions import HashingBusy
+
+
+url_token = '/api/v1_0/token/'
+url_users = '/api/v1_0/users/'
+
+
+@pytest.fixture(scope='function')
+def hasher(app, monkeypatch):
+  def use(method, salt_length=8, workers=0, queue_size=16):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', method)
+    monkeypatch.setitem(app.config, 'PASSWORD_SALT_LENGTH', salt_length)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', workers)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_QUEUE_SIZE', queue_size)
+    hasher = PasswordHasher()
+    hasher.init_app(app)
+    return hasher
+  return use
+
+
+def test_normalize_method():
+  assert normalize_method('pbkdf2:sha256') == 'pbkdf2:sha256:150000'
+  assert normalize_method('pbkdf2:sha512:1000') == 'pbkdf2:sha512:1000'
+  assert normalize_method('scrypt') == 'scrypt:32768:8:1'
+  assert normalize_method('scrypt:1024:8:2') == 'scrypt:1024:8:2'
+  for method in ['plain', 'sha256', 'pbkdf2:unknown', 'scrypt:1024']:
+    with pytest.raises(ValueError):
+      normalize_method(method)
+
+
+@pytest.mark.parametrize('method', ['pbkdf2:sha256:1000', 'pbkdf2:sha512:1000', 'scrypt:1024:8:1'])
+def test_hash_length(hasher, method):
+  assert len(hasher(method, salt_length=16).hash('testtest')) == hash_length(method, 16)
+
+  # pbkdf2:sha512 with default iterations doesn't fit in the former 128.
+  assert hash_length(normalize_method('pbkdf2:sha512'), 8) == 158
+  assert hasher('pbkdf2:sha512', salt_length=8).method == 'pbkdf2:sha512:150000'
+  with pytest.raises(ValueError):
+    hasher(method, salt_length=User.password.type.length)
+
+
+@pytest.mark.parametrize('method', ['pbkdf2:sha256:1000', 'scrypt:1024:8:1'])
+def test_password_hasher(hasher, method):
+  current = hasher(method, salt_length=16)
+  pwhash = current.hash('testtest')
+  assert pwhash.startswith(method + '$')
+  assert len(pwhash) <= User.password.type.length
+  assert current.verify(pwhash, 'testtest')
+  assert not current.verify(pwhash, 'testtesu')
+  assert not current.needs_rehash(pwhash)
+
+  # Hashes of another policy are verified, and need rehash.
+  other = hasher('pbkdf2:sha256:2000')
+  assert other.verify(pwhash, 'testtest')
+  assert other.needs_rehash(pwhash)
+  assert hasher(method, salt_length=8).needs_rehash(pwhash)
+
+  stats = current.stats()['schemes'][method]
+  assert (stats['hashed'], stats['verified'], stats['rejected']) == (1, 1, 1)
+
+
+def test_rehash_on_login(app, client, headers, init_db):
+  row = dict(name='test001', email='test001@test.com', role_id=1)
+  db.session.add(User(**row, password=generate_password_hash('testtest')))
+  db.session.commit()
+  assert password_hasher.method == normalize_method(app.config['PASSWORD_HASH_METHOD'])
+  rehashes = password_hasher.stats()['rehashes']
+
+  data = json.dumps(dict(email=row['email'], password='testtest'))
+  for _ in range(2):
+    ret = client.post(url_token, data=data, headers=headers)
+    assert ret.status_code == 200
+  assert password_hasher.stats()['rehashes'] == rehashes + 1
+
+  pwhash = User.query.filter_by(email=row['email']).first().password
+  assert pwhash.startswith(password_hasher.method + '$')
+
+
+def test_password_hash_pool(hasher):
+  pooled = hasher('pbkdf2:sha256:1000', workers=1, queue_size=1)
+  pwhash = pooled.hash('testtest')
+  assert pooled.pool._mp_context.get_start_method() == 'forkserver'
+  assert pooled.verify(pwhash, 'testtest')
+  assert not pooled.verify(pwhash, 'testtesu')
+  stats = pooled.stats()
+  assert stats['schemes']['pbkdf2:sha256:1000']['hashed'] == 1
+  assert stats['pool']['max_in_flight'] == 1
+  assert stats['pool']['in_flight'] == 0
+
+  # Hashing beyond workers + queue_size is rejected without waiting.
+  for _ in range(2):
+    pooled.slots.acquire()
+  with pytest.raises(HashingBusy):
+    pooled.hash('testtest')
+  for _ in range(2):
+    pooled.slots.release()
+  assert pooled.stats()['pool']['rejected'] == 1
+  assert pooled.verify(pwhash, 'testtest')
+  pooled.pool.shutdown()
+
+  assert hasher('pbkdf2:sha256:1000').stats()['pool'] is None
+
+
+@pytest.mark.parametrize('error', [
+  HashingBusy('Too many passwords are being hashed. Retry later.'),
+  BrokenProcessPool('A process in the pool was terminated abruptly.'),
+])
+def test_hashing_busy(client, headers, init_db, monkeypatch, error):
+  row = dict(name='test001', email='test001@test.com', role_id=1)
+  db.session.add(User(**row, password=generate_password_hash('testtest')))
+  db.session.commit()
+
+  def busy(*args):
+    raise error
+  monkeypatch.setattr(password_hasher, 'run', busy)
+
+  data = json.dumps(dict(email=row['email'], password='testtest'))
+  ret = client.post(url_token, data=data, headers=headers)
+  assert ret.status_code == 503
+  data = json.dumps(dict(name='test002', email='test002@test.com', password='testtest',
+                         role_id=1))
+  ret = client.post(url_users, data=data, headers=headers)
+  assert ret.status_code == 503
+  assert User.query.filter_by(name='test002').count() == 0
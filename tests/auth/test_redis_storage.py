@@ -0,0 +1,120 @@
+import time
+
+import pytest
+import redis
+
+from app.auth.blacklist import RedisBucketStorage, RedisStorage
+from app.auth.broadcast import RedisBroadcast
+from fake_redis import FakeRedis
+
+
+@pytest.fixture(scope='function')
+def redis_storage(app, monkeypatch):
+  monkeypatch.setattr(redis, 'StrictRedis', FakeRedis)
+  def use(prefix, storage_class=RedisStorage):
+    monkeypatch.setitem(app.config, 'REDIS_KEY_PREFIX', prefix)
+    storage = storage_class()
+    storage.init_app(app)
+    return storage, storage.storage
+  return use
+
+
+def test_redis_storage_prefix(redis_storage):
+  storage, client = redis_storage('blacklist:')
+  client.set('other', 'true')
+  client.set('blacklist*other', 'true')
+
+  storage.revoke_access_token('abc')
+  storage.probate_refresh_token('xyz')
+  assert storage.bump_generation('test001@test.com') == 1
+  assert set(client.data) == {
+    b'other', b'blacklist*other',
+    b'blacklist:abc', b'blacklist:xyz', b'blacklist:generation:test001@test.com',
+  }
+  assert storage.get_many(['abc', 'xyz', 'other']) == [True, False, None]
+  assert sorted((jti, revoked) for jti, revoked, _ in storage.scan()) == \
+      [('abc', True), ('xyz', False)]
+  assert list(storage.scan_generations()) == [('test001@test.com', 1)]
+  assert storage.get_generation_many(['test001@test.com', 'other']) == [1, 0]
+
+  storage.delete('abc')
+  assert client.calls[-1] == 'unlink'
+  assert storage.get('abc') is None
+
+  # Keys are unlinked in batches of count, leaving keys without prefix.
+  for i in range(5):
+    storage.revoke_access_token(f'jti{i}')
+  client.calls.clear()
+  storage.flushall(count=2)
+  assert set(client.data) == {b'other', b'blacklist*other'}
+  assert client.calls.count('unlink') == 4
+  assert 'flushdb' not in client.calls
+
+
+def test_redis_storage_without_prefix(redis_storage):
+  storage, client = redis_storage('')
+  client.set('other', 'value')
+  storage.revoke_access_token('abc')
+  assert set(client.data) == {b'other', b'abc'}
+  assert storage.get('abc') is True
+
+  # Keys of blacklist can't be told from the others, so the DB is flushed.
+  storage.flushall()
+  assert client.data == {}
+  assert client.calls[-1] == 'flushdb'
+
+
+def test_redis_bucket_storage(redis_storage, monkeypatch):
+  storage, client = redis_storage('blacklist:', RedisBucketStorage)
+  monkeypatch.setattr(storage, 'bucket_interval', 100)
+  exp = (int(time.time()) // 100 + 1) * 100 + 10
+  assert storage.bucket_key(exp) == f'blacklist:bucket:{exp // 100}'
+  with pytest.raises(ValueError):
+    storage.bucket_key(None)
+
+  storage.revoke_access_token('abc', exp=exp)
+  storage.probate_refresh_token('xyz', exp=exp + 100)
+  assert set(client.data) == {
+    f'blacklist:bucket:{exp // 100}'.encode(), f'blacklist:bucket:{exp // 100 + 1}'.encode(),
+  }
+  # Each bucket expires at its end, once all of its tokens have expired.
+  assert client.expires[storage.bucket_key(exp).encode()] == (exp // 100 + 1) * 100
+  assert client.expires[storage.bucket_key(exp + 100).encode()] == (exp // 100 + 2) * 100
+
+  client.calls.clear()
+  assert storage.get('abc', exp=exp) is True
+  assert storage.get('abc', exp=exp + 100) is None
+  assert storage.get_many(['abc', 'xyz', 'pqr'], [exp, exp + 100, exp]) == [True, False, None]
+  assert set(client.calls) == {'hget'}
+  assert storage.probate_many_if_absent(
+      [('abc', 'access_token'), ('pqr', 'access_token')], [exp, exp]) == [True, False]
+  assert storage.get_many(['abc', 'pqr'], [exp, exp]) == [True, False]
+
+  assert sorted(storage.scan()) == [
+    ('abc', True, (exp // 100 + 1) * 100),
+    ('pqr', False, (exp // 100 + 1) * 100),
+    ('xyz', False, (exp // 100 + 2) * 100),
+  ]
+
+  storage.delete('abc', exp=exp)
+  assert storage.get('abc', exp=exp) is None
+  with pytest.raises(ValueError):
+    storage.delete('xyz')
+  assert storage.get('xyz', exp=exp + 100) is False
+
+
+def test_redis_broadcast_resubscribe(app, monkeypatch):
+  monkeypatch.setattr(redis, 'StrictRedis', FakeRedis)
+  broadcast = RedisBroadcast()
+  broadcast.init_app(app)
+  assert broadcast.poll() == [('reset', None)]
+
+  broadcast.publish('revoke', 'abc')
+  broadcast.publish('generation', 'test001@test.com')
+  assert broadcast.poll() == [('revoke', 'abc'), ('generation', 'test001@test.com')]
+  assert broadcast.poll() == []
+
+  # redis-py subscribes again on reconnect, and messages meanwhile are lost.
+  broadcast.pubsub.subscribe(broadcast.channel)
+  broadcast.publish('delete', 'abc')
+  assert broadcast.poll() == [('reset', None), ('delete', 'abc')]
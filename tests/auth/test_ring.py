@@ -0,0 +1,28 @@
+from app.auth.ring import HashRing
+
+
+def test_hash_ring():
+  nodes = [f'node{i}:6379/0' for i in range(4)]
+  keys = [f'jti-{i}' for i in range(10000)]
+  ring = HashRing(nodes)
+  owners = [ring.get(key) for key in keys]
+
+  # Keys are spread evenly enough.
+  for node in nodes:
+    assert 1500 < owners.count(node) < 3500
+
+  groups = ring.group(keys)
+  assert sorted(i for indexes in groups.values() for i in indexes) == list(range(len(keys)))
+  assert all(owners[i] == node for node, indexes in groups.items() for i in indexes)
+
+  # Only keys of the added node move.
+  ring.add('node4:6379/0')
+  moved = [key for key, owner in zip(keys, owners) if ring.get(key) != owner]
+  assert all(ring.get(key) == 'node4:6379/0' for key in moved)
+  assert len(moved) < len(keys) * 0.3
+
+  # Removing it restores the original mapping.
+  ring.remove('node4:6379/0')
+  assert [ring.get(key) for key in keys] == owners
+
+  assert HashRing(['single']).group(keys[:3]) == {'single': [0, 1, 2]}
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from app.auth import shared_table
+from app.auth.shared_table import SharedHashTable
+from app.utils.exceptions import StorageFull
+
+
+@pytest.fixture(scope="function")
+def path(tmp_path):
+  return str(tmp_path / 'blacklist')
+
+
+def key(i):
+  return i.to_bytes(16, 'little')
+
+
+def test_shared_table(path):
+  table = SharedHashTable(path, capacity=8)
+  other = SharedHashTable(path, capacity=1024)
+  assert other.capacity == 8
+
+  expires_at = time.time() + 60
+  table.set(key(1), shared_table.PROBATED, expires_at)
+  assert other.get(key(1)) == (shared_table.PROBATED, expires_at)
+
+  other.set(key(1), shared_table.REVOKED, expires_at)
+  assert table.get(key(1)) == (shared_table.REVOKED, expires_at)
+
+  table.delete(key(1))
+  assert other.get(key(1)) is None
+
+  table.set(key(2), shared_table.REVOKED, time.time() - 1)
+  assert table.get(key(2)) is None
+
+  table.clear()
+  assert other.get(key(1)) is None
+
+
+def test_shared_table_collision(path):
+  table = SharedHashTable(path, capacity=4)
+  expires_at = time.time() + 60
+
+  # All keys have the same home slot.
+  for i in range(4):
+    table.set(key(i * 4), shared_table.REVOKED, expires_at)
+  for i in range(4):
+    assert table.get(key(i * 4)) == (shared_table.REVOKED, expires_at)
+
+  with pytest.raises(StorageFull):
+    table.set(key(1), shared_table.REVOKED, expires_at)
+
+  # Deleted slot is reused, and keys after it are still found.
+  table.delete(key(4))
+  table.set(key(1), shared_table.PROBATED, expires_at)
+  assert table.get(key(1)) == (shared_table.PROBATED, expires_at)
+  assert table.get(key(12)) == (shared_table.REVOKED, expires_at)
+
+
+def test_shared_table_rebuild(path):
+  capacity = 1 << 13
+  table = SharedHashTable(path, capacity=capacity)
+  counter = key(capacity * 8)
+  table.increment(counter)
+  table.set(key(0), shared_table.REVOKED, time.time() + 60)
+
+  # Every slot is used once by keys which expire at once.
+  for i in range(1, capacity * 3):
+    table.set(key(i), shared_table.PROBATED, time.time() - 1)
+    assert table.used() <= table.max_used
+  assert table.get(key(0))[0] == shared_table.REVOKED
+  assert table.increment(counter) == 2
+
+  # A miss stops at an EMPTY slot instead of probing the whole table.
+  start = time.perf_counter()
+  for i in range(100):
+    assert table.get(key(capacity * 4 + i)) is None
+  assert time.perf_counter() - start < 0.05
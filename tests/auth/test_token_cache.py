@@ -0,0 +1,93 @@
+import hashlib
+
+import flask_jwt_extended.utils
+import flask_jwt_extended.view_decorators
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from jwt.exceptions import InvalidSignatureError
+
+from app.auth.blacklist import blacklist
+from app.auth.keys import key_ring
+from app.auth.token_cache import VerifiedTokenCache
+from helpers.utils import bearer_token
+
+
+url_token = '/api/v1_0/token/'
+
+
+@pytest.fixture(scope='function')
+def token_cache(app, monkeypatch):
+  monkeypatch.setattr(
+      flask_jwt_extended.view_decorators, 'decode_token',
+      flask_jwt_extended.view_decorators.decode_token)
+  monkeypatch.setitem(app.config, 'TOKEN_CACHE_ENABLED', True)
+  cache = VerifiedTokenCache()
+  cache.init_app(app)
+  return cache
+
+
+def test_verified_token_cache(app, client, init_db, token_cache):
+  with app.app_context():
+    access_token = create_access_token(identity='test001@test.com')
+    claims = token_cache.decode_token(access_token)
+    assert token_cache.decode_token(access_token) is claims
+    with pytest.raises(InvalidSignatureError):
+      token_cache.decode_token(access_token[:-2] + 'xx')
+  assert token_cache.stats()['hits'] == 1
+  assert token_cache.stats()['entries'] == 1
+
+  # Entry expires at exp of token.
+  [(_, expires)] = token_cache.cache.entries.values()
+  assert expires == claims['exp']
+
+  # @jwt_required decodes through cache, and still checks revocation.
+  ret = client.get(url_token, headers=bearer_token(access_token))
+  assert ret.status_code == 200
+  ret = client.get(url_token, headers=bearer_token(access_token))
+  assert ret.status_code == 200
+  assert token_cache.stats()['hits'] == 3
+
+  blacklist.revoke_access_token(claims['jti'], exp=claims['exp'])
+  ret = client.get(url_token, headers=bearer_token(access_token))
+  assert ret.status_code == 401
+  assert ret.json == dict(error={'message': 'Token has been revoked.'})
+
+  blacklist.flushall()
+
+
+def test_verified_token_cache_keys(app, token_cache, monkeypatch):
+  with app.app_context():
+    access_token = create_access_token(identity='test001@test.com')
+    claims = token_cache.decode_token(access_token)
+    assert token_cache.decode_token(access_token) is claims
+
+    # Verified again once keys are loaded again.
+    key_ring.init_app(app)
+    assert token_cache.decode_token(access_token) is not claims
+    claims = token_cache.decode_token(access_token)
+
+    # Verified again once the key is no longer accepted.
+    key = hashlib.blake2b(access_token.encode(), digest_size=16).digest()
+    token_cache.cache.set(key, (claims, 'old', key_ring.version))
+    monkeypatch.setattr(key_ring, 'keys', {'old': None})
+    monkeypatch.setattr(key_ring, 'is_published', lambda key, now: False)
+    assert token_cache.decode_token(access_token) is not claims
+
+
+def test_verified_token_cache_scope(app, token_cache):
+  # Other apps of the process don't decode through the cache.
+  with app.app_context():
+    access_token = create_access_token(identity='test001@test.com')
+  other = Flask('other')
+  other.config.update(app.config)
+  JWTManager(other)
+  with other.app_context():
+    assert token_cache.decode_token(access_token)['identity'] == 'test001@test.com'
+  assert token_cache.stats()['entries'] == 0
+
+  # Decoding is put back once the cache is disabled.
+  app.config['TOKEN_CACHE_ENABLED'] = False
+  token_cache.init_app(app)
+  assert flask_jwt_extended.view_decorators.decode_token is \
+      flask_jwt_extended.utils.decode_token
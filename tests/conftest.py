@@ -6,10 +6,13 @@ os.environ['FLASK_ENV'] = 'testing'
 os.environ['FLASK_APP'] = 'app'
 
 import pytest
+from werkzeug.security import generate_password_hash
 
 from app import create_app
 from app.models import db
 from app.models.role import Role
+from app.models.user import User
+from helpers.utils import me
 
 
 @pytest.fixture(scope='session')
@@ -44,6 +47,14 @@ def init_db(app):
     db.drop_all()
 
 
+@pytest.fixture(scope='class')
+def prepare_users(init_db):
+  row = me.copy()
+  row['password'] = generate_password_hash(row['password'])
+  db.session.add(User(**row))
+  db.session.commit()
+
+
 @pytest.fixture(scope='session')
 def base_url():
   return 'http://localhost'
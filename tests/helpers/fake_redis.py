@@ -0,0 +1,218 @@
+"""
+In-memory stand-in of redis.StrictRedis with the commands blacklist uses,
+to test redis storages without a redis server. Every command is recorded
+in calls by name.
+"""
+import re
+import time
+
+
+def to_bytes(value):
+  if isinstance(value, bytes):
+    return value
+  return str(value).encode()
+
+
+def glob_to_regex(pattern):
+  """Translate glob of SCAN MATCH, where backslash escapes the next character."""
+  pattern = to_bytes(pattern).decode()
+  regex = ''
+  i = 0
+  while i < len(pattern):
+    c = pattern[i]
+    if c == '\\' and i + 1 < len(pattern):
+      i += 1
+      regex += re.escape(pattern[i])
+    elif c == '*':
+      regex += '.*'
+    elif c == '?':
+      regex += '.'
+    else:
+      regex += re.escape(c)
+    i += 1
+  return re.compile(regex.encode(), re.DOTALL)
+
+
+class ConnectionPool:
+  def __init__(self, **kwargs):
+    self.connection_kwargs = kwargs
+
+
+class FakeRedis:
+  def __init__(self, host='localhost', port=6379, db=0, **kwargs):
+    self.connection_pool = ConnectionPool(host=host, port=port, db=db)
+    self.data = dict()
+    self.expires = dict()
+    self.calls = []
+    self.pubsubs = []
+
+  @classmethod
+  def from_url(cls, url, **kwargs):
+    host, port = url.split('//', 1)[1].split('/')[0].split(':')
+    return cls(host=host, port=int(port))
+
+  def record(self, name):
+    self.calls.append(name)
+
+  def alive(self, key):
+    key = to_bytes(key)
+    expires_at = self.expires.get(key)
+    if expires_at is not None and expires_at <= time.time():
+      self.data.pop(key, None)
+      self.expires.pop(key, None)
+    return key in self.data
+
+  def get(self, key):
+    self.record('get')
+    return self.data[to_bytes(key)] if self.alive(key) else None
+
+  def mget(self, keys):
+    self.record('mget')
+    return [self.data[to_bytes(key)] if self.alive(key) else None for key in keys]
+
+  def set(self, key, value, ex=None, px=None, nx=False):
+    self.record('set')
+    if nx and self.alive(key):
+      return None
+    key = to_bytes(key)
+    self.data[key] = to_bytes(value)
+    self.expires.pop(key, None)
+    if ex is not None:
+      self.expires[key] = time.time() + ex
+    elif px is not None:
+      self.expires[key] = time.time() + px / 1000
+    return True
+
+  def incr(self, key):
+    self.record('incr')
+    value = int(self.data[to_bytes(key)]) + 1 if self.alive(key) else 1
+    self.data[to_bytes(key)] = to_bytes(value)
+    return value
+
+  def ttl(self, key):
+    self.record('ttl')
+    if not self.alive(key):
+      return -2
+    expires_at = self.expires.get(to_bytes(key))
+    return -1 if expires_at is None else int(expires_at - time.time())
+
+  def expireat(self, key, when):
+    self.record('expireat')
+    if not self.alive(key):
+      return False
+    self.expires[to_bytes(key)] = when
+    return True
+
+  def unlink(self, *keys):
+    self.record('unlink')
+    deleted = 0
+    for key in keys:
+      if self.alive(key):
+        self.data.pop(to_bytes(key))
+        self.expires.pop(to_bytes(key), None)
+        deleted += 1
+    return deleted
+
+  def flushdb(self):
+    self.record('flushdb')
+    self.data.clear()
+    self.expires.clear()
+
+  def scan_iter(self, match=None, count=None):
+    self.record('scan')
+    regex = None if match is None else glob_to_regex(match)
+    for key in list(self.data):
+      if self.alive(key) and (regex is None or regex.fullmatch(key)):
+        yield key
+
+  def hash(self, key, create=False):
+    if not self.alive(key):
+      if not create:
+        return dict()
+      self.data[to_bytes(key)] = dict()
+    return self.data[to_bytes(key)]
+
+  def hget(self, key, field):
+    self.record('hget')
+    return self.hash(key).get(to_bytes(field))
+
+  def hexists(self, key, field):
+    self.record('hexists')
+    return to_bytes(field) in self.hash(key)
+
+  def hset(self, key, field, value):
+    self.record('hset')
+    fields = self.hash(key, create=True)
+    added = to_bytes(field) not in fields
+    fields[to_bytes(field)] = to_bytes(value)
+    return int(added)
+
+  def hsetnx(self, key, field, value):
+    self.record('hsetnx')
+    fields = self.hash(key, create=True)
+    if to_bytes(field) in fields:
+      return 0
+    fields[to_bytes(field)] = to_bytes(value)
+    return 1
+
+  def hdel(self, key, *fields):
+    self.record('hdel')
+    hash_fields = self.hash(key)
+    deleted = sum(hash_fields.pop(to_bytes(field), None) is not None for field in fields)
+    if self.alive(key) and not hash_fields:
+      self.unlink(key)
+    return deleted
+
+  def hscan_iter(self, key, count=None):
+    self.record('hscan')
+    yield from list(self.hash(key).items())
+
+  def pipeline(self, transaction=True):
+    return Pipeline(self)
+
+  def pubsub(self, ignore_subscribe_messages=False):
+    pubsub = PubSub(ignore_subscribe_messages)
+    self.pubsubs.append(pubsub)
+    return pubsub
+
+  def publish(self, channel, message):
+    self.record('publish')
+    receivers = [pubsub for pubsub in self.pubsubs if to_bytes(channel) in pubsub.channels]
+    for pubsub in receivers:
+      pubsub.messages.append(
+          {'type': 'message', 'channel': to_bytes(channel), 'data': to_bytes(message)})
+    return len(receivers)
+
+
+class PubSub:
+  """Subscribing again, as redis-py does on reconnect, is confirmed again."""
+  def __init__(self, ignore_subscribe_messages=False):
+    self.ignore_subscribe_messages = ignore_subscribe_messages
+    self.channels = set()
+    self.messages = []
+
+  def subscribe(self, *channels):
+    for channel in channels:
+      self.channels.add(to_bytes(channel))
+      if not self.ignore_subscribe_messages:
+        self.messages.append(
+            {'type': 'subscribe', 'channel': to_bytes(channel), 'data': len(self.channels)})
+
+  def get_message(self):
+    return self.messages.pop(0) if self.messages else None
+
+
+class Pipeline:
+  def __init__(self, client):
+    self.client = client
+    self.commands = []
+
+  def __getattr__(self, name):
+    def queue(*args, **kwargs):
+      self.commands.append((name, args, kwargs))
+      return self
+    return queue
+
+  def execute(self):
+    commands, self.commands = self.commands, []
+    return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in commands]
@@ -1,4 +1,11 @@
+import json
 import os
+from http import HTTPStatus
+
+
+url_token = '/api/v1_0/token/'
+
+me = dict(name='test001', email='test001@test.com', password='testtest', role_id=1)
 
 
 def join_url(base_url, tail_url):
@@ -8,3 +15,11 @@ def join_url(base_url, tail_url):
 
 def bearer_token(token):
   return {'Authorization': f'Bearer {token}'}
+
+
+def login(client, headers, user=me):
+  """Return (access_token, refresh_token) issued to user."""
+  data = dict(email=user['email'], password=user['password'])
+  ret = client.post(url_token, data=json.dumps(data), headers=headers)
+  assert ret.status_code == HTTPStatus.OK
+  return ret.json['access_token'], ret.json['refresh_token']
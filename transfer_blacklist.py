@@ -0,0 +1,302 @@
+"""
+Export blacklist to a file, or import it from a file, so that revoked tokens
+survive a change of BLACKLIST_STORAGE_TYPE or of redis nodes.
+Entries keep the time at which they expire, and expired ones are skipped.
+Both read and write a batch at a time, so memory doesn't grow with blacklist.
+
+$ FLASK_ENV=<mode> python transfer_blacklist.py export <file> [--format ndjson|binary]
+$ FLASK_ENV=<mode> python transfer_blacklist.py import <file> [--batch-size N]
+
+--storage-type overrides BLACKLIST_STORAGE_TYPE of the mode, e.g. to export
+memory storage of MEMORY_STORAGE_PATH while the server is stopped.
+With GUNICORN_WORKERS > 1, memory storage of every worker is exported.
+shared_memory keeps UUID as 16 bytes, which are exported as binary jti,
+but can't list generations, so it's refused with BLACKLIST_GENERATION_ENABLED.
+
+ndjson
+======
+The first line is the header, and each of the other lines is an entry
+{"jti": ..., "revoked": ..., "expires_at": ...} or a generation
+{"identity": ..., "generation": ...}. Binary jti is in "jti_hex" instead.
+
+binary
+======
+MAGIC + length of header(uint32) + header in JSON, followed by records of
+the format of the log of MemoryStorage(see app.auth.journal), i.e. SET for
+entries and GENERATION for generations.
+"""
+import argparse
+import json
+import struct
+import sys
+import time
+import uuid
+
+from app import create_app
+from app.auth import journal
+from app.auth.blacklist import Blacklist, MemoryStorage, RedisBucketStorage, blacklist
+from app.models import db
+
+
+MAGIC = b'BLKEXP01'
+HEADER_LENGTH = struct.Struct('<I')
+
+app = create_app()
+app.app_context().push()
+
+
+def open_blacklist(storage_type):
+  """
+  Storage is used directly, bypassing cache, filter and broadcast of
+  blacklist, which workers of the server don't see anyway.
+  """
+  if storage_type is None or storage_type == blacklist.storage_type:
+    return blacklist
+
+  app.config['BLACKLIST_STORAGE_TYPE'] = storage_type
+  app.config['BLACKLIST_CACHE_ENABLED'] = False
+  app.config['BLACKLIST_FILTER_ENABLED'] = False
+  other = Blacklist()
+  other.init_app(app)
+  return other
+
+
+def make_header(source):
+  return {
+    'version': 2,
+    'storage_type': source.storage_type,
+    'layout': 'bucket' if isinstance(source.storage, RedisBucketStorage) else 'key',
+    'exported_at': time.time(),
+  }
+
+
+class NdjsonWriter:
+  def __init__(self, f, header):
+    self.f = f
+    self.f.write(json.dumps(header).encode() + b'\n')
+
+  def entry(self, jti, revoked, expires_at):
+    if isinstance(jti, bytes):
+      record = {'jti_hex': jti.hex(), 'revoked': revoked, 'expires_at': expires_at}
+    else:
+      record = {'jti': jti, 'revoked': revoked, 'expires_at': expires_at}
+    self.f.write(json.dumps(record).encode() + b'\n')
+
+  def generation(self, identity, generation):
+    record = {'identity': identity, 'generation': generation}
+    self.f.write(json.dumps(record).encode() + b'\n')
+
+
+class BinaryWriter:
+  def __init__(self, f, header):
+    self.f = f
+    header = json.dumps(header).encode()
+    self.f.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+
+  def entry(self, jti, revoked, expires_at):
+    self.write(journal.SET, jti, journal.REVOKED if revoked else 0, expires_at)
+
+  def generation(self, identity, generation):
+    self.write(journal.GENERATION, identity, 0, generation)
+
+  def write(self, op, key, flags, value):
+    if isinstance(key, bytes):
+      flags |= journal.BYTES_KEY
+    else:
+      key = key.encode()
+    self.f.write(journal.RECORD.pack(op, flags, len(key), value) + key)
+
+
+def read_ndjson(f):
+  """
+  Return header and iterator of records, which are ('entry', (jti, revoked,
+  expires_at)) or ('generation', (identity, generation)).
+  """
+  header = json.loads(f.readline())
+  def records():
+    for line in f:
+      record = json.loads(line)
+      if 'identity' in record:
+        yield 'generation', (record['identity'], record['generation'])
+      else:
+        jti = record['jti'] if 'jti' in record else bytes.fromhex(record['jti_hex'])
+        yield 'entry', (jti, record['revoked'], record['expires_at'])
+  return header, records()
+
+
+def read_binary(f):
+  if f.read(len(MAGIC)) != MAGIC:
+    raise ValueError('File is not a blacklist export.')
+  length, = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+  header = json.loads(f.read(length))
+  def records():
+    while True:
+      data = f.read(journal.RECORD.size)
+      if len(data) < journal.RECORD.size:
+        return
+      op, flags, length, value = journal.RECORD.unpack(data)
+      key = f.read(length)
+      key = key if flags & journal.BYTES_KEY else key.decode()
+      if op == journal.GENERATION:
+        yield 'generation', (key, int(value))
+      else:
+        yield 'entry', (key, bool(flags & journal.REVOKED), value)
+  return header, records()
+
+
+def memory_storages(source):
+  """
+  With GUNICORN_WORKERS > 1, each worker keeps its own memory storage in
+  journal of MEMORY_STORAGE_PATH.{n}, and source has opened only one of them.
+  Return storages of all of them.
+  """
+  path = app.config.get('MEMORY_STORAGE_PATH')
+  workers = int(app.config.get('GUNICORN_WORKERS', 1))
+  if path is None or workers <= 1:
+    return [source.storage]
+
+  storages = [source.storage]
+  app.config['GUNICORN_WORKERS'] = 1
+  for n in range(workers):
+    if f'{path}.{n}.log' == source.storage.journal.log_path:
+      continue
+    app.config['MEMORY_STORAGE_PATH'] = f'{path}.{n}'
+    storage = MemoryStorage()
+    storage.init_app(app)
+    storages.append(storage)
+  return storages
+
+
+def scan_entries(storages):
+  """
+  The same jti may be in storages of several workers. Revoked entries of all
+  of them come first, since import keeps the first entry of each jti.
+  """
+  if len(storages) == 1:
+    yield from storages[0].scan()
+    return
+  for revoked in [True, False]:
+    for storage in storages:
+      for entry in storage.scan():
+        if entry[1] == revoked:
+          yield entry
+
+
+def scan_generations(storages):
+  """Generation of identity bumped in several workers is the greatest of them."""
+  if len(storages) == 1:
+    yield from storages[0].scan_generations()
+    return
+  generations = dict()
+  for storage in storages:
+    for identity, generation in storage.scan_generations():
+      generations[identity] = max(generation, generations.get(identity, 0))
+  yield from generations.items()
+
+
+def export_blacklist(path, format, storage_type):
+  source = open_blacklist(storage_type)
+  if source.storage_type == 'shared_memory' and source.generation_enabled:
+    print("Generations of shared_memory can't be listed, so tokens of users "
+          'whose generation was bumped would be valid again after import.')
+    sys.exit(1)
+
+  storages = memory_storages(source) if source.storage_type == 'memory' else [source.storage]
+  writer_class = NdjsonWriter if format == 'ndjson' else BinaryWriter
+  entries = generations = 0
+  with open(path, 'wb') as f:
+    writer = writer_class(f, make_header(source))
+    for jti, revoked, expires_at in scan_entries(storages):
+      writer.entry(jti, revoked, expires_at)
+      entries += 1
+    for identity, generation in scan_generations(storages):
+      writer.generation(identity, generation)
+      generations += 1
+  print(f'{entries} tokens and {generations} generations are exported to {path} '
+        f'from {len(storages)} storages.')
+
+
+def to_target_jti(target, jti):
+  """
+  Convert jti between str and 16 bytes depending on BLACKLIST_BINARY_JTI of
+  target. shared_memory takes either. 16 bytes is a packed UUID, unless it's
+  the hash of a jti other than UUID exported from shared_memory, which then
+  never matches any token.
+  """
+  if target.binary_jti:
+    return target.to_key(jti)
+  if isinstance(jti, bytes) and target.storage_type != 'shared_memory':
+    return str(uuid.UUID(bytes=jti))
+  return jti
+
+
+def import_blacklist(path, batch_size, storage_type):
+  target = open_blacklist(storage_type)
+  with open(path, 'rb') as f:
+    is_binary = f.read(len(MAGIC)) == MAGIC
+    f.seek(0)
+    header, records = read_binary(f) if is_binary else read_ndjson(f)
+
+    if header['storage_type'] == 'shared_memory' and header['version'] < 2:
+      print('Tokens exported from shared_memory by version 1 are hashes of jtis, '
+            "which can't be found in any storage.")
+      sys.exit(1)
+    if isinstance(target.storage, RedisBucketStorage) and header['layout'] != 'bucket':
+      print(f"Tokens exported from {header['storage_type']} can't be found "
+            'in bucket layout of redis, since their exp is not known.')
+      sys.exit(1)
+
+    entries = []
+    generations = []
+    counts = {'entry': 0, 'generation': 0, 'expired': 0}
+    now = time.time()
+    for kind, record in records:
+      if kind == 'generation':
+        generations.append(record)
+      elif record[2] <= now:
+        counts['expired'] += 1
+        continue
+      else:
+        jti, revoked, expires_at = record
+        entries.append((to_target_jti(target, jti), revoked, expires_at))
+      counts[kind] += 1
+
+      if len(entries) >= batch_size:
+        target.storage.restore_many(entries)
+        entries = []
+        now = time.time()
+      if len(generations) >= batch_size:
+        target.storage.restore_generations(generations)
+        generations = []
+    target.storage.restore_many(entries)
+    target.storage.restore_generations(generations)
+
+  print(f"{counts['entry']} tokens and {counts['generation']} generations "
+        f"are imported from {path}. {counts['expired']} expired tokens are skipped.")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('command', choices=['export', 'import'])
+  parser.add_argument('path', help='File to export to, or import from.')
+  parser.add_argument(
+      '--format', choices=['ndjson', 'binary'], default='ndjson',
+      help='Format of exported file. Import finds it out from the file.')
+  parser.add_argument(
+      '--batch-size', type=int, default=1000,
+      help='Number of entries written to storage at once on import.')
+  parser.add_argument(
+      '--storage-type', default=None,
+      help='BLACKLIST_STORAGE_TYPE used instead of the one of the mode.')
+  args = parser.parse_args()
+
+  try:
+    if args.command == 'export':
+      export_blacklist(args.path, args.format, args.storage_type)
+    else:
+      import_blacklist(args.path, args.batch_size, args.storage_type)
+  except Exception as e:
+    print(f'Error occurred. {type(e)}: {str(e)}\nExecute rollback.')
+    db.session.rollback()
+    print('Rollback done.')
+    sys.exit(1)